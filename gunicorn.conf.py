@@ -0,0 +1,103 @@
+"""
+gunicorn settings: gunicorn -c gunicorn.conf.py
+
+The app is loaded once in the master and the workers are forked from it, so
+the imported code, the warmed up caches and the catalog snapshot are shared
+copy-on-write. Everything is set through the environment:
+
+GUNICORN_PROFILE       sync (default), gthread or uvicorn (ASGI, online_shop.asgi)
+GUNICORN_WORKERS       default 2 * cpus + 1, cpus + 1 for gthread
+GUNICORN_THREADS       threads per gthread worker, default 4
+GUNICORN_MAX_REQUESTS  a worker is replaced after this many requests, plus up
+                       to GUNICORN_MAX_REQUESTS_JITTER so they do not restart together
+GUNICORN_METRICS_DIR   per worker memory and request metrics, one JSON file per
+                       worker (mainapp.process_metrics), unset turns them off
+"""
+
+import gc
+import multiprocessing
+import os
+import time
+from mainapp.process_metrics import WorkerMetrics
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'online_shop.settings_production')
+
+profile = os.environ.get('GUNICORN_PROFILE', 'sync')
+cpus = multiprocessing.cpu_count()
+PROFILES = {
+    'sync': {'worker_class': 'sync', 'threads': 1, 'workers': 2 * cpus + 1},
+    'gthread': {'worker_class': 'gthread', 'threads': int(os.environ.get('GUNICORN_THREADS', 4)),
+                'workers': cpus + 1},
+    'uvicorn': {'worker_class': 'uvicorn.workers.UvicornWorker', 'threads': 1, 'workers': 2 * cpus + 1},
+}
+if profile not in PROFILES:
+    raise RuntimeError(f'GUNICORN_PROFILE must be one of {", ".join(PROFILES)}, not {profile}')
+
+wsgi_app = 'online_shop.asgi:application' if profile == 'uvicorn' else 'online_shop.wsgi:application'
+worker_class = PROFILES[profile]['worker_class']
+threads = PROFILES[profile]['threads']
+workers = int(os.environ.get('GUNICORN_WORKERS', PROFILES[profile]['workers']))
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+preload_app = True
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+# the worker heartbeat files in memory instead of a disk backed /tmp
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+metrics_dir = os.environ.get('GUNICORN_METRICS_DIR')
+
+
+def when_ready(server):
+    # the objects of the preloaded app are never freed, moving them out of the
+    # collector keeps its reference count updates from copying their pages
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from django.db import connections
+    # no connection may be shared with the master, the app opens none on purpose
+    connections.close_all()
+    worker.metrics = WorkerMetrics(metrics_dir, worker.pid) if metrics_dir else None
+    if worker.metrics:
+        worker.metrics.flush()
+
+
+def pre_request(worker, req):
+    req.started = time.perf_counter()
+
+
+def post_request(worker, req, environ, resp):
+    # not called by the uvicorn worker, its file only has the memory
+    if worker.metrics and hasattr(req, 'started'):
+        worker.metrics.request_finished(time.perf_counter() - req.started, resp.status_code or 0)
+
+
+def worker_exit(server, worker):
+    # the counters of the worker are folded into metrics-exited.json on the next scrape,
+    # its query statistics into queries-exited.json by child_exit
+    from mainapp.metrics import registry
+    from mainapp.query_stats import query_stats
+    registry.flush(exited=True)
+    query_stats.flush(exited=True)
+    metrics = getattr(worker, 'metrics', None)
+    if metrics:
+        snapshot = metrics.snapshot()
+        server.log.info('worker %s exits after %s requests, rss %s bytes', worker.pid,
+                        snapshot['requests'], snapshot['memory'].get('rss', snapshot['memory'].get('max_rss')))
+        metrics.remove()
+
+
+def child_exit(server, worker):
+    # called in the master, also for killed workers that could not flush or remove their file
+    from django.conf import settings
+    from mainapp.query_stats import fold_exited
+    if metrics_dir:
+        WorkerMetrics(metrics_dir, worker.pid).remove()
+    if settings.METRICS_DIR:
+        fold_exited(settings.METRICS_DIR)
@@ -1,5 +1,7 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from mainapp.models import Collection, Product, Customer, Cart, CartItem, Order, OrderItem
+from mainapp.order_status import bulk_update_payment_status
+from mainapp.pagination import EstimatedCountPaginator
 
 
 @admin.register(Product)
@@ -9,7 +11,9 @@ class ProductAdmin(admin.ModelAdmin):
     list_editable = ['unit_price']
     list_per_page = 10
     list_select_related = ['collection']
+    paginator = EstimatedCountPaginator
     search_fields = ['title']
+    show_full_result_count = False
 
 
 @admin.register(Collection)
@@ -17,6 +21,7 @@ class CollectionAdmin(admin.ModelAdmin):
     autocomplete_fields = ['featured_product']
     list_display = ['title']
     search_fields = ['title']
+    show_full_result_count = False
 
 
 @admin.register(Customer)
@@ -24,26 +29,77 @@ class CustomerAdmin(admin.ModelAdmin):
     list_display = ['first_name', 'last_name']
     list_per_page = 5
     ordering = ['first_name', 'last_name']
-    search_fields = ['first_name__istartswith', 'last_name__istartswith']
+    paginator = EstimatedCountPaginator
+    search_fields = ['search_phone', 'search_email',
+                     'search_first_name', 'search_last_name']
+    search_help_text = 'Телефон, email или начало имени и фамилии'
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        return queryset.search(search_term), False
 
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
+    actions = ['mark_complete', 'mark_failed', 'mark_pending']
     list_display = ['id', 'placed_at', 'customer', 'payment_status']
     list_editable = ['payment_status']
+    list_select_related = ['customer']
+    paginator = EstimatedCountPaginator
+    raw_id_fields = ['customer']
+    show_full_result_count = False
+
+    def update_payment_status(self, request, queryset, payment_status):
+        order_ids = queryset.values_list('id', flat=True)
+        report = bulk_update_payment_status(
+            [{'order_id': order_id, 'payment_status': payment_status} for order_id in order_ids])
+        self.message_user(
+            request, f'Обновлено заказов: {report["updated"]}, без изменений: {report["unchanged"]}',
+            messages.SUCCESS)
+
+    @admin.action(description='Отметить как оплаченные')
+    def mark_complete(self, request, queryset):
+        self.update_payment_status(request, queryset, Order.PAYMENT_STATUS_COMPLETE)
+
+    @admin.action(description='Отметить как неудачные')
+    def mark_failed(self, request, queryset):
+        self.update_payment_status(request, queryset, Order.PAYMENT_STATUS_FAILED)
+
+    @admin.action(description='Отметить как ожидающие оплаты')
+    def mark_pending(self, request, queryset):
+        self.update_payment_status(request, queryset, Order.PAYMENT_STATUS_PENDING)
+
+
+'''order and cart items render the product title per row,
+so the product is joined without its description'''
 
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['product', 'quantity']
+    list_select_related = ['product']
+    paginator = EstimatedCountPaginator
+    raw_id_fields = ['order', 'product']
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('product__description')
 
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
     list_display = ['created_at']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ['product', 'quantity']
+    list_select_related = ['product']
+    paginator = EstimatedCountPaginator
+    raw_id_fields = ['cart', 'product']
+    show_full_result_count = False
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('product__description')
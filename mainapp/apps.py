@@ -6,4 +6,17 @@ class MainappConfig(AppConfig):
     name = 'mainapp'
 
     def ready(self):
-        import mainapp.signals
\ No newline at end of file
+        import mainapp.signals
+        import mainapp.tasks
+        from django.conf import settings
+        from django.core.exceptions import ImproperlyConfigured
+        from mainapp.authentication import check_revocation_cache
+        from mainapp.catalog import load_snapshot
+        # a worker must not start with token revocations only it can see
+        if not settings.DEBUG:
+            for error in check_revocation_cache(None):
+                raise ImproperlyConfigured(f'{error.msg}. {error.hint}')
+        load_snapshot()
+        if settings.WARM_UP_ON_READY:
+            from mainapp.warmup import warm_up
+            warm_up()
@@ -0,0 +1,59 @@
+from datetime import timedelta
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from mainapp.models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+
+ARCHIVABLE_STATUSES = [Order.PAYMENT_STATUS_COMPLETE, Order.PAYMENT_STATUS_FAILED]
+
+
+def archive_orders(months, batch_size=1000, progress=None):
+    '''moves complete and failed orders placed more than `months` months (30 days)
+    ago, together with their items, into the archive tables. Every batch is copied
+    and deleted in its own transaction, so the hot tables are never locked for long.
+    Returns the number of archived orders and order items'''
+    cutoff = timezone.now() - timedelta(days=30 * months)
+    archived_orders = archived_items = 0
+
+    while True:
+        with transaction.atomic():
+            orders = list(Order.objects.select_for_update(skip_locked=True)
+                          .filter(placed_at__lt=cutoff, payment_status__in=ARCHIVABLE_STATUSES)
+                          .order_by('placed_at')[:batch_size])
+            if not orders:
+                break
+            order_ids = [order.id for order in orders]
+            items = list(OrderItem.objects.filter(order_id__in=order_ids))
+
+            ArchivedOrder.objects.bulk_create([ArchivedOrder(
+                id=order.id, placed_at=order.placed_at, payment_status=order.payment_status,
+                customer_id=order.customer_id) for order in orders])
+            ArchivedOrderItem.objects.bulk_create([ArchivedOrderItem(
+                id=item.id, order_id=item.order_id, product_id=item.product_id,
+                quantity=item.quantity, unit_price=item.unit_price) for item in items])
+
+            # raw deletes send no post_delete, the archived orders stay in the customer summaries
+            OrderItem.objects.filter(order_id__in=order_ids)._raw_delete(OrderItem.objects.db)
+            Order.objects.filter(pk__in=order_ids)._raw_delete(Order.objects.db)
+
+        archived_orders += len(orders)
+        archived_items += len(items)
+        if progress:
+            progress(archived_orders, archived_items)
+
+    return archived_orders, archived_items
+
+
+def table_size(table):
+    '''size of a table with its indexes in bytes, None when the database cannot tell'''
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_total_relation_size(%s)', [table])
+            return cursor.fetchone()[0]
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = %s', [table])
+            except DatabaseError:
+                return None
+            return cursor.fetchone()[0] or 0
+    return None
@@ -0,0 +1,161 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import jwt
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import checks
+from django.core.cache import caches
+from django.utils.functional import cached_property
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+
+'''stateless authentication with signed access tokens.
+
+A token carries user_id, is_staff and customer_id, so permission checks and
+the customer of the request need no database query. Tokens are signed with
+the JWT_ACTIVE_KEY_ID key of JWT_SIGNING_KEYS and name it in the kid header.
+Every key of JWT_SIGNING_KEYS is accepted, so a key is rotated by adding the
+new one, making it active and removing the old one once the tokens signed
+with it have expired. Values are secrets for the HS algorithms and dicts with
+a private and a public PEM key for the asymmetric ones'''
+
+REVOKED_PREFIX = 'jwt-revoked:'
+# backends whose entries only this process sees, a revocation stored there is missed by the other workers
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',
+                        'django.core.cache.backends.dummy.DummyCache')
+
+
+def signing_key(kid):
+    key = settings.JWT_SIGNING_KEYS[kid]
+    return key['private'] if isinstance(key, dict) else key
+
+
+def verifying_key(kid):
+    key = settings.JWT_SIGNING_KEYS.get(kid)
+    return key['public'] if isinstance(key, dict) else key
+
+
+def issue_token(user, customer_id=None):
+    now = int(time.time())
+    claims = {
+        'user_id': user.pk,
+        'is_staff': user.is_staff,
+        'customer_id': customer_id,
+        'iat': now,
+        'exp': now + settings.JWT_ACCESS_TOKEN_LIFETIME,
+        'jti': uuid.uuid4().hex,
+    }
+    kid = settings.JWT_ACTIVE_KEY_ID
+    return jwt.encode(claims, signing_key(kid), algorithm=settings.JWT_ALGORITHM, headers={'kid': kid})
+
+
+def decode_token(token):
+    try:
+        kid = jwt.get_unverified_header(token).get('kid')
+        key = verifying_key(kid)
+        if key is None:
+            raise exceptions.AuthenticationFailed('Токен подписан неизвестным ключом')
+        return jwt.decode(token, key, algorithms=[settings.JWT_ALGORITHM],
+                          options={'require': ['exp', 'iat', 'jti', 'user_id']})
+    except jwt.ExpiredSignatureError:
+        raise exceptions.AuthenticationFailed('Срок действия токена истек')
+    except jwt.InvalidTokenError:
+        raise exceptions.AuthenticationFailed('Недействительный токен')
+
+
+class RevocationCache:
+    '''ids of revoked tokens, kept in the JWT_REVOCATION_CACHE_ALIAS cache until
+    the tokens expire. It has to be shared by the workers, see check_revocation_cache.
+    Revocations seen by this worker are also kept in a bounded local map,
+    a token found there is rejected without a round trip'''
+
+    def __init__(self, size):
+        self.size = size
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+
+    def remember(self, jti, expires_at):
+        with self.lock:
+            self.local[jti] = expires_at
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+    @property
+    def shared(self):
+        return caches[settings.JWT_REVOCATION_CACHE_ALIAS]
+
+    def revoke(self, jti, expires_at):
+        self.shared.set(REVOKED_PREFIX + jti, True, max(1, int(expires_at - time.time())))
+        self.remember(jti, expires_at)
+
+    def is_revoked(self, jti, expires_at):
+        if jti in self.local:
+            return True
+        if self.shared.get(REVOKED_PREFIX + jti):
+            self.remember(jti, expires_at)
+            return True
+        return False
+
+    def clear(self):
+        with self.lock:
+            self.local.clear()
+
+
+revocations = RevocationCache(settings.JWT_REVOCATION_CACHE_SIZE)
+
+
+@checks.register(checks.Tags.security, deploy=True)
+def check_revocation_cache(app_configs, **kwargs):
+    '''manage.py check --deploy, and MainappConfig.ready when not DEBUG'''
+    backend = settings.CACHES[settings.JWT_REVOCATION_CACHE_ALIAS]['BACKEND']
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [checks.Error(
+        f'JWT_REVOCATION_CACHE_ALIAS uses the process-local cache backend {backend}',
+        hint='Revoked tokens would still be accepted by the other workers. '
+             'Set REDIS_URL or point JWT_REVOCATION_CACHE_ALIAS at a shared cache.',
+        id='mainapp.E001')]
+
+
+class TokenUser:
+    '''request.user of a token request, built from the claims without a query'''
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+    is_superuser = False
+
+    def __init__(self, claims):
+        self.id = self.pk = claims['user_id']
+        self.is_staff = bool(claims.get('is_staff'))
+        self.customer_id = claims.get('customer_id')
+
+    def __str__(self):
+        return f'user {self.id}'
+
+    '''the database row for the rare code that needs more than the claims'''
+
+    @cached_property
+    def user(self):
+        return get_user_model().objects.get(pk=self.id)
+
+
+class JWTAuthentication(BaseAuthentication):
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        header = get_authorization_header(request).split()
+        if not header or header[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(header) != 2:
+            raise exceptions.AuthenticationFailed('Неверный заголовок Authorization')
+
+        claims = decode_token(header[1].decode('latin-1'))
+        if revocations.is_revoked(claims['jti'], claims['exp']):
+            raise exceptions.AuthenticationFailed('Токен отозван')
+        return TokenUser(claims), claims
+
+    def authenticate_header(self, request):
+        return f'{self.keyword} realm="api"'
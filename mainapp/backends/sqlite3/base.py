@@ -0,0 +1,39 @@
+from django.db.backends.sqlite3 import base
+
+
+'''the sqlite3 backend tuned for several workers on one database file.
+
+WAL lets readers run next to the writer, busy_timeout makes a writer wait for
+the lock instead of failing, and transactions start with BEGIN IMMEDIATE: a
+transaction that reads first and writes later takes the write lock up front,
+it can not fail with "database is locked" when it upgrades its read lock.
+Every atomic block takes the write lock, reads outside of them do not.
+PRAGMAS are applied to each new connection, OPTIONS['pragmas'] overrides them'''
+
+PRAGMAS = {
+    # first, switching to WAL needs the lock
+    'busy_timeout': 5000,
+    'journal_mode': 'WAL',
+    # durable at checkpoints instead of every commit, WAL keeps the file consistent
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # negative values are KiB
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = {**PRAGMAS, **params.pop('pragmas', {})}
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -0,0 +1,288 @@
+import hashlib
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from urllib.parse import urlencode
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from mainapp.metrics import registry
+
+
+'''two tier cache for hot read endpoints.
+
+Values are looked up in a bounded in-process LRU, then in the shared cache
+(redis through django-redis in production) and only then recomputed. A
+recomputation runs once per key: one thread per worker (single-flight) and one
+worker per key (a lock key added to the shared cache), the others get the
+stale value when there is one or wait for the result. Entries are recomputed a
+bit before they expire with a probability that grows as expiry gets closer
+(probabilistic early expiration, beta scales how early), so a hot key is
+refreshed by one request instead of expiring under all of them.
+
+Every entry records the versions of its tags. Invalidating a tag replaces its
+version, entries written with an older version are misses from then on. The
+local tier of the invalidating worker is cleared at once, other workers drop
+their local copies within APP_CACHE_LOCAL_TTL seconds'''
+
+TAG_PREFIX = 'cache-tag:'
+LOCK_PREFIX = 'cache-lock:'
+
+
+class Entry:
+    __slots__ = ('value', 'expires_at', 'delta', 'tags')
+
+    def __init__(self, value, expires_at, delta, tags):
+        self.value = value
+        self.expires_at = expires_at
+        # seconds the recomputation took, early expiration starts earlier for slow values
+        self.delta = delta
+        self.tags = tags
+
+
+class LocalCache:
+    '''bounded LRU of entries, each kept at most ttl seconds'''
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, now):
+        with self.lock:
+            found = self.entries.get(key)
+            if found is None:
+                return None
+            entry, local_expires_at = found
+            if local_expires_at <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, now):
+        with self.lock:
+            self.entries[key] = (entry, min(entry.expires_at, now + self.ttl))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_tagged(self, tag_keys):
+        with self.lock:
+            for key in [key for key, (entry, _) in self.entries.items()
+                        if not tag_keys.isdisjoint(entry.tags)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class Flight:
+    '''a recomputation in progress in this worker, other threads wait for its result'''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class CacheMetrics:
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def snapshot(self):
+        with self.lock:
+            counts = dict(self.counts)
+        stats = {}
+        for tier in ('local', 'remote'):
+            hits, misses = counts.get(f'{tier}_hits', 0), counts.get(f'{tier}_misses', 0)
+            stats[tier] = {'hits': hits, 'misses': misses,
+                           'hit_ratio': hits / (hits + misses) if hits + misses else None}
+        for name in ('recomputes', 'early_recomputes', 'stale_served', 'waits'):
+            stats[name] = counts.get(name, 0)
+        return stats
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+
+class TieredCache:
+    def __init__(self, remote=None, local_size=1024, local_ttl=2, lock_timeout=10, beta=1.0,
+                 clock=time.time, random=random.random, sleep=time.sleep):
+        self._remote = remote
+        self.local = LocalCache(local_size, local_ttl)
+        self.lock_timeout = lock_timeout
+        self.beta = beta
+        self.clock = clock
+        self.random = random
+        self.sleep = sleep
+        self.metrics = CacheMetrics()
+        self.flights = {}
+        self.flights_lock = threading.Lock()
+
+    @property
+    def remote(self):
+        if self._remote is None:
+            self._remote = caches[settings.APP_CACHE_ALIAS]
+        return self._remote
+
+    def get_or_set(self, key, compute, timeout, tags=()):
+        '''value of key, compute() is called to produce it on a miss.
+        timeout is in seconds, tags are names passed to invalidate_tags'''
+        now = self.clock()
+        entry = self.local.get(key, now)
+        if entry is not None and not self.refresh_early(entry, now):
+            self.metrics.count('local_hits')
+            return entry.value
+        self.metrics.count('local_misses')
+
+        tag_keys = [TAG_PREFIX + tag for tag in tags]
+        found = self.remote.get_many([key, *tag_keys])
+        versions = self.tag_versions(tag_keys, found)
+        entry = found.get(key)
+        if entry is not None and (entry.tags != versions or entry.expires_at <= now):
+            entry = None
+        if entry is not None and not self.refresh_early(entry, now):
+            self.metrics.count('remote_hits')
+            self.local.set(key, entry, now)
+            return entry.value
+        self.metrics.count('remote_misses')
+        return self.recompute(key, compute, timeout, versions, stale=entry)
+
+    def refresh_early(self, entry, now):
+        # 1 - random() is in (0, 1], its log is <= 0, see the module docstring
+        return now - entry.delta * self.beta * math.log(1 - self.random()) >= entry.expires_at
+
+    def tag_versions(self, tag_keys, found):
+        '''current versions of the tags, a tag evicted from the shared cache gets
+        a new version so that entries written before the eviction are not trusted'''
+        missing = {tag_key: uuid.uuid4().hex for tag_key in tag_keys if tag_key not in found}
+        for tag_key, version in missing.items():
+            if not self.remote.add(tag_key, version, None):
+                missing[tag_key] = self.remote.get(tag_key)
+        return {tag_key: found.get(tag_key) or missing[tag_key] for tag_key in tag_keys}
+
+    def recompute(self, key, compute, timeout, versions, stale):
+        with self.flights_lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if not leader:
+            if stale is not None:
+                self.metrics.count('stale_served')
+                return stale.value
+            self.metrics.count('waits')
+            if flight.done.wait(self.lock_timeout) and flight.error is None:
+                return flight.value
+            return compute()
+
+        try:
+            flight.value = self.recompute_once(key, compute, timeout, versions, stale)
+            return flight.value
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            flight.done.set()
+            with self.flights_lock:
+                del self.flights[key]
+
+    def recompute_once(self, key, compute, timeout, versions, stale):
+        '''recomputes in the worker that adds the lock key, the others serve the
+        stale value or poll the shared cache until the lock times out'''
+        lock_key = LOCK_PREFIX + key
+        if not self.remote.add(lock_key, 1, self.lock_timeout):
+            if stale is not None:
+                self.metrics.count('stale_served')
+                return stale.value
+            self.metrics.count('waits')
+            deadline = self.clock() + self.lock_timeout
+            while self.clock() < deadline:
+                self.sleep(0.05)
+                entry = self.remote.get(key)
+                if entry is not None and entry.tags == versions and entry.expires_at > self.clock():
+                    self.local.set(key, entry, self.clock())
+                    return entry.value
+            self.metrics.count('recomputes')
+            return self.store(key, compute, timeout, versions)
+        try:
+            # a valid stale entry means that early expiration triggered the recomputation
+            self.metrics.count('recomputes' if stale is None else 'early_recomputes')
+            return self.store(key, compute, timeout, versions)
+        finally:
+            self.remote.delete(lock_key)
+
+    def store(self, key, compute, timeout, versions):
+        started = self.clock()
+        value = compute()
+        now = self.clock()
+        entry = Entry(value, now + timeout, now - started, versions)
+        self.remote.set(key, entry, timeout)
+        self.local.set(key, entry, now)
+        return value
+
+    def delete(self, key):
+        self.local.delete(key)
+        self.remote.delete(key)
+
+    def invalidate_tags(self, *tags):
+        tag_keys = {TAG_PREFIX + tag for tag in tags}
+        self.remote.set_many({tag_key: uuid.uuid4().hex for tag_key in tag_keys}, None)
+        self.local.delete_tagged(tag_keys)
+
+    def stats(self):
+        return self.metrics.snapshot()
+
+
+def cache_key(prefix, query_params):
+    '''key of a read endpoint response, independent of the parameter order'''
+    params = sorted((name, value) for name, values in query_params.lists() for value in values)
+    return f'{prefix}:{hashlib.md5(urlencode(params).encode()).hexdigest()}'
+
+
+app_cache = TieredCache(
+    local_size=settings.APP_CACHE_LOCAL_SIZE, local_ttl=settings.APP_CACHE_LOCAL_TTL,
+    lock_timeout=settings.APP_CACHE_LOCK_TIMEOUT, beta=settings.APP_CACHE_BETA)
+
+
+def invalidate_on_commit(*tags, using=None):
+    '''invalidates the tags once the transaction commits. Invalidated earlier, a
+    concurrent request could cache the rows still committed before the change
+    and serve them for the whole timeout'''
+    transaction.on_commit(lambda: app_cache.invalidate_tags(*tags), using=using)
+
+
+@registry.collector
+def collect_app_cache():
+    stats = app_cache.stats()
+    tiers = ('local', 'remote')
+    return {
+        'app_cache_lookups_total': {
+            'type': 'counter', 'help': 'app_cache lookups per tier and result',
+            'samples': [[{'tier': tier, 'result': result}, stats[tier][count]]
+                        for tier in tiers for result, count in (('hit', 'hits'), ('miss', 'misses'))]},
+        'app_cache_hit_ratio': {
+            'type': 'gauge', 'help': 'Share of the app_cache lookups of the tier that were hits',
+            'samples': [[{'tier': tier}, stats[tier]['hit_ratio']] for tier in tiers
+                        if stats[tier]['hit_ratio'] is not None]},
+        'app_cache_events_total': {
+            'type': 'counter', 'help': 'app_cache recomputations, stale values served and waits for a recomputation',
+            'samples': [[{'event': event}, stats[event]]
+                        for event in ('recomputes', 'early_recomputes', 'stale_served', 'waits')]},
+    }
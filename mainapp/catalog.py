@@ -0,0 +1,424 @@
+import fcntl
+import heapq
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from operator import itemgetter
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from mainapp.models import Product, ProductChange
+
+
+logger = logging.getLogger(__name__)
+
+'''compact read-only copy of the product catalog shared by all workers.
+
+The snapshot is a versioned binary file written by the build_catalog_snapshot
+command and memory-mapped by every worker, so the pages are shared through the
+page cache instead of being copied into each process. Layout (little endian):
+
+    header   magic b'OSCS', format version (uint32), row count (uint64),
+             sequence (int64, the ProductChange id the build is current to)
+    columns  ids, unit prices in cents, collection ids, inventory,
+             row numbers ordered by price, all int64[count]
+    titles   utf-8 offsets int64[count + 1] followed by the utf-8 blob
+
+Rows are stored in the default product ordering (title, id). Product changes
+after the build are kept in a per worker overlay, filled by the Product signals
+of the worker itself and by polling the ProductChange log for inserts, updates
+and deletes made by the other workers. The products of the polled changes are
+loaded again, the ones that are gone are removed from the overlay.
+
+The log is polled by id. Ids are handed out when a row is inserted, not when its
+transaction commits, so a slow transaction can commit an id lower than one seen
+already: the skipped ids are polled again for CATALOG_CHANGE_GAP_TIMEOUT seconds.
+For the same reason a build is only current to the last change older than that,
+the later ones are polled again by the workers mapping the file. A build deletes
+the log up to its sequence, the workers then map the new file.
+
+A worker maps a file written by build_catalog_snapshot again on its next
+refresh, the overlay starts empty then. When the overlay outgrows
+CATALOG_SNAPSHOT_MAX_CHANGES (sync_stock changes every product it sells), the
+first worker to notice folds it into the base by building the file again'''
+
+MAGIC = b'OSCS'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sIQq')
+COLUMNS = ('ids', 'prices', 'collections', 'inventory', 'price_order')
+FIELDS = {'id', 'title', 'unit_price', 'inventory', 'collection'}
+# the values accepted by django-filter's BooleanWidget
+BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+
+class ProductRow:
+    __slots__ = ('id', 'title', 'price_cents', 'collection_id', 'inventory')
+
+    def __init__(self, id, title, price_cents, collection_id, inventory):
+        self.id = id
+        self.title = title
+        self.price_cents = price_cents
+        self.collection_id = collection_id
+        self.inventory = inventory
+
+    @classmethod
+    def from_product(cls, product):
+        return cls(product.id, product.title, int(product.unit_price * 100),
+                   product.collection_id, product.inventory)
+
+    @property
+    def unit_price(self):
+        return Decimal(self.price_cents) / 100
+
+    def serializable_value(self, field_name):
+        '''lets PrimaryKeyRelatedField read the collection id like on a model instance'''
+        if field_name == 'collection':
+            return self.collection_id
+        return getattr(self, field_name)
+
+
+def write_snapshot(path, rows, sequence):
+    '''writes rows (ProductRow) to path atomically through a temporary file'''
+    rows = sorted(rows, key=lambda row: (row.title, row.id))
+    columns = {
+        'ids': array('q', (row.id for row in rows)),
+        'prices': array('q', (row.price_cents for row in rows)),
+        'collections': array('q', (row.collection_id for row in rows)),
+        'inventory': array('q', (row.inventory for row in rows)),
+        'price_order': array('q', sorted(range(len(rows)),
+                                         key=lambda index: (rows[index].price_cents, rows[index].id))),
+    }
+    titles = [row.title.encode() for row in rows]
+    offsets = array('q', [0])
+    for title in titles:
+        offsets.append(offsets[-1] + len(title))
+
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(rows), sequence))
+        for name in COLUMNS:
+            file.write(columns[name].tobytes())
+        file.write(offsets.tobytes())
+        file.write(b''.join(titles))
+    os.replace(temporary, path)
+    return len(rows)
+
+
+def build_snapshot(path, wait=True):
+    '''writes the snapshot of the products table to path, one process at a time.
+    Returns the row count, or None without wait when another process is building'''
+    with open(f'{path}.lock', 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        return write_products(path)
+
+
+def write_products(path):
+    # taken before the products are read, the changes after it are polled again
+    settled = timezone.now() - timedelta(seconds=settings.CATALOG_CHANGE_GAP_TIMEOUT)
+    sequence = ProductChange.objects.filter(created_at__lt=settled)\
+        .order_by('-id').values_list('id', flat=True).first() or 0
+    queryset = Product.objects.order_by().values_list('id', 'title', 'unit_price', 'collection_id', 'inventory')
+    rows = [ProductRow(id, title, int(unit_price * 100), collection_id, inventory)
+            for id, title, unit_price, collection_id, inventory in queryset.iterator(chunk_size=10000)]
+    count = write_snapshot(path, rows, sequence)
+    ProductChange.objects.filter(id__lte=sequence).delete()
+    return count
+
+
+class CatalogSnapshot:
+    def __init__(self, path, refresh_interval=5):
+        self.path = path
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            self.file_id = (stat.st_ino, stat.st_mtime_ns)
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.sequence = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a catalog snapshot of version {FORMAT_VERSION}')
+
+        view = memoryview(self.buffer)
+        offset = HEADER.size
+        for name in COLUMNS:
+            setattr(self, name, view[offset:offset + 8 * self.count].cast('q'))
+            offset += 8 * self.count
+        self.title_offsets = view[offset:offset + 8 * (self.count + 1)].cast('q')
+        self.titles_start = offset + 8 * (self.count + 1)
+
+        self.changes = {}
+        # ids below the sequence not seen yet, polled again until their expiry (monotonic time)
+        self.gaps = {}
+        self.version = 0
+        self.overlay = (None, frozenset(), [], [])
+        self.refresh_interval = refresh_interval
+        self.checked_at = 0.0
+        self.lock = threading.RLock()
+        # numpy is imported with the first snapshot, workers without one never load it
+        from mainapp.filter_engine import create_engine
+        self.engine = create_engine(self)
+
+    def title(self, index):
+        start = self.titles_start + self.title_offsets[index]
+        end = self.titles_start + self.title_offsets[index + 1]
+        return self.buffer[start:end].decode()
+
+    def row(self, index):
+        return ProductRow(self.ids[index], self.title(index), self.prices[index],
+                          self.collections[index], self.inventory[index])
+
+    def set(self, product_id, row):
+        '''row (ProductRow) replaces the snapshot row of the product, None removes it'''
+        with self.lock:
+            self.changes[product_id] = row
+            self.version += 1
+
+    def apply(self, product):
+        self.set(product.id, ProductRow.from_product(product))
+
+    def remove(self, product_id):
+        self.set(product_id, None)
+
+    def get_changes(self):
+        with self.lock:
+            return self.version, dict(self.changes)
+
+    def is_outdated(self):
+        '''whether build_catalog_snapshot replaced the file since it was mapped'''
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) != self.file_id
+
+    def is_due(self):
+        return time.monotonic() - self.checked_at >= self.refresh_interval
+
+    def refresh(self, force=False):
+        '''loads products changed by any worker since the last check,
+        at most once per refresh interval. Returns whether it checked'''
+        if not force and not self.is_due():
+            return False
+        with self.lock:
+            now = self.checked_at = time.monotonic()
+            self.gaps = {id: expires for id, expires in self.gaps.items() if expires > now}
+            changes = list(ProductChange.objects.filter(Q(id__gt=self.sequence) | Q(id__in=list(self.gaps)))
+                           .values_list('id', 'product_id'))
+            seen = {id for id, _ in changes}
+            for id in seen:
+                self.gaps.pop(id, None)
+            latest = max(seen, default=self.sequence)
+            if latest > self.sequence:
+                expires = now + settings.CATALOG_CHANGE_GAP_TIMEOUT
+                self.gaps.update((id, expires) for id in range(self.sequence + 1, latest) if id not in seen)
+                self.sequence = latest
+            self.reload({product_id for _, product_id in changes})
+        return True
+
+    def reload(self, product_ids):
+        '''applies the current rows of the products, removes the deleted ones'''
+        product_ids = list(product_ids)
+        for start in range(0, len(product_ids), 500):
+            chunk = product_ids[start:start + 500]
+            found = set()
+            for product in Product.objects.filter(pk__in=chunk)\
+                    .only('id', 'title', 'unit_price', 'collection', 'inventory'):
+                self.apply(product)
+                found.add(product.id)
+            for product_id in set(chunk) - found:
+                self.remove(product_id)
+
+    def get_overlay(self):
+        '''(version, ids of the changed products, changed rows by title, by price),
+        sorted once per overlay version instead of on every query'''
+        overlay = self.overlay
+        if overlay[0] != self.version:
+            version, changes = self.get_changes()
+            rows = [row for row in changes.values() if row is not None]
+            overlay = self.overlay = (version, frozenset(changes),
+                                      sorted(rows, key=title_key), sorted(rows, key=price_key))
+        return overlay
+
+    def query(self, collection_ids=None, price_gt=None, price_lt=None, in_stock=None, ordering='title'):
+        '''returns the matching rows as a lazy ordered sequence, see SnapshotResult.
+        Evaluated by the vectorized filter engine when numpy is installed'''
+        if self.engine is not None:
+            return self.engine.query(collection_ids, price_gt, price_lt, in_stock, ordering)
+        _, changed_ids, by_title, by_price = self.get_overlay()
+        min_cents = None if price_gt is None else price_gt * 100
+        max_cents = None if price_lt is None else price_lt * 100
+        filtered = not (collection_ids is None and min_cents is None and max_cents is None and in_stock is None)
+
+        def matches(price_cents, row_collection_id, inventory):
+            return (collection_ids is None or row_collection_id in collection_ids) \
+                and (min_cents is None or price_cents > min_cents) \
+                and (max_cents is None or price_cents < max_cents) \
+                and (in_stock is None or (inventory > 0) == in_stock)
+
+        if ordering in ('unit_price', '-unit_price'):
+            order, changed, key = self.price_order, by_price, price_key
+        else:
+            order, changed, key = range(self.count), by_title, title_key
+        reverse = ordering == '-unit_price'
+        changed = [row for row in changed if matches(row.price_cents, row.collection_id, row.inventory)]
+
+        def entries():
+            base = (index for index in (reversed(order) if reverse else order)
+                    if self.ids[index] not in changed_ids and matches(
+                        self.prices[index], self.collections[index], self.inventory[index]))
+            if not changed:
+                return base
+            # base rows are not materialized, only their keys are needed for the merge
+            merged = heapq.merge(((key(BaseRow(self, index)), index) for index in base),
+                                 ((key(row), row) for row in (reversed(changed) if reverse else changed)),
+                                 key=itemgetter(0), reverse=reverse)
+            return (entry for _, entry in merged)
+
+        # without filters and overlay the count is known, otherwise counting scans the columns once
+        count = self.count if not (filtered or changed_ids) else None
+        return SnapshotResult(self, entries, count)
+
+
+def title_key(row):
+    return (row.title, row.id)
+
+
+def price_key(row):
+    return (row.price_cents, row.id)
+
+
+class BaseRow:
+    '''key access to a snapshot row without decoding the columns it does not need'''
+    __slots__ = ('snapshot', 'index')
+
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+
+    @property
+    def id(self):
+        return self.snapshot.ids[self.index]
+
+    @property
+    def title(self):
+        return self.snapshot.title(self.index)
+
+    @property
+    def price_cents(self):
+        return self.snapshot.prices[self.index]
+
+
+class SnapshotResult:
+    '''ordered query result over a generator of row references, rows are built
+    only for the slice that is read and nothing is kept of the rows before it,
+    so paginating it with django's Paginator materializes one page'''
+
+    def __init__(self, snapshot, entries, count=None):
+        self.snapshot = snapshot
+        self.entries = entries
+        self._count = count
+
+    def __len__(self):
+        return self.count()
+
+    def count(self):
+        if self._count is None:
+            self._count = sum(1 for _ in self.entries())
+        return self._count
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self.count()) \
+                if any(value is not None and value < 0 for value in (item.start, item.stop)) \
+                else (item.start, item.stop, item.step)
+            entries = list(islice(self.entries(), start, stop, step))
+        else:
+            index = item + self.count() if item < 0 else item
+            entries = list(islice(self.entries(), index, index + 1))
+            if not entries:
+                raise IndexError(item)
+        rows = [entry if isinstance(entry, ProductRow) else self.snapshot.row(entry)
+                for entry in entries]
+        return rows if isinstance(item, slice) else rows[0]
+
+
+_snapshot = None
+
+
+def load_snapshot(path=None):
+    global _snapshot
+    path = path or settings.CATALOG_SNAPSHOT_PATH
+    _snapshot = CatalogSnapshot(path, settings.CATALOG_SNAPSHOT_REFRESH_INTERVAL) \
+        if os.path.exists(path) else None
+    return _snapshot
+
+
+def unload_snapshot():
+    global _snapshot
+    _snapshot = None
+
+
+def get_snapshot():
+    return _snapshot
+
+
+def refresh_snapshot():
+    '''the snapshot to answer a request with, see the module docstring'''
+    snapshot = _snapshot
+    if snapshot is None or not snapshot.is_due():
+        return snapshot
+    # a rebuilt file is mapped before polling, the build deleted the log it covers
+    if snapshot.is_outdated():
+        snapshot = load_snapshot(snapshot.path)
+    snapshot.refresh(force=True)
+    if len(snapshot.changes) > settings.CATALOG_SNAPSHOT_MAX_CHANGES:
+        try:
+            build_snapshot(snapshot.path, wait=False)
+        except OSError as error:
+            # the overlay keeps answering, it only costs memory
+            logger.warning('could not rebuild the catalog snapshot %s: %s', snapshot.path, error)
+        if snapshot.is_outdated():
+            snapshot = load_snapshot(snapshot.path)
+            snapshot.refresh(force=True)
+    return snapshot
+
+
+def parse_params(query_params):
+    '''maps the ProductViewSet list parameters the snapshot can answer, returns
+    None for anything else (search, other filters, invalid values) so that the
+    request goes through the ORM and gets its usual validation'''
+    params = {}
+    for name, value in query_params.items():
+        try:
+            if name in ('collection_id', 'collection_id__in'):
+                collection_ids = {int(value)} if name == 'collection_id' \
+                    else {int(item) for item in value.split(',') if item}
+                if not collection_ids:
+                    return None
+                # both parameters together select their intersection, like the SQL filters
+                params['collection_ids'] = params.get('collection_ids', collection_ids) & collection_ids
+            elif name == 'in_stock':
+                in_stock = BOOLEANS.get(value.lower())
+                if in_stock is None:
+                    return None
+                params['in_stock'] = in_stock
+            elif name in ('unit_price__gt', 'unit_price__lt'):
+                price = Decimal(value)
+                if not price.is_finite():
+                    return None
+                params['price_gt' if name.endswith('gt') else 'price_lt'] = price
+            elif name == 'ordering' and value in ('unit_price', '-unit_price'):
+                params['ordering'] = value
+            elif name not in ('page', 'fields'):
+                return None
+        except (ValueError, InvalidOperation):
+            return None
+    return params
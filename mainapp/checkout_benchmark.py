@@ -0,0 +1,225 @@
+import multiprocessing
+import random
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal
+from functools import partial
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection, connections
+from django.test import Client
+from mainapp.authentication import issue_token
+from mainapp.loadtest import percentile
+from mainapp.models import Cart, CartItem, Collection, Customer, IdempotencyKey, Order, OrderItem, OutboxMessage, Product, \
+    ProductChange, StockSync
+from mainapp.provisioning import provision_customers
+from mainapp.tasks import sync_stock
+from mainapp.transactions import conflict_kind, retry_metrics
+
+
+'''measures how many checkouts per second OrderViewSet.create sustains.
+
+Every checkout is made by its own customer from its own cart, with a token and
+an Idempotency-Key, through the Django test client, so a run exercises the
+whole request path. Checkout locks only the cart row, the product rows are
+written by the sync_stock outbox handler, which each worker runs right after
+its checkout (run_sync_stock=True) so that orders of the same products contend
+for the same rows. In the hot workload every cart contains one of a few hot
+products, in the uniform one the products are drawn from the whole set'''
+
+EMAIL_DOMAIN = 'checkout-benchmark.invalid'
+WORKLOADS = ('hot', 'uniform')
+
+
+class LockTimer:
+    '''execute wrapper adding up the time spent in statements that take row locks
+    or write. Waits for a row lock happen inside those statements, as does the
+    busy wait of SQLite for the write lock, so the total approximates the lock
+    wait time. The wait of a SQLite COMMIT for readers is not included'''
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        verb = sql.lstrip()[:6].upper()
+        if verb not in ('INSERT', 'UPDATE', 'DELETE') and 'FOR UPDATE' not in sql:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+class CheckoutStats:
+    def __init__(self):
+        self.latencies = []
+        self.failures = Counter()
+        self.errors = Counter()
+        self.retries = 0
+        self.transaction_retries = 0
+        self.lock_wait = 0.0
+
+    def merge(self, other):
+        self.latencies += other.latencies
+        self.failures += other.failures
+        self.errors += other.errors
+        self.retries += other.retries
+        self.transaction_retries += other.transaction_retries
+        self.lock_wait += other.lock_wait
+
+    def summary(self, elapsed):
+        orders = len(self.latencies)
+        return {
+            'orders': orders,
+            'orders_per_second': orders / elapsed if elapsed else 0,
+            'failed': sum(self.failures.values()),
+            'failures': dict(self.failures),
+            'p50': percentile(self.latencies, 50),
+            'p95': percentile(self.latencies, 95),
+            'p99': percentile(self.latencies, 99),
+            'max': max(self.latencies, default=0),
+            'deadlocks': self.errors['deadlock'],
+            'errors': dict(self.errors),
+            'retries': self.retries,
+            'transaction_retries': self.transaction_retries,
+            'lock_wait': self.lock_wait,
+            'lock_wait_per_order': self.lock_wait * 1000 / orders if orders else 0,
+        }
+
+
+def create_products(count):
+    collection = Collection.objects.create(title=f'Checkout benchmark {uuid.uuid4().hex[:8]}')
+    products = Product.objects.bulk_create([
+        Product(title=f'Benchmark product {index}', unit_price=Decimal('10.00'),
+                inventory=1000000, collection=collection)
+        for index in range(count)])
+    ProductChange.record(product.pk for product in products)
+    return products
+
+
+def create_carts(count, products, items_per_cart=3, workload='uniform', hot_products=3, seed=None):
+    '''one customer and one cart per checkout, returns the jobs:
+    dicts with the token of the customer, the cart id and the cart items'''
+    rng = random.Random(seed)
+    run = uuid.uuid4().hex[:8]
+    customers = provision_customers([
+        {'email': f'{run}-{index}@{EMAIL_DOMAIN}', 'password': None,
+         'first_name': 'Benchmark', 'last_name': str(index)}
+        for index in range(count)])
+    product_ids = [product.pk for product in products]
+    hot = product_ids[:hot_products]
+
+    jobs, carts, items = [], [], []
+    for customer in customers:
+        if workload == 'hot':
+            chosen = [rng.choice(hot)]
+            chosen += rng.sample([pk for pk in product_ids if pk != chosen[0]],
+                                 min(items_per_cart - 1, len(product_ids) - 1))
+        else:
+            chosen = rng.sample(product_ids, min(items_per_cart, len(product_ids)))
+        cart = Cart()
+        carts.append(cart)
+        job_items = [{'product_id': pk, 'quantity': rng.randint(1, 3)} for pk in chosen]
+        items += [CartItem(cart=cart, product_id=item['product_id'], quantity=item['quantity'])
+                  for item in job_items]
+        jobs.append({'token': issue_token(customer.user, customer.pk), 'cart_id': str(cart.pk),
+                     'items': job_items})
+    Cart.objects.bulk_create(carts)
+    CartItem.objects.bulk_create(items)
+    return jobs
+
+
+def place_order(client, job, stats, max_retries=3, run_sync_stock=True):
+    '''checks out the cart of the job and runs sync_stock for its items. A database
+    error is retried with the same Idempotency-Key, as a client would, so a retry
+    after a failed sync_stock replays the stored order instead of placing it again'''
+    headers = {'HTTP_AUTHORIZATION': f'Bearer {job["token"]}',
+               'HTTP_IDEMPOTENCY_KEY': uuid.uuid4().hex}
+    started = time.perf_counter()
+    for attempt in range(max_retries + 1):
+        if attempt:
+            stats.retries += 1
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+        try:
+            response = client.post('/orders/', {'cart_id': job['cart_id']},
+                                   content_type='application/json', **headers)
+            if response.status_code != 201:
+                stats.failures[response.status_code] += 1
+                return
+            if run_sync_stock:
+                sync_stock({'order_id': response.json()['id'], 'items': job['items']})
+        except DatabaseError as error:
+            stats.errors[conflict_kind(error) or 'other'] += 1
+            continue
+        stats.latencies.append((time.perf_counter() - started) * 1000)
+        return
+    stats.failures['retries exhausted'] += 1
+
+
+def transaction_retries():
+    '''retries of the server side transactions so far, see mainapp.transactions'''
+    return sum(sum(counts['retries'].values()) for counts in retry_metrics.snapshot().values())
+
+
+def run_worker(jobs, host='localhost', max_retries=3, run_sync_stock=True):
+    stats = CheckoutStats()
+    lock_timer = LockTimer()
+    client = Client(HTTP_HOST=host)
+    retries = transaction_retries()
+    try:
+        with connection.execute_wrapper(lock_timer):
+            for job in jobs:
+                place_order(client, job, stats, max_retries, run_sync_stock)
+    finally:
+        connections.close_all()
+    stats.lock_wait = lock_timer.seconds
+    # exact in a worker process, the threads of one process share the counters
+    stats.transaction_retries = transaction_retries() - retries
+    return stats
+
+
+def run_checkouts(jobs, workers=4, processes=False, **options):
+    '''checks out the jobs with `workers` threads, or forked processes (each with
+    its own connection, for databases with real row locks such as Postgres).
+    Returns the merged stats and the wall time'''
+    chunks = [jobs[index::workers] for index in range(workers)]
+    connections.close_all()
+    if processes:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    retries = transaction_retries()
+    started = time.perf_counter()
+    with executor:
+        results = list(executor.map(partial(run_worker, **options), chunks))
+    elapsed = time.perf_counter() - started
+
+    stats = CheckoutStats()
+    for result in results:
+        stats.merge(result)
+    if not processes:
+        stats.transaction_retries = transaction_retries() - retries
+    return stats, elapsed
+
+
+def delete_benchmark_data(products):
+    '''removes the orders, customers and products created for a run, with the
+    stock syncs and idempotency keys of the orders'''
+    customers = Customer.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}')
+    orders = Order.objects.filter(customer__in=customers)
+    order_ids = list(orders.values_list('pk', flat=True))
+    users = [customer.user_id for customer in customers]
+    OutboxMessage.objects.filter(payload__order_id__in=order_ids).delete()
+    StockSync.objects.filter(order_id__in=order_ids).delete()
+    IdempotencyKey.objects.filter(scope__in=[f'{user_id}:/orders/' for user_id in users]).delete()
+    # raw deletes skip the summary signals, the summaries go with the customers
+    OrderItem.objects.filter(order__in=orders)._raw_delete(OrderItem.objects.db)
+    orders._raw_delete(Order.objects.db)
+    Cart.objects.filter(items__product__in=products).delete()
+    customers.delete()
+    get_user_model().objects.filter(pk__in=users).delete()
+    collections = {product.collection_id for product in products}
+    Product.objects.filter(pk__in=[product.pk for product in products]).delete()
+    Collection.objects.filter(pk__in=collections).delete()
@@ -0,0 +1,60 @@
+import hashlib
+from collections import Counter
+from decimal import Decimal
+from urllib.parse import urlencode
+from django.conf import settings
+from django.db.models import Case, Count, IntegerField, Value, When
+
+
+'''facet counts of the product list: products per collection and per price
+bucket for the current search and filters, computed with one grouped query
+(or from the catalog snapshot) and cached per normalized query'''
+
+# parameters that do not change which products match
+IGNORED_PARAMS = {'page', 'fields', 'ordering', 'format'}
+
+
+def price_bounds():
+    return [Decimal(bound) for bound in settings.FACET_PRICE_BUCKETS]
+
+
+def normalize(name, value):
+    value = value.strip()
+    if name == 'search':
+        # SearchFilter splits the terms on whitespace and matches them case-insensitively
+        return ' '.join(sorted(set(value.lower().split())))
+    if name == 'collection_id__in':
+        return ','.join(sorted(set(item.strip() for item in value.split(',') if item.strip())))
+    return value
+
+
+def cache_key(query_params):
+    '''the same key for the same products in any parameter order or spelling'''
+    params = sorted((name, normalize(name, value))
+                    for name, values in query_params.lists() if name not in IGNORED_PARAMS
+                    for value in values)
+    digest = hashlib.md5(urlencode(params).encode()).hexdigest()
+    return f'facets:{digest}'
+
+
+def facet_groups(queryset, bounds):
+    '''(collection id, price bucket, count) of the queryset in one grouped query'''
+    bucket = Case(*[When(unit_price__lt=bound, then=Value(index)) for index, bound in enumerate(bounds)],
+                  default=Value(len(bounds)), output_field=IntegerField())
+    return list(queryset.order_by().annotate(price_bucket=bucket)
+                .values_list('collection_id', 'price_bucket').annotate(count=Count('id')))
+
+
+def build_facets(groups, bounds):
+    collections, prices = Counter(), Counter()
+    for collection_id, bucket, count in groups:
+        collections[collection_id] += count
+        prices[bucket] += count
+    edges = [None] + [f'{bound:.2f}' for bound in bounds] + [None]
+    return {
+        'count': sum(collections.values()),
+        'collections': [{'id': collection_id, 'count': count}
+                        for collection_id, count in sorted(collections.items(), key=lambda item: (-item[1], item[0]))],
+        'prices': [{'min': edges[bucket], 'max': edges[bucket + 1], 'count': prices[bucket]}
+                   for bucket in range(len(bounds) + 1)],
+    }
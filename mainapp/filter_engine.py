@@ -0,0 +1,155 @@
+import math
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+'''vectorized evaluation of the product list filters over the catalog snapshot.
+
+The columns are numpy views over the snapshot mmap, so every worker reads the
+shared pages without copying them. A query is a few boolean masks over the
+columns, the price ordering reuses the price_order column of the snapshot.
+Rows changed after the build are masked out of the columns and evaluated from
+the overlay of the snapshot, which stays small between two builds. Without
+numpy the snapshot falls back to its pure python scan'''
+
+# the bounds are clamped so that numpy compares them with int64 columns
+MAX_CENTS = 2 ** 62
+
+
+def create_engine(snapshot):
+    return FilterEngine(snapshot) if numpy is not None else None
+
+
+def to_cents(price, rounding):
+    '''integer bound equivalent to the decimal one for integer cents,
+    floor for a strict lower bound and ceil for a strict upper bound'''
+    return max(-MAX_CENTS, min(MAX_CENTS, rounding(price * 100)))
+
+
+class FilterEngine:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.ids = numpy.frombuffer(snapshot.ids, dtype=numpy.int64)
+        self.prices = numpy.frombuffer(snapshot.prices, dtype=numpy.int64)
+        self.collections = numpy.frombuffer(snapshot.collections, dtype=numpy.int64)
+        self.inventory = numpy.frombuffer(snapshot.inventory, dtype=numpy.int64)
+        self.price_order = numpy.frombuffer(snapshot.price_order, dtype=numpy.int64)
+        self.overlay = (None, None, [], None)
+
+    def get_overlay(self):
+        '''(version, mask of the unchanged base rows, changed rows, their columns),
+        recomputed only when the snapshot overlay changed since the last query'''
+        if self.overlay[0] != self.snapshot.version:
+            version, changes = self.snapshot.get_changes()
+            changed_ids = numpy.fromiter(changes, dtype=numpy.int64, count=len(changes))
+            unchanged = numpy.isin(self.ids, changed_ids, invert=True) if changes else None
+            rows = [row for row in changes.values() if row is not None]
+            columns = tuple(numpy.array([getattr(row, name) for row in rows], dtype=numpy.int64)
+                            for name in ('price_cents', 'collection_id', 'inventory', 'id'))
+            # assigned at once, concurrent queries see either the old or the new overlay
+            self.overlay = (version, unchanged, rows, columns)
+        return self.overlay
+
+    @staticmethod
+    def mask(prices, collections, inventory, collection_ids, min_cents, max_cents, in_stock):
+        mask = numpy.ones(len(prices), dtype=bool)
+        if collection_ids is not None:
+            mask &= numpy.isin(collections, collection_ids)
+        if min_cents is not None:
+            mask &= prices > min_cents
+        if max_cents is not None:
+            mask &= prices < max_cents
+        if in_stock is not None:
+            mask &= (inventory > 0) if in_stock else (inventory <= 0)
+        return mask
+
+    def match(self, collection_ids=None, price_gt=None, price_lt=None, in_stock=None):
+        '''(mask of the matching base rows, row numbers of the matching changed rows,
+        changed rows, their columns)'''
+        _, unchanged, rows, row_columns = self.get_overlay()
+        predicates = (
+            None if collection_ids is None else numpy.array(list(collection_ids), dtype=numpy.int64),
+            None if price_gt is None else to_cents(price_gt, math.floor),
+            None if price_lt is None else to_cents(price_lt, math.ceil),
+            in_stock)
+
+        mask = self.mask(self.prices, self.collections, self.inventory, *predicates)
+        if unchanged is not None:
+            mask &= unchanged
+        matched = numpy.flatnonzero(self.mask(*row_columns[:3], *predicates))
+        return mask, matched, rows, row_columns
+
+    def query(self, collection_ids=None, price_gt=None, price_lt=None, in_stock=None, ordering='title'):
+        '''returns the matching rows as a lazy ordered sequence, see EngineResult'''
+        mask, matched, rows, (row_prices, _, _, row_ids) = self.match(
+            collection_ids, price_gt, price_lt, in_stock)
+        by_price = ordering in ('unit_price', '-unit_price')
+        # the columns are stored by title, price_order holds the row numbers by price
+        entries = self.price_order[mask[self.price_order]] if by_price else numpy.flatnonzero(mask)
+
+        # changed rows are referenced by negative numbers, -1 being rows[0]
+        if len(matched):
+            references = -1 - matched
+            if by_price:
+                prices = numpy.concatenate([self.prices[entries], row_prices[matched]])
+                ids = numpy.concatenate([self.ids[entries], row_ids[matched]])
+                entries = numpy.concatenate([entries, references])[numpy.lexsort((ids, prices))]
+            else:
+                changed = sorted(zip(matched.tolist(), references.tolist()),
+                                 key=lambda entry: (rows[entry[0]].title, rows[entry[0]].id))
+                positions = [self.title_position(entries, rows[index]) for index, _ in changed]
+                entries = numpy.insert(entries, positions, [reference for _, reference in changed])
+        if ordering == '-unit_price':
+            entries = entries[::-1]
+        return EngineResult(self.snapshot, entries, rows)
+
+    def facet_groups(self, price_bounds, collection_ids=None, price_gt=None, price_lt=None,
+                     in_stock=None, ordering=None):
+        '''(collection id, price bucket, count) of the matching rows, the bucket
+        of a price is the number of bounds it is not below'''
+        mask, matched, _, (row_prices, row_collections, _, _) = self.match(
+            collection_ids, price_gt, price_lt, in_stock)
+        collections = numpy.concatenate([self.collections[mask], row_collections[matched]])
+        buckets = numpy.searchsorted(
+            numpy.array([to_cents(bound, math.ceil) for bound in price_bounds], dtype=numpy.int64),
+            numpy.concatenate([self.prices[mask], row_prices[matched]]), side='right')
+        groups, counts = numpy.unique(numpy.stack([collections, buckets]), axis=1, return_counts=True)
+        return list(zip(*groups.tolist(), counts.tolist()))
+
+    def title_position(self, entries, row):
+        '''binary search of the (title, id) of a changed row among base rows in title order,
+        only the titles on the search path are decoded'''
+        key = (row.title, row.id)
+        low, high = 0, len(entries)
+        while low < high:
+            middle = (low + high) // 2
+            index = int(entries[middle])
+            if (self.snapshot.title(index), int(self.ids[index])) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+class EngineResult:
+    '''ordered query result over row references, rows are built only for
+    the slice that is read, like SnapshotResult'''
+
+    def __init__(self, snapshot, entries, rows):
+        self.snapshot = snapshot
+        self.entries = entries
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.entries)
+
+    def count(self):
+        return len(self.entries)
+
+    def __getitem__(self, item):
+        entries = self.entries[item].tolist() if isinstance(item, slice) else [int(self.entries[item])]
+        rows = [self.rows[-1 - reference] if reference < 0 else self.snapshot.row(reference)
+                for reference in entries]
+        return rows if isinstance(item, slice) else rows[0]
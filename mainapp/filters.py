@@ -1,11 +1,26 @@
-from django_filters.rest_framework import FilterSet
+from django_filters.rest_framework import BooleanFilter, FilterSet
+from rest_framework.filters import BaseFilterBackend
 from mainapp.models import Product
 
 
 class ProductFilter(FilterSet):
+    in_stock = BooleanFilter(method='filter_in_stock')
+
     class Meta:
         model = Product
         fields = {
-            'collection_id': ['exact'],
+            'collection_id': ['exact', 'in'],
             'unit_price': ['gt', 'lt']
         }
+
+    def filter_in_stock(self, queryset, name, value):
+        return queryset.filter(inventory__gt=0) if value else queryset.filter(inventory__lte=0)
+
+
+class CustomerSearchFilter(BaseFilterBackend):
+    '''?search= by phone, email or name prefix over the indexed search columns'''
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '')
+        return queryset.search(term)
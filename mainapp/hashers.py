@@ -0,0 +1,10 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    '''PBKDF2 with the iteration count of the PASSWORD_HASHER_ITERATIONS setting'''
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASHER_ITERATIONS
@@ -0,0 +1,83 @@
+import json
+from datetime import timedelta
+from functools import wraps
+from hashlib import sha256
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from mainapp.models import IdempotencyKey
+from mainapp.transactions import run_in_transaction
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def get_idempotency_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24))
+
+
+def request_fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps(data, sort_keys=True, default=str)
+    return sha256(f'{request.method}:{request.path}:{payload}'.encode()).hexdigest()
+
+
+def idempotent(view_method):
+    '''replays the stored response when a client retries a create request
+    with the same Idempotency-Key header. The key row is locked for the
+    duration of the request so concurrent duplicates wait for the first
+    one to finish instead of doing the work twice. The transaction is retried
+    on conflicts, view included.
+
+    Keys are scoped to the user, so the key of an anonymous request is
+    ignored: any other anonymous client could send the same key and would
+    get the stored response, e.g. the id of someone else's cart'''
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'error': 'Слишком длинный ключ идемпотентности'}, status=status.HTTP_400_BAD_REQUEST)
+
+        scope = f'{request.user.pk}:{request.path}'
+        fingerprint = request_fingerprint(request)
+
+        def respond():
+            record, created = IdempotencyKey.objects.select_for_update()\
+                .get_or_create(key=key, scope=scope, defaults={'fingerprint': fingerprint})
+
+            if not created:
+                if record.created_at < timezone.now() - get_idempotency_ttl():
+                    record.fingerprint = fingerprint
+                    record.response_status = None
+                    record.response_body = None
+                    record.created_at = timezone.now()
+                elif record.fingerprint != fingerprint:
+                    return Response({'error': 'Ключ идемпотентности уже использован с другим запросом'},
+                                    status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                elif record.response_status is not None:
+                    return Response(record.response_body, status=record.response_status,
+                                    headers={'Idempotent-Replayed': 'true'})
+                else:
+                    record.fingerprint = fingerprint
+
+            response = view_method(self, request, *args, **kwargs)
+
+            # server errors are not stored so that the client can retry them
+            if response.status_code >= 500:
+                record.delete()
+            else:
+                record.response_status = response.status_code
+                record.response_body = response.data
+                record.save()
+
+            return response
+
+        return run_in_transaction(f'idempotent {view_method.__qualname__}', respond)
+
+    return wrapper
@@ -0,0 +1,164 @@
+import bisect
+import json
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve
+from mainapp.metrics import LATENCY_BUCKETS
+
+
+'''replays recorded API requests and collects latency and SQL statistics per endpoint.
+A recording is a JSON lines file, one request per line:
+{"method": "GET", "path": "/products/?page=2", "body": {...}, "headers": {...}}'''
+
+# the bounds of the request latency histogram of /metrics, in milliseconds
+HISTOGRAM_BOUNDS = tuple(round(bound * 1000, 3) for bound in LATENCY_BUCKETS)
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def histogram(values, bounds=HISTOGRAM_BOUNDS):
+    '''the number of values per bucket: up to and including each bound, the
+    last bucket is above the last bound. Not cumulative, unlike Prometheus'''
+    counts = [0] * (len(bounds) + 1)
+    for value in values:
+        counts[bisect.bisect_left(bounds, value)] += 1
+    return counts
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = []
+        self.queries = []
+        self.errors = 0
+
+    def summary(self):
+        return {
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'p50': percentile(self.latencies, 50),
+            'p95': percentile(self.latencies, 95),
+            'p99': percentile(self.latencies, 99),
+            'max': max(self.latencies, default=0),
+            'histogram': histogram(self.latencies),
+            'queries': sum(self.queries) / len(self.queries) if self.queries else None,
+        }
+
+
+def load_recording(path):
+    '''returns the requests of a recording and the number of skipped
+    lines (blank lines and records without method and path)'''
+    requests, skipped = [], 0
+    with open(path) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(record, dict) or 'path' not in record:
+                skipped += 1
+                continue
+            record.setdefault('method', 'GET')
+            requests.append(record)
+    return requests, skipped
+
+
+def endpoint_name(method, path):
+    try:
+        match = resolve(path.split('?')[0])
+    except Resolver404:
+        return f'{method} <unresolved>'
+    return f'{method} {match.url_name or match.view_name}'
+
+
+class InProcessTarget:
+    '''sends requests through the Django test client in the worker thread,
+    so the SQL queries of each request can be counted'''
+
+    counts_queries = True
+
+    def __init__(self, host):
+        self.host = host
+        self.local = threading.local()
+
+    def send(self, record):
+        if not hasattr(self.local, 'client'):
+            self.local.client = Client(HTTP_HOST=self.host)
+        headers = {'HTTP_' + name.upper().replace('-', '_'): value
+                   for name, value in record.get('headers', {}).items()}
+        method = getattr(self.local.client, record['method'].lower())
+        with CaptureQueriesContext(connection) as context:
+            if record.get('body') is None:
+                response = method(record['path'], **headers)
+            else:
+                response = method(record['path'], data=record['body'],
+                                  content_type='application/json', **headers)
+        return response.status_code, len(context.captured_queries)
+
+
+class HttpTarget:
+    '''sends requests to a running server, e.g. a local gunicorn'''
+
+    counts_queries = False
+
+    def __init__(self, base_url):
+        import requests
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.local = threading.local()
+
+    def send(self, record):
+        if not hasattr(self.local, 'session'):
+            self.local.session = self.requests.Session()
+        response = self.local.session.request(
+            record['method'], self.base_url + record['path'],
+            json=record.get('body'), headers=record.get('headers'))
+        return response.status_code, None
+
+
+def replay(records, target, concurrency=4, ramp_up=0.0, repeat=1):
+    '''replays the records in order with `concurrency` worker threads, worker i
+    starts i * ramp_up / concurrency seconds after the first one.
+    Returns the stats per endpoint and the wall time'''
+    stream = iter([record for _ in range(repeat) for record in records])
+    stream_lock = threading.Lock()
+    stats = defaultdict(EndpointStats)
+    stats_lock = threading.Lock()
+
+    def worker(index):
+        time.sleep(index * ramp_up / concurrency)
+        while True:
+            with stream_lock:
+                record = next(stream, None)
+            if record is None:
+                return
+            name = endpoint_name(record['method'].upper(), record['path'])
+            started = time.perf_counter()
+            try:
+                status_code, queries = target.send(record)
+            except Exception:
+                status_code, queries = None, None
+            latency = (time.perf_counter() - started) * 1000
+            with stats_lock:
+                endpoint = stats[name]
+                endpoint.latencies.append(latency)
+                if queries is not None:
+                    endpoint.queries.append(queries)
+                if status_code is None or status_code >= 500:
+                    endpoint.errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    return dict(stats), time.perf_counter() - started
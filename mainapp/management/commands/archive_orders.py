@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from mainapp.archive import archive_orders, table_size
+from mainapp.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = ('Moves complete and failed orders older than --months into the archive '
+            'tables and reports the space reclaimed in the hot tables')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=12)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        tables = {model._meta.db_table: (model.objects.count(), table_size(model._meta.db_table))
+                  for model in (Order, OrderItem)}
+
+        orders, items = archive_orders(
+            options['months'], options['batch_size'],
+            progress=lambda orders, items: self.stdout.write(f'Archived {orders} orders, {items} items'))
+        self.stdout.write(f'Archived {orders} orders and {items} order items in total')
+
+        moved = {Order._meta.db_table: orders, OrderItem._meta.db_table: items}
+        for table, (rows, size) in tables.items():
+            if size is None or not rows:
+                self.stdout.write(f'{table}: size is not available on this database')
+                continue
+            reclaimed = size * moved[table] // rows
+            self.stdout.write(f'{table}: {size / 2 ** 20:.1f} MiB before, '
+                              f'about {reclaimed / 2 ** 20:.1f} MiB reclaimed')
+        self.stdout.write('The space is reused after VACUUM (postgres autovacuum runs it), '
+                          'on sqlite run VACUUM to shrink the file')
@@ -0,0 +1,74 @@
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from mainapp.checkout_benchmark import (
+    WORKLOADS, create_carts, create_products, delete_benchmark_data, run_checkouts)
+
+
+class Command(BaseCommand):
+    help = ('Creates carts and checks them out in parallel, reports orders/sec, latency '
+            'percentiles, deadlocks, client and transaction retries and lock wait time for the hot product '
+            'and the uniform workload. Run it against a copy of the database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=1000, help='checkouts per workload')
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--processes', action='store_true',
+                            help='forked worker processes instead of threads, for Postgres')
+        parser.add_argument('--workload', choices=[*WORKLOADS, 'both'], default='both')
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--hot-products', type=int, default=3,
+                            help='products one of which is in every cart of the hot workload')
+        parser.add_argument('--items', type=int, default=3, help='items per cart')
+        parser.add_argument('--max-retries', type=int, default=3)
+        parser.add_argument('--no-sync-stock', action='store_true',
+                            help='do not run the sync_stock handler after each checkout')
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--host', default='localhost',
+                            help='Host header of the requests, must be in ALLOWED_HOSTS')
+        parser.add_argument('--keep', action='store_true', help='keep the created data')
+
+    def handle(self, *args, **options):
+        if options['products'] < max(options['items'], options['hot_products'], 1):
+            raise CommandError('--products must be at least --items and --hot-products')
+        workloads = WORKLOADS if options['workload'] == 'both' else [options['workload']]
+
+        database = connection.vendor
+        if database == 'sqlite':
+            with connection.cursor() as cursor:
+                journal_mode = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+            database += f' (journal_mode={journal_mode})'
+        mode = 'processes' if options['processes'] else 'threads'
+        self.stdout.write(f'{database}, {options["workers"]} {mode}, '
+                          f'{options["carts"]} checkouts per workload')
+
+        # failed checkouts are counted, their tracebacks would bury the report
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        products = create_products(options['products'])
+        try:
+            results = {}
+            for workload in workloads:
+                jobs = create_carts(options['carts'], products, options['items'], workload,
+                                    options['hot_products'], options['seed'])
+                stats, elapsed = run_checkouts(
+                    jobs, options['workers'], options['processes'], host=options['host'],
+                    max_retries=options['max_retries'], run_sync_stock=not options['no_sync_stock'])
+                results[workload] = stats.summary(elapsed)
+        finally:
+            if not options['keep']:
+                delete_benchmark_data(products)
+
+        self.stdout.write(f'{"workload":<10} {"orders":>7} {"failed":>7} {"orders/s":>9} '
+                          f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8} '
+                          f'{"deadlocks":>9} {"retries":>8} {"tx retries":>10} {"lock ms/order":>14}')
+        for workload, summary in results.items():
+            self.stdout.write(
+                f'{workload:<10} {summary["orders"]:>7} {summary["failed"]:>7} '
+                f'{summary["orders_per_second"]:>9.1f} {summary["p50"]:>8.1f} {summary["p95"]:>8.1f} '
+                f'{summary["p99"]:>8.1f} {summary["max"]:>8.1f} {summary["deadlocks"]:>9} '
+                f'{summary["retries"]:>8} {summary["transaction_retries"]:>10} '
+                f'{summary["lock_wait_per_order"]:>14.1f}')
+        for workload, summary in results.items():
+            if summary['errors'] or summary['failures']:
+                self.stdout.write(f'{workload}: database errors {summary["errors"]}, '
+                                  f'failed checkouts {summary["failures"]}')
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from mainapp.sqlite_benchmark import PROFILES, run_profile
+
+
+class Command(BaseCommand):
+    help = ('Measures reader and writer throughput of a scratch sqlite file with the '
+            'default backend and with the tuned one (SQLITE_TUNING)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=5.0, help='seconds per profile')
+        parser.add_argument('--rows', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{options["readers"]} readers, {options["writers"]} writers, '
+                          f'{options["duration"]}s per profile')
+        self.stdout.write(f'{"profile":<10} {"journal":>8} {"reads/s":>9} {"read p95":>9} '
+                          f'{"writes/s":>9} {"write p95":>10} {"locked":>7}')
+        for profile, engine in PROFILES.items():
+            result = run_profile(engine, options['readers'], options['writers'],
+                                 options['duration'], options['rows'])
+            reads, writes = result['reads'], result['writes']
+            self.stdout.write(
+                f'{profile:<10} {result["journal_mode"]:>8} {reads["per_second"]:>9.0f} '
+                f'{reads["p95"]:>9.2f} {writes["per_second"]:>9.0f} {writes["p95"]:>10.2f} '
+                f'{reads["errors"] + writes["errors"]:>7}')
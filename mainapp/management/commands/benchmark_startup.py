@@ -0,0 +1,33 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from subprocess import CalledProcessError
+from mainapp.startup_benchmark import measure
+
+
+class Command(BaseCommand):
+    help = ('Starts fresh interpreters with each settings module and reports the median time '
+            'until the WSGI application is ready and the latency of its first two requests')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--settings-module', action='append', dest='settings_modules',
+                            help='repeatable, defaults to online_shop.settings and online_shop.settings_production')
+        parser.add_argument('--path', default='/products/')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        settings_modules = options['settings_modules'] or ['online_shop.settings', 'online_shop.settings_production']
+        # the production profile refuses to start without a secret key and a redis url
+        env = {'DJANGO_SECRET_KEY': 'startup-benchmark', 'DJANGO_ALLOWED_HOSTS': options['host'],
+               'REDIS_URL': os.environ.get('REDIS_URL', 'redis://localhost:6379/0')}
+
+        self.stdout.write(f'GET {options["path"]}, median of {options["runs"]} runs')
+        self.stdout.write(f'{"settings":<35} {"ready ms":>9} {"1st req ms":>11} {"2nd req ms":>11} {"status":>8}')
+        for settings_module in settings_modules:
+            try:
+                result = measure(settings_module, options['path'], options['runs'], options['host'], env)
+            except CalledProcessError as error:
+                raise CommandError(f'{settings_module} failed to start:\n{error.stderr}')
+            statuses = ','.join(str(status) for status in result['statuses'])
+            self.stdout.write(f'{settings_module:<35} {result["ready"]:>9.1f} {result["first_request"]:>11.1f} '
+                              f'{result["second_request"]:>11.1f} {statuses:>8}')
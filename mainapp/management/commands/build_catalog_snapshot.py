@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from mainapp.catalog import build_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Writes the memory-mapped product catalog snapshot loaded by the workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=str(settings.CATALOG_SNAPSHOT_PATH))
+
+    def handle(self, *args, **options):
+        count = build_snapshot(options['path'])
+        self.stdout.write(f'Wrote {count} products to {options["path"]}')
@@ -0,0 +1,137 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+from uuid import uuid4
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from mainapp.models import Collection, Product, Customer, Cart, CartItem, Order, OrderItem, ProductChange
+from mainapp.summaries import rebuild_summaries
+
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+         'tempor incididunt ut labore et dolore magna aliqua').split()
+
+
+class Command(BaseCommand):
+    help = ('Generates a synthetic dataset for benchmarking, e.g. --collections 1000 '
+            '--products 1000000 --orders 5000000 --order-items 20000000')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collections', type=int, default=10)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--order-items', type=int, default=20000)
+        parser.add_argument('--carts', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='zipf exponent of product popularity, 0 for uniform')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        collection_ids = self.create_collections(options['collections'])
+        product_ids = self.create_products(options['products'], collection_ids)
+        customer_ids = self.create_customers(options['customers'])
+
+        # the n-th most popular product is picked with weight 1 / n ** skew
+        popularity = list(product_ids)
+        self.rng.shuffle(popularity)
+        self.popular_products = popularity
+        self.cum_weights = list(accumulate(
+            1 / rank ** options['skew'] for rank in range(1, len(popularity) + 1)))
+
+        self.create_orders(options['orders'], options['order_items'], customer_ids)
+        self.create_carts(options['carts'])
+        # bulk_create skips the Order signals that keep the summaries
+        self.stdout.write(f'customer summaries: {rebuild_summaries()}')
+
+    def progress(self, name, done, total):
+        self.stdout.write(f'{name}: {done}/{total}')
+
+    def pick_products(self, count):
+        return set(self.rng.choices(self.popular_products, cum_weights=self.cum_weights, k=count))
+
+    def insert(self, model, objects, name, done, total):
+        created = model.objects.bulk_create(objects, batch_size=self.batch_size)
+        self.progress(name, done, total)
+        return created
+
+    def batches(self, total):
+        for start in range(0, total, self.batch_size):
+            yield start, min(start + self.batch_size, total)
+
+    def create_collections(self, total):
+        ids = []
+        for start, end in self.batches(total):
+            collections = [Collection(title=f'Collection {number}')
+                           for number in range(start, end)]
+            ids += [collection.id for collection in self.insert(
+                Collection, collections, 'collections', end, total)]
+        return ids
+
+    def create_products(self, total, collection_ids):
+        self.unit_prices = {}
+        for start, end in self.batches(total):
+            products = [Product(
+                title=f'Product {number}',
+                description=' '.join(self.rng.choices(WORDS, k=self.rng.randint(0, 400))),
+                unit_price=Decimal(self.rng.randint(100, 999999)) / 100,
+                inventory=self.rng.randint(0, 1000),
+                collection_id=self.rng.choice(collection_ids)) for number in range(start, end)]
+            products = self.insert(Product, products, 'products', end, total)
+            ProductChange.record(product.id for product in products)
+            self.unit_prices.update((product.id, product.unit_price) for product in products)
+        return list(self.unit_prices)
+
+    def create_customers(self, total):
+        ids = []
+        for start, end in self.batches(total):
+            customers = []
+            for number in range(start, end):
+                customer = Customer(
+                    first_name=f'Name{number % 997}', last_name=f'Surname{number}',
+                    email=f'customer{number}@example.com',
+                    phone=f'+7{self.rng.randint(9000000000, 9999999999)}',
+                    street=f'Street {number % 101}', house=str(self.rng.randint(1, 200)),
+                    flat=str(self.rng.randint(1, 500)))
+                customer.normalize_search_fields()
+                customers.append(customer)
+            ids += [customer.id for customer in self.insert(
+                Customer, customers, 'customers', end, total)]
+        return ids
+
+    def create_orders(self, total, total_items, customer_ids):
+        now = timezone.now()
+        average_items = max(1, total_items // max(total, 1))
+        statuses = [Order.PAYMENT_STATUS_COMPLETE] * 8 + \
+            [Order.PAYMENT_STATUS_PENDING, Order.PAYMENT_STATUS_FAILED]
+        items_done = 0
+
+        for start, end in self.batches(total):
+            orders = [Order(
+                customer_id=self.rng.choice(customer_ids),
+                payment_status=self.rng.choice(statuses),
+                placed_at=now - timedelta(seconds=self.rng.randint(0, 3 * 365 * 24 * 3600)))
+                for _ in range(start, end)]
+            orders = self.insert(Order, orders, 'orders', end, total)
+
+            items = [OrderItem(order_id=order.id, product_id=product_id,
+                               quantity=self.rng.randint(1, 5), unit_price=self.unit_prices[product_id])
+                     for order in orders
+                     for product_id in self.pick_products(self.rng.randint(1, 2 * average_items - 1))]
+            items_done += len(items)
+            self.insert(OrderItem, items, 'order items', items_done, total_items)
+
+    def create_carts(self, total):
+        for start, end in self.batches(total):
+            # random ids, ids drawn from the seeded rng repeat in the next run
+            carts = [Cart(id=uuid4()) for _ in range(start, end)]
+            Cart.objects.bulk_create(carts, batch_size=self.batch_size)
+            items = [CartItem(cart_id=cart.id, product_id=product_id,
+                              quantity=self.rng.randint(1, 3))
+                     for cart in carts for product_id in self.pick_products(self.rng.randint(1, 5))]
+            self.insert(CartItem, items, 'carts', end, total)
@@ -0,0 +1,21 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from mainapp.provisioning import provision_customers
+
+
+class Command(BaseCommand):
+    help = ('Imports customers with their users from a JSON lines file, one object per line '
+            'with email, password and the customer fields')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with open(options['path']) as file:
+            try:
+                accounts = [json.loads(line) for line in file if line.strip()]
+            except json.JSONDecodeError as error:
+                raise CommandError(f'Invalid JSON line: {error}')
+        customers = provision_customers(accounts, options['batch_size'])
+        self.stdout.write(f'Imported {len(customers)} customers')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from mainapp.idempotency import get_idempotency_ttl
+from mainapp.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored idempotency keys older than IDEMPOTENCY_KEY_TTL'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - get_idempotency_ttl()
+        deleted, _ = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(f'Deleted {deleted} expired idempotency keys')
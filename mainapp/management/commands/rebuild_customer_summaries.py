@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from mainapp.summaries import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recomputes order count, lifetime value and last order date of every customer'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuilt = rebuild_summaries()
+        self.stdout.write(f'Rebuilt {rebuilt} customer summaries')
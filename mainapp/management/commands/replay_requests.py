@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from mainapp.loadtest import HISTOGRAM_BOUNDS, HttpTarget, InProcessTarget, load_recording, replay
+
+
+class Command(BaseCommand):
+    help = ('Replays a recorded stream of API requests (JSON lines) and reports '
+            'throughput, latency percentiles and histograms and SQL queries per endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('recording', help='JSON lines file with method, path, body and headers')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--ramp-up', type=float, default=0.0,
+                            help='seconds over which the worker threads are started')
+        parser.add_argument('--repeat', type=int, default=1)
+        parser.add_argument('--url', help='base url of a running server, e.g. http://127.0.0.1:8000. '
+                                          'Without it requests are sent in-process through the test client')
+        parser.add_argument('--host', default='localhost',
+                            help='Host header for in-process requests, must be in ALLOWED_HOSTS')
+
+    def handle(self, *args, **options):
+        records, skipped = load_recording(options['recording'])
+        if skipped:
+            self.stderr.write(f'Skipped {skipped} lines without a request path')
+        if not records:
+            raise CommandError('The recording has no requests')
+
+        if options['url']:
+            target = HttpTarget(options['url'])
+        else:
+            target = InProcessTarget(options['host'])
+
+        stats, elapsed = replay(records, target, options['concurrency'],
+                                options['ramp_up'], options['repeat'])
+
+        total = sum(len(endpoint.latencies) for endpoint in stats.values())
+        self.stdout.write(f'{total} requests in {elapsed:.2f}s, {total / elapsed:.1f} req/s')
+        self.stdout.write(f'{"endpoint":<40} {"count":>7} {"errors":>7} {"p50 ms":>8} '
+                          f'{"p95 ms":>8} {"p99 ms":>8} {"max ms":>8} {"queries":>8}')
+        for name, endpoint in sorted(stats.items()):
+            summary = endpoint.summary()
+            queries = '-' if summary['queries'] is None else f'{summary["queries"]:.1f}'
+            self.stdout.write(
+                f'{name:<40} {summary["requests"]:>7} {summary["errors"]:>7} '
+                f'{summary["p50"]:>8.1f} {summary["p95"]:>8.1f} {summary["p99"]:>8.1f} '
+                f'{summary["max"]:>8.1f} {queries:>8}')
+
+        self.stdout.write('')
+        self.stdout.write('requests per latency bucket, up to the bound in ms')
+        bounds = [f'{bound:g}' for bound in HISTOGRAM_BOUNDS] + ['+Inf']
+        self.stdout.write(f'{"endpoint":<40}' + ''.join(f' {bound:>6}' for bound in bounds))
+        for name, endpoint in sorted(stats.items()):
+            self.stdout.write(f'{name:<40}' + ''.join(f' {count:>6}' for count in endpoint.summary()['histogram']))
@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from mainapp.outbox import process_batch
+
+
+class Command(BaseCommand):
+    help = 'Runs handlers for pending outbox messages (order emails, stock sync, analytics)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4,
+                            help='threads running handlers of one batch')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='seconds to sleep when there is nothing to do')
+        parser.add_argument('--once', action='store_true',
+                            help='process the pending messages and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_batch(options['batch_size'], options['workers'])
+            if processed:
+                self.stdout.write(f'Processed {processed} outbox messages')
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['poll_interval'])
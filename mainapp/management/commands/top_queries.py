@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from mainapp.query_stats import SORT_KEYS, count_processes, fold_exited, merge, read_snapshots, top_queries
+
+
+class Command(BaseCommand):
+    help = ('Prints the SQL fingerprints that took the most time (or ran most often, were slowest) '
+            'in all processes writing to METRICS_DIR, with the views and serializers that ran them '
+            'and the plans of their slow queries')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='directory of the statistics, METRICS_DIR by default')
+        parser.add_argument('--sort', choices=SORT_KEYS, default='total',
+                            help='total time, count, mean or max time, or slow queries')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--plans', action='store_true', help='print the EXPLAIN output')
+        parser.add_argument('--width', type=int, default=120, help='characters of SQL shown')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.METRICS_DIR
+        if not directory:
+            raise CommandError('METRICS_DIR is not set, the statistics are only kept in the memory of each process')
+        fold_exited(directory)
+        snapshots = [snapshot for _, snapshot in read_snapshots(directory)]
+        if not snapshots:
+            raise CommandError(f'No query statistics in {directory}')
+        dropped = sum(snapshot['dropped'] for snapshot in snapshots)
+
+        self.stdout.write(f'{count_processes(snapshots)} processes, slow from {settings.SLOW_QUERY_THRESHOLD}s'
+                          + (f', {dropped} queries over QUERY_STATS_MAX_FINGERPRINTS not counted' if dropped else ''))
+        self.stdout.write(f'{"fingerprint":<16} {"count":>8} {"total ms":>10} {"mean ms":>8} '
+                          f'{"max ms":>8} {"slow":>6}  origin')
+        for key, entry in top_queries(merge(snapshots), options['sort'], options['limit']):
+            origin = entry['origins'][0][0] if entry['origins'] else '-'
+            self.stdout.write(
+                f'{key:<16} {entry["count"]:>8} {entry["seconds"] * 1000:>10.1f} '
+                f'{entry["seconds"] * 1000 / entry["count"]:>8.2f} {entry["max_seconds"] * 1000:>8.1f} '
+                f'{entry["slow"]:>6}  {origin}')
+            self.stdout.write(f'    {entry["sql"][:options["width"]]}')
+            for origin, count in entry['origins'][1:]:
+                self.stdout.write(f'    also from {origin} ({count} slow)')
+            if options['plans'] and entry['plan']:
+                for line in entry['plan']:
+                    self.stdout.write(f'    | {line}')
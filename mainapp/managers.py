@@ -1,4 +1,5 @@
 from django.contrib.auth.base_user import BaseUserManager
+from django.db.models import Q, QuerySet
 
 
 class CustomUserManager(BaseUserManager):
@@ -11,6 +12,36 @@ class CustomUserManager(BaseUserManager):
             raise ValueError('The Email must be set')
         email = self.normalize_email(email)
         user = self.model(email=email, **extra_fields)
-        # user.set_password(password)
+        # None sets an unusable password, the hasher cost is PASSWORD_HASHER_ITERATIONS
+        user.set_password(password)
         user.save()
         return user
+
+
+def normalize_phone(phone):
+    return ''.join(char for char in phone if char.isdigit())
+
+
+class CustomerQuerySet(QuerySet):
+    '''prefix lookups on the normalized search columns of Customer,
+    each branch can be answered from one of their indexes'''
+
+    def search(self, term):
+        term = term.strip().lower()
+        if not term:
+            return self
+
+        digits = normalize_phone(term)
+        if digits and not term.strip('+-() 0123456789'):
+            return self.filter(search_phone__startswith=digits)
+        if '@' in term:
+            return self.filter(search_email__startswith=term)
+
+        words = term.split()
+        if len(words) == 1:
+            return self.filter(Q(search_first_name__startswith=term)
+                               | Q(search_last_name__startswith=term)
+                               | Q(search_email__startswith=term))
+        first, last = words[0], ' '.join(words[1:])
+        return self.filter(Q(search_first_name__startswith=first, search_last_name__startswith=last)
+                           | Q(search_first_name__startswith=last, search_last_name__startswith=first))
@@ -0,0 +1,289 @@
+import bisect
+import fcntl
+import json
+import math
+import os
+import threading
+import time
+from django.conf import settings
+from mainapp.process_metrics import is_running, read_worker_metrics
+
+
+'''in-process metrics in the Prometheus data model: counters, gauges and
+histograms with labels.
+
+Every process keeps its own registry. With METRICS_DIR set it writes a
+snapshot to metrics-<pid>.json in that directory (at most every
+METRICS_FLUSH_INTERVAL seconds, after requests and outbox batches) and
+/metrics merges the snapshots of all processes: counters and histograms are
+added up, gauges get a pid label and are only kept for running processes.
+The counters of exited processes are folded into metrics-exited.json so that
+the totals do not drop when gunicorn recycles a worker.
+
+Collectors are functions called when a snapshot is taken, for counts that
+are kept elsewhere (app_cache, transaction retries)'''
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+EXITED_FILE = 'metrics-exited.json'
+
+
+def label_key(labels):
+    return json.dumps(labels, sort_keys=True)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes the labels {self.labelnames}, not {tuple(labels)}')
+        return label_key({name: str(value) for name, value in labels.items()})
+
+    def samples(self):
+        with self.lock:
+            return [[json.loads(key), value] for key, value in self.values.items()]
+
+    def describe(self):
+        return {'type': self.type, 'help': self.help, 'samples': self.samples()}
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    '''the counts per bucket are kept non-cumulative, the last bucket is +Inf'''
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            sample = self.values.get(key)
+            if sample is None:
+                sample = self.values[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0, 'count': 0}
+            sample['buckets'][bisect.bisect_left(self.buckets, value)] += 1
+            sample['sum'] += value
+            sample['count'] += 1
+
+    def samples(self):
+        with self.lock:
+            return [[json.loads(key), {**value, 'buckets': list(value['buckets'])}]
+                    for key, value in self.values.items()]
+
+    def describe(self):
+        return {**super().describe(), 'bounds': list(self.buckets)}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.flushed_at = None
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, func):
+        '''func returns {name: {'type', 'help', 'samples': [[labels, value], ...]}}'''
+        self.collectors.append(func)
+        return func
+
+    def snapshot(self, exited=False):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        families = {metric.name: metric.describe() for metric in metrics}
+        for collect in self.collectors:
+            families.update(collect())
+        return {'pid': os.getpid(), 'exited': exited, 'metrics': families}
+
+    def reset(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+    def flush(self, exited=False):
+        '''writes the snapshot of this process to METRICS_DIR'''
+        directory = settings.METRICS_DIR
+        self.flushed_at = time.monotonic()
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.snapshot(exited), file)
+        os.replace(temporary, path)
+
+    def maybe_flush(self):
+        if settings.METRICS_DIR and (self.flushed_at is None
+                                     or time.monotonic() - self.flushed_at >= settings.METRICS_FLUSH_INTERVAL):
+            self.flush()
+
+
+registry = Registry()
+
+
+def merge(snapshots):
+    '''adds up counters and histograms, gauges of running processes get a pid label'''
+    merged = {}
+    for snapshot in snapshots:
+        for name, family in snapshot['metrics'].items():
+            if family['type'] == 'gauge' and snapshot.get('exited'):
+                continue
+            target = merged.setdefault(name, {**family, 'samples': {}})
+            for labels, value in family['samples']:
+                if family['type'] == 'gauge' and snapshot.get('pid') is not None:
+                    labels = {**labels, 'pid': str(snapshot['pid'])}
+                key = label_key(labels)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = (labels, value)
+                elif family['type'] == 'histogram':
+                    target['samples'][key] = (labels, {
+                        'buckets': [a + b for a, b in zip(current[1]['buckets'], value['buckets'])],
+                        'sum': current[1]['sum'] + value['sum'],
+                        'count': current[1]['count'] + value['count']})
+                else:
+                    target['samples'][key] = (labels, current[1] + value)
+    for family in merged.values():
+        family['samples'] = list(family['samples'].values())
+    return merged
+
+
+def read_snapshots(directory):
+    snapshots = []
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith('metrics-') and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                snapshots.append((name, json.load(file)))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def fold_exited(directory):
+    '''merges the snapshots of exited processes (and of killed ones, which could
+    not mark their snapshot) into metrics-exited.json, under a lock so that two
+    scrapes do not fold the same file twice'''
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        snapshots = read_snapshots(directory)
+        exited = [(name, snapshot) for name, snapshot in snapshots if name != EXITED_FILE
+                  and (snapshot.get('exited') or not is_running(snapshot['pid']))]
+        if not exited:
+            return
+        folded = [snapshot for name, snapshot in snapshots if name == EXITED_FILE]
+        merged = merge(folded + [snapshot for _, snapshot in exited])
+        path = os.path.join(directory, EXITED_FILE)
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump({'pid': None, 'exited': True, 'metrics': merged}, file)
+        os.replace(f'{path}.tmp', path)
+        for name, _ in exited:
+            os.remove(os.path.join(directory, name))
+
+
+def worker_families(directory):
+    '''the files of the gunicorn hooks (mainapp.process_metrics) as gauges per worker'''
+    workers = read_worker_metrics(directory)
+    if not workers:
+        return {}
+    return {
+        'gunicorn_worker_requests': {
+            'type': 'gauge', 'help': 'Requests served by the worker since it started',
+            'samples': [[{'pid': str(worker['pid'])}, worker['requests']] for worker in workers]},
+        'gunicorn_worker_memory_bytes': {
+            'type': 'gauge', 'help': 'Memory of the worker, shared_* are pages shared with other processes',
+            'samples': [[{'pid': str(worker['pid']), 'kind': kind}, value]
+                        for worker in workers for kind, value in worker['memory'].items()]},
+    }
+
+
+def collect():
+    '''the merged metrics of every process, or of this one without METRICS_DIR'''
+    directory = settings.METRICS_DIR
+    if not directory:
+        return merge([registry.snapshot()])
+    registry.flush()
+    fold_exited(directory)
+    families = merge([snapshot for _, snapshot in read_snapshots(directory)])
+    families.update(worker_families(directory))
+    return families
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items())) + '}'
+
+
+def render(families):
+    '''the Prometheus text exposition format'''
+    lines = []
+    for name, family in sorted(families.items()):
+        lines.append(f'# HELP {name} {family["help"]}')
+        lines.append(f'# TYPE {name} {family["type"]}')
+        for labels, value in sorted(family['samples'], key=lambda sample: label_key(sample[0])):
+            if family['type'] != 'histogram':
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip([*family['bounds'], math.inf], value['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels({**labels, "le": format_value(bound)})} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(value["sum"])}')
+            lines.append(f'{name}_count{format_labels(labels)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,128 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db import connection
+from django.utils.functional import SimpleLazyObject
+from mainapp.metrics import QUERY_BUCKETS, registry
+from mainapp.models import Customer
+from mainapp.query_stats import query_stats
+
+
+class CustomerCache:
+    '''user id -> Customer, per worker, each entry kept at most ttl seconds.
+    Entries are dropped by the Customer signals of this worker, changes made
+    by other workers are seen after the ttl'''
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            found = self.entries.get(user_id)
+            if found is None or found[1] <= time.monotonic():
+                return None
+            self.entries.move_to_end(user_id)
+        # a copy, so that a view changing its customer does not change the cached one
+        return copy.copy(found[0])
+
+    def set(self, user_id, customer):
+        with self.lock:
+            self.entries[user_id] = (customer, time.monotonic() + self.ttl)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def forget(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+customer_cache = CustomerCache(settings.CUSTOMER_CACHE_SIZE, settings.CUSTOMER_CACHE_TTL)
+
+
+def resolve_customer(user):
+    if not user.is_authenticated:
+        return None
+    customer_id = getattr(user, 'customer_id', None)
+    if customer_id is not None:
+        # the customer_id claim of a token, the other columns load on first access
+        return Customer.from_db('default', ['id'], [customer_id])
+
+    customer = customer_cache.get(user.pk)
+    if customer is None:
+        customer = Customer.objects.filter(user_id=user.pk).first()
+        if customer is not None:
+            customer_cache.set(user.pk, customer)
+    return customer
+
+
+class CustomerMiddleware:
+    '''request.customer is the Customer of the authenticated user, resolved on first
+    access and at most once per request. It is falsy for anonymous users and users
+    without a customer. The user is read at access time, so users authenticated
+    by DRF inside the view (tokens) are seen too'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.customer = SimpleLazyObject(lambda: resolve_customer(request.user))
+        return self.get_response(request)
+
+
+request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Time to answer a request, per view and action', ['view', 'action'])
+requests_total = registry.counter(
+    'http_requests_total', 'Requests answered, per view, action and status', ['view', 'action', 'status'])
+request_queries = registry.histogram(
+    'db_queries_per_request', 'SQL queries made to answer a request', ['view', 'action'], QUERY_BUCKETS)
+
+
+def view_labels(request, view_func):
+    '''viewset class and action for drf views, module and function otherwise'''
+    method = request.method.lower()
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__name__}', method
+    actions = getattr(view_func, 'actions', None) or {}
+    return view_class.__name__, actions.get(method, method)
+
+
+class MetricsMiddleware:
+    '''records latency, status and query count of every request. First in
+    MIDDLEWARE, so the time and the queries of the other middleware count too'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(1)
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        seconds = time.perf_counter() - started
+
+        view, action = getattr(request, 'metrics_view', ('unresolved', request.method.lower()))
+        request_duration.observe(seconds, view=view, action=action)
+        request_queries.observe(len(queries), view=view, action=action)
+        requests_total.inc(view=view, action=action, status=response.status_code)
+        registry.maybe_flush()
+        query_stats.maybe_flush()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = view_labels(request, view_func)
@@ -1,9 +1,11 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from uuid import uuid4
-from mainapp.managers import CustomUserManager
+from mainapp.managers import CustomUserManager, CustomerQuerySet, normalize_phone
 
 
 class CustomUser(AbstractBaseUser, PermissionsMixin):
@@ -32,6 +34,13 @@ class Collection(models.Model):
     class Meta:
         ordering = ['title']
 
+    '''saved in a transaction, so that the ProductChange written by post_save
+    is committed together with the product'''
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 
 class Product(models.Model):
     title = models.CharField(max_length=200)
@@ -42,6 +51,7 @@ class Product(models.Model):
         validators=[MinValueValidator(1)])
     inventory = models.IntegerField(validators=[MinValueValidator(0)])
     collection = models.ForeignKey(Collection, on_delete=models.PROTECT)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.title
@@ -59,10 +69,49 @@ class Customer(models.Model):
     house = models.CharField(max_length=40)
     korpus = models.CharField(max_length=50, null=True, blank=True)
     flat = models.CharField(max_length=50)
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='customer')
+
+    # lowercase copies for indexed prefix search, kept in sync by save()
+    search_first_name = models.CharField(
+        max_length=150, db_index=True, editable=False)
+    search_last_name = models.CharField(
+        max_length=150, db_index=True, editable=False)
+    search_email = models.CharField(
+        max_length=254, db_index=True, editable=False)
+    search_phone = models.CharField(
+        max_length=15, db_index=True, editable=False)
+
+    SEARCH_FIELDS = {
+        'first_name': 'search_first_name',
+        'last_name': 'search_last_name',
+        'email': 'search_email',
+        'phone': 'search_phone',
+    }
+
+    objects = CustomerQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.first_name}, {self.last_name}'
 
+    '''has to be called before bulk_create, which skips save()'''
+
+    def normalize_search_fields(self, fields=None):
+        for field, search_field in self.SEARCH_FIELDS.items():
+            if fields is None or field in fields:
+                value = getattr(self, field)
+                setattr(self, search_field,
+                        normalize_phone(value) if field == 'phone' else value.lower())
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        self.normalize_search_fields(update_fields)
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {
+                search_field for field, search_field in self.SEARCH_FIELDS.items()
+                if field in update_fields}
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['first_name', 'last_name']
 
@@ -77,14 +126,27 @@ class Order(models.Model):
         (PAYMENT_STATUS_FAILED, 'Failed')
     ]
 
-    placed_at = models.DateTimeField(auto_now_add=True)
+    # a default instead of auto_now_add, so that generate_data can insert past orders
+    placed_at = models.DateTimeField(default=timezone.now, editable=False)
     payment_status = models.CharField(
         max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING)
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
 
+    class Meta:
+        indexes = [models.Index(fields=['customer', 'placed_at'])]
+
     def __str__(self):
         return f'{self.placed_at}, {self.payment_status}'
 
+    '''remembers the loaded values so that post_save can tell
+    which payment status the order had before'''
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(
@@ -92,10 +154,64 @@ class OrderItem(models.Model):
     product = models.ForeignKey(
         Product, on_delete=models.PROTECT, related_name='orderitems')
     quantity = models.PositiveSmallIntegerField()
+    # the price of the product when the order was placed
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
 
     def __str__(self):
         return self.product.title
 
+    '''remembers the loaded values so that post_save can tell
+    by how much the quantity changed'''
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+
+class ArchivedOrder(models.Model):
+    '''completed and failed orders moved out of the hot tables by archive_orders,
+    ids are kept from the original rows'''
+    id = models.BigIntegerField(primary_key=True)
+    placed_at = models.DateTimeField()
+    payment_status = models.CharField(
+        max_length=1, choices=Order.PAYMENT_STATUS_CHOICES)
+    customer = models.ForeignKey(
+        Customer, on_delete=models.PROTECT, related_name='archived_orders')
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['customer', 'placed_at'])]
+
+    def __str__(self):
+        return f'{self.placed_at}, {self.payment_status}'
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(
+        ArchivedOrder, on_delete=models.CASCADE, related_name='orderitems')
+    product = models.ForeignKey(
+        Product, on_delete=models.PROTECT, related_name='archived_orderitems')
+    quantity = models.PositiveSmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+
+    def __str__(self):
+        return f'{self.product_id}, {self.quantity}'
+
+
+class CustomerSummary(models.Model):
+    customer = models.OneToOneField(
+        Customer, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    order_count = models.PositiveIntegerField(default=0)
+    lifetime_value = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.customer_id}, {self.order_count}'
+
 
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
@@ -114,3 +230,74 @@ class CartItem(models.Model):
 
     def __str__(self):
         return f'{self.product}, {self.quantity}'
+
+
+class IdempotencyKey(models.Model):
+    key = models.CharField(max_length=255)
+    scope = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = [['key', 'scope']]
+        indexes = [models.Index(fields=['created_at'])]
+
+    def __str__(self):
+        return f'{self.scope}, {self.key}'
+
+
+class OutboxMessage(models.Model):
+    STATUS_PENDING = 'P'
+    STATUS_DONE = 'D'
+    STATUS_FAILED = 'F'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed')
+    ]
+
+    event = models.CharField(max_length=100)
+    handler = models.CharField(max_length=255)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    status = models.CharField(
+        max_length=1, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'available_at'])]
+
+    def __str__(self):
+        return f'{self.event}, {self.handler}, {self.status}'
+
+
+class StockSync(models.Model):
+    '''orders whose items sync_stock has taken from the inventory, so that a
+    redelivered order_placed message does not take them a second time'''
+    order_id = models.PositiveIntegerField(unique=True)
+    synced_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.order_id}, {self.synced_at}'
+
+
+class ProductChange(models.Model):
+    '''log of product inserts, updates and deletes, written in the transaction of
+    the change. Workers poll it by id to keep their catalog snapshot current,
+    see mainapp.catalog'''
+    product_id = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.id}, {self.product_id}'
+
+    @classmethod
+    def record(cls, product_ids):
+        '''for writes that skip the Product signals: queryset.update() and bulk_create'''
+        cls.objects.bulk_create([cls(product_id=product_id) for product_id in product_ids],
+                                batch_size=1000)
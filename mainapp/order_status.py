@@ -0,0 +1,81 @@
+from collections import defaultdict
+from decimal import Decimal
+from mainapp.models import Order
+from mainapp.summaries import add_values_to_summaries, order_totals
+from mainapp.transactions import run_in_transaction
+
+
+CHUNK_SIZE = 500
+
+
+def apply_payment_statuses(requested):
+    '''locks the orders, updates the changed ones and adjusts the summaries,
+    returns the current rows and the number of updated orders'''
+    ids = list(requested)
+    current = {}
+    for start in range(0, len(ids), CHUNK_SIZE):
+        current.update({order_id: (payment_status, customer_id) for order_id, payment_status, customer_id
+                        in Order.objects.select_for_update().filter(pk__in=ids[start:start + CHUNK_SIZE])
+                        .values_list('id', 'payment_status', 'customer_id')})
+
+    by_status = defaultdict(list)
+    for order_id, payment_status in requested.items():
+        if order_id in current and current[order_id][0] != payment_status:
+            by_status[payment_status].append(order_id)
+
+    updated = 0
+    for payment_status, order_ids in by_status.items():
+        for start in range(0, len(order_ids), CHUNK_SIZE):
+            updated += Order.objects.filter(pk__in=order_ids[start:start + CHUNK_SIZE])\
+                .update(payment_status=payment_status)
+
+    # queryset.update() skips post_save, so the summaries are adjusted here
+    complete = Order.PAYMENT_STATUS_COMPLETE
+    changed = [order_id for order_ids in by_status.values() for order_id in order_ids
+               if (current[order_id][0] == complete) != (requested[order_id] == complete)]
+    totals = {}
+    for start in range(0, len(changed), CHUNK_SIZE):
+        totals.update(order_totals(changed[start:start + CHUNK_SIZE]))
+    values = defaultdict(Decimal)
+    for order_id in changed:
+        sign = 1 if requested[order_id] == complete else -1
+        values[current[order_id][1]] += sign * totals.get(order_id, Decimal(0))
+    add_values_to_summaries(values)
+    return current, updated
+
+
+def bulk_update_payment_status(updates):
+    '''applies [{'order_id': ..., 'payment_status': ...}] with one UPDATE per status
+    (and chunk of ids) in a single transaction, retried on conflicts. Rows with an
+    unknown status or a bad id are reported as invalid, ids without an order as missing.
+    All the rows of an id given with different statuses are invalid, none of them is applied'''
+    statuses = {code for code, _ in Order.PAYMENT_STATUS_CHOICES}
+    invalid, rows = [], defaultdict(list)
+    for update in updates:
+        order_id = update.get('order_id') if isinstance(update, dict) else None
+        payment_status = update.get('payment_status') if isinstance(update, dict) else None
+        if isinstance(order_id, str) and order_id.isdigit():
+            order_id = int(order_id)
+        if isinstance(order_id, bool) or not isinstance(order_id, int):
+            invalid.append({'update': update, 'error': 'Неверный ID заказа'})
+        elif payment_status not in statuses:
+            invalid.append({'update': update, 'error': 'Неверный статус оплаты'})
+        else:
+            rows[order_id].append(update)
+
+    requested = {}
+    for order_id, order_updates in rows.items():
+        if len({update['payment_status'] for update in order_updates}) > 1:
+            invalid.extend({'update': update, 'error': 'Разные статусы оплаты для одного заказа'}
+                           for update in order_updates)
+        else:
+            requested[order_id] = order_updates[0]['payment_status']
+
+    current, updated = run_in_transaction('bulk_payment_status', apply_payment_statuses, requested)
+
+    return {
+        'updated': updated,
+        'unchanged': len([order_id for order_id in requested if order_id in current]) - updated,
+        'missing': [order_id for order_id in requested if order_id not in current],
+        'invalid': invalid,
+    }
@@ -0,0 +1,103 @@
+import random
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from mainapp.metrics import registry
+from mainapp.models import OutboxMessage
+from mainapp.query_stats import query_stats
+
+
+_handlers = {}
+
+
+def handler(event):
+    '''registers a function that runs in the outbox worker for every
+    message enqueued for the event, the function receives the payload'''
+
+    def decorator(func):
+        _handlers[f'{func.__module__}.{func.__name__}'] = (event, func)
+        return func
+    return decorator
+
+
+def enqueue(event, payload):
+    '''must be called inside the transaction that writes the data the
+    event describes, so that messages are committed or rolled back with it'''
+    messages = [OutboxMessage(event=event, handler=name, payload=payload)
+                for name, (handler_event, _) in _handlers.items() if handler_event == event]
+    return OutboxMessage.objects.bulk_create(messages)
+
+
+def get_max_attempts():
+    return getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8)
+
+
+def get_lease():
+    return timedelta(seconds=getattr(settings, 'OUTBOX_LEASE', 300))
+
+
+def retry_delay(attempts):
+    '''exponential backoff with full jitter, capped at one hour'''
+    return timedelta(seconds=random.uniform(0, min(2 ** attempts, 3600)))
+
+
+def claim_batch(batch_size):
+    '''claims pending messages by pushing their available_at forward by the lease,
+    messages of a crashed worker become available again once the lease runs out.
+    Rows locked by other workers are skipped (no-op on SQLite, which serializes
+    writers anyway)'''
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(OutboxMessage.objects.select_for_update(skip_locked=True)
+                        .filter(status=OutboxMessage.STATUS_PENDING, available_at__lte=now)
+                        .order_by('available_at')[:batch_size])
+        OutboxMessage.objects.filter(pk__in=[message.pk for message in messages])\
+            .update(available_at=now + get_lease(), attempts=F('attempts') + 1)
+    for message in messages:
+        message.attempts += 1
+    return messages
+
+
+def run_message(message):
+    try:
+        _, func = _handlers[message.handler]
+        func(message.payload)
+    except Exception:
+        return traceback.format_exc()
+    finally:
+        connections.close_all()
+    return None
+
+
+def process_batch(batch_size=100, max_workers=4):
+    messages = claim_batch(batch_size)
+    if not messages:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        errors = list(executor.map(run_message, messages))
+
+    now = timezone.now()
+    done = []
+    with transaction.atomic():
+        for message, error in zip(messages, errors):
+            if error is None:
+                done.append(message.pk)
+                continue
+            message.last_error = error
+            if message.attempts >= get_max_attempts():
+                message.status = OutboxMessage.STATUS_FAILED
+            else:
+                message.available_at = now + retry_delay(message.attempts)
+            message.save(update_fields=['last_error', 'status', 'available_at'])
+        OutboxMessage.objects.filter(pk__in=done)\
+            .update(status=OutboxMessage.STATUS_DONE, processed_at=now)
+
+    # the worker serves no requests, its metrics are written after each batch
+    registry.maybe_flush()
+    query_stats.maybe_flush()
+    return len(messages)
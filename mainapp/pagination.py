@@ -1,5 +1,46 @@
-from rest_framework.pagination import PageNumberPagination
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+
+class OrderHistoryPagination(CursorPagination):
+    '''keyset pagination over the (customer, placed_at) index'''
+    page_size = 10
+    ordering = '-placed_at'
+
+
+class EstimatedCountPaginator(Paginator):
+    '''paginator for admin changelists of large tables. Unfiltered lists take the
+    row count from postgres statistics (pg_class.reltuples) or from a short lived
+    cached count on other databases instead of running COUNT(*) on every page'''
+
+    estimate_threshold = 10000
+    cache_timeout = 60
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query') or queryset.query.where:
+            return super().count
+
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+                row = cursor.fetchone()
+            estimate = row[0] if row else -1
+            if estimate >= self.estimate_threshold:
+                return estimate
+            return super().count
+
+        return cache.get_or_set(f'admin-count:{queryset.db}:{table}',
+                                lambda: super(EstimatedCountPaginator, self).count,
+                                self.cache_timeout)
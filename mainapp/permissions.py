@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import permissions
 
 
@@ -6,3 +7,20 @@ class IsAdminOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
         return bool(request.user and request.user.is_staff)
+
+
+class IsAdminOrOwnCustomer(permissions.BasePermission):
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+        customer = request.customer
+        return bool(customer) and str(customer.id) == str(view.kwargs.get('customer_pk'))
+
+
+class IsAdminOrMetricsScraper(permissions.BasePermission):
+    '''staff, or a request from one of the addresses in METRICS_ALLOWED_IPS'''
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+        return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
@@ -0,0 +1,126 @@
+import json
+import os
+import resource
+import threading
+import time
+
+
+'''memory and request counters of one server worker, written as a JSON file
+per worker to a shared directory so they can be read from outside the
+process. The gunicorn hooks in gunicorn.conf.py keep them up to date.
+No Django imports: the module is loaded by the gunicorn master'''
+
+SMAPS_FIELDS = {'Rss': 'rss', 'Pss': 'pss', 'Shared_Clean': 'shared_clean',
+                'Shared_Dirty': 'shared_dirty', 'Private_Clean': 'private_clean',
+                'Private_Dirty': 'private_dirty'}
+
+
+def memory_usage():
+    '''bytes of memory of this process. On Linux the shared part is split out: pages
+    still shared with the master after the fork count towards shared_* and only
+    proportionally towards pss. Elsewhere only the peak rss is known'''
+    try:
+        with open('/proc/self/smaps_rollup') as file:
+            usage = {}
+            for line in file:
+                name, _, value = line.partition(':')
+                if name in SMAPS_FIELDS:
+                    usage[SMAPS_FIELDS[name]] = int(value.split()[0]) * 1024
+            return usage
+    except OSError:
+        # kilobytes on Linux, bytes on macOS
+        return {'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+
+class WorkerMetrics:
+    def __init__(self, directory, pid=None, flush_interval=1.0, clock=time.monotonic):
+        self.pid = pid or os.getpid()
+        self.path = os.path.join(directory, f'worker-{self.pid}.json')
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.started_at = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.request_seconds = 0.0
+        self.max_request_seconds = 0.0
+        self.flushed_at = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def request_finished(self, seconds, status_code):
+        with self.lock:
+            self.requests += 1
+            if status_code >= 500:
+                self.errors += 1
+            self.request_seconds += seconds
+            self.max_request_seconds = max(self.max_request_seconds, seconds)
+            due = self.flushed_at is None or self.clock() - self.flushed_at >= self.flush_interval
+            if due:
+                self.flushed_at = self.clock()
+        if due:
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            counters = {
+                'pid': self.pid,
+                'started_at': self.started_at,
+                'requests': self.requests,
+                'errors': self.errors,
+                'request_seconds': self.request_seconds,
+                'max_request_seconds': self.max_request_seconds,
+            }
+        return {**counters, 'memory': memory_usage(), 'updated_at': time.time()}
+
+    def flush(self):
+        '''replaces the file in one rename, readers never see a partial one'''
+        self.flushed_at = self.clock()
+        snapshot = self.snapshot()
+        temporary = f'{self.path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(temporary, self.path)
+        return snapshot
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_worker_metrics(directory):
+    '''the last snapshot of every worker that wrote one and has not exited.
+    The files of workers that were killed before worker_exit could remove
+    them are removed here'''
+    snapshots = []
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return snapshots
+    for name in names:
+        if not (name.startswith('worker-') and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            continue
+        if is_running(snapshot['pid']):
+            snapshots.append(snapshot)
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+    return snapshots
@@ -0,0 +1,103 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework.exceptions import ValidationError
+from rest_framework.relations import RelatedField
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+
+def build_projection(serializer, model, prefix=''):
+    '''collects the columns a serializer reads as only() lookups together with the
+    select_related and Prefetch lookups for nested serializers. Returns None when
+    a field can read attributes that are not known in advance (method fields,
+    properties, dotted sources), loading such rows with deferred columns
+    would cost a query per row'''
+    columns, related, prefetches = [], [], []
+
+    for field in serializer.fields.values():
+        if field.source == '*' or len(field.source_attrs) > 1:
+            return None
+        name = field.source_attrs[0]
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            if hasattr(model, name):
+                return None
+            continue  # annotation added by the queryset
+
+        if isinstance(field, ListSerializer) and model_field.one_to_many:
+            projection = build_projection(field.child, model_field.related_model)
+            if projection is None:
+                return None
+            child_columns, child_related, child_prefetches = projection
+            queryset = apply_projection(
+                model_field.related_model.objects.all(),
+                ([model_field.field.name] + child_columns, child_related, child_prefetches))
+            prefetches.append(Prefetch(prefix + name, queryset=queryset))
+        elif not model_field.concrete or model_field.many_to_many:
+            continue  # reverse and many to many relations are not columns
+        elif isinstance(field, BaseSerializer):
+            projection = build_projection(
+                field, model_field.related_model, f'{prefix}{name}__')
+            if projection is None:
+                return None
+            child_columns, child_related, child_prefetches = projection
+            columns += [prefix + name] + child_columns
+            related += [prefix + name] + child_related
+            prefetches += child_prefetches
+        elif isinstance(field, RelatedField) and not field.use_pk_only_optimization():
+            return None
+        else:
+            columns.append(prefix + name)
+
+    return columns, related, prefetches
+
+
+def apply_projection(queryset, projection):
+    columns, related, prefetches = projection
+    # select_related() without arguments would follow every foreign key
+    if related:
+        queryset = queryset.select_related(*related)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    return queryset.only(*columns)
+
+
+class ProjectionMixin:
+    '''list and retrieve fetch only the columns of the fields the serializer renders.
+    Clients can narrow the fields further with ?fields=id,title'''
+
+    projection_actions = ('list', 'retrieve')
+
+    def get_requested_fields(self):
+        param = self.request.query_params.get('fields')
+        if self.action not in self.projection_actions or not param:
+            return None
+        return [name.strip() for name in param.split(',') if name.strip()]
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    '''hooked into filter_queryset, which list and get_object apply on
+    top of get_queryset, so that viewsets can keep overriding get_queryset'''
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action not in self.projection_actions:
+            return queryset
+
+        projection = build_projection(self.get_serializer(), queryset.model)
+        if projection is None:
+            return queryset
+        return apply_projection(queryset, projection)
+
+
+def narrow_fields(serializer, fields):
+    unknown = set(fields) - set(serializer.fields)
+    if unknown:
+        raise ValidationError(
+            {'fields': f'Неизвестные поля: {", ".join(sorted(unknown))}'})
+    for name in set(serializer.fields) - set(fields):
+        serializer.fields.pop(name)
@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from mainapp.models import Customer
+
+
+'''creates customers together with the user they sign in with. A customer
+is never left without its user: both are written in one transaction'''
+
+
+def provision_customer(email, password=None, **customer_fields):
+    '''signup of one customer, password None gives an unusable password'''
+    User = get_user_model()
+    with transaction.atomic():
+        user = User.objects.create_user(email, password)
+        return Customer.objects.create(user=user, email=user.email, **customer_fields)
+
+
+def provision_customers(accounts, batch_size=1000):
+    '''bulk path for imports: accounts are dicts with email, password and the
+    Customer fields. Users and customers are inserted with bulk_create, so the
+    per row cost is the password hashing. Returns the created customers'''
+    User = get_user_model()
+    customers = []
+    with transaction.atomic():
+        for start in range(0, len(accounts), batch_size):
+            batch = accounts[start:start + batch_size]
+            users = User.objects.bulk_create([
+                User(email=User.objects.normalize_email(account['email']),
+                     password=make_password(account.get('password')))
+                for account in batch])
+            created = []
+            for user, account in zip(users, batch):
+                fields = {name: value for name, value in account.items() if name != 'password'}
+                customer = Customer(**{**fields, 'email': user.email, 'user': user})
+                customer.normalize_search_fields()
+                created.append(customer)
+            customers += Customer.objects.bulk_create(created)
+    return customers
@@ -0,0 +1,283 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from functools import lru_cache
+from django.conf import settings
+from django.db import DatabaseError
+from rest_framework.serializers import BaseSerializer
+from rest_framework.views import APIView
+from mainapp.metrics import is_running, registry
+
+
+'''statistics per SQL fingerprint, collected by an execute wrapper that
+mainapp.signals installs on every database connection, so the queries of
+views, the outbox worker and management commands are all seen.
+
+Every query adds to the count and time of its fingerprint: the SQL with
+literals and parameters replaced by ? and IN lists and VALUES rows collapsed.
+A query that takes SLOW_QUERY_THRESHOLD seconds or more is slow: it is
+counted per origin (the innermost serializer or view method on the stack,
+else the innermost mainapp function) and the first slow one of a fingerprint
+is explained. The origin of a fingerprint is also taken when it is first
+seen, the stack is not walked for the other fast queries.
+
+Like mainapp.metrics every process writes its statistics to
+METRICS_DIR/queries-<pid>.json, the top_queries command adds them up. The
+statistics of exited processes are folded into queries-exited.json'''
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'(?<![\w"$.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b', re.IGNORECASE)
+PLACEHOLDER = re.compile(r'%s')
+IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+VALUES_ROWS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+WHITESPACE = re.compile(r'\s+')
+MAX_ORIGINS = 10
+EXITED_FILE = 'queries-exited.json'
+
+
+def normalize(sql):
+    sql = STRING.sub('?', sql)
+    sql = NUMBER.sub('?', sql)
+    sql = PLACEHOLDER.sub('?', sql)
+    sql = IN_LIST.sub('(...)', sql)
+    sql = VALUES_ROWS.sub('(...)', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql):
+    '''the normalized sql and a short hash of it. The ORM sends the values as
+    parameters, so the same sql strings come again and again'''
+    normalized = normalize(sql)
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16], normalized
+
+
+def find_origin(frame):
+    '''Serializer.method or ViewSet.method of the innermost frame run by a
+    serializer or a view, else module.function of the innermost mainapp frame'''
+    first_app_frame = None
+    while frame is not None:
+        # type(), isinstance() would evaluate lazy objects such as request.customer
+        owner = type(frame.f_locals.get('self'))
+        if issubclass(owner, (BaseSerializer, APIView)):
+            return f'{owner.__name__}.{frame.f_code.co_name}'
+        module = frame.f_globals.get('__name__', '')
+        if first_app_frame is None and module.startswith('mainapp.') and module != __name__:
+            first_app_frame = f'{module}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return first_app_frame or 'unknown'
+
+
+def explain(connection, sql, params):
+    '''the plan of a query, EXPLAIN QUERY PLAN on sqlite. Run on a cursor of
+    the database driver, so it is neither logged nor passed to the execute
+    wrappers (and not counted by assertNumQueries), in a savepoint so that a
+    failing EXPLAIN does not break the transaction of the query'''
+    savepoint = connection.in_atomic_block and connection.features.uses_savepoints
+    cursor = connection.create_cursor()
+    try:
+        if savepoint:
+            cursor.execute('SAVEPOINT query_stats_explain')
+        try:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            rows = cursor.fetchall()
+        except DatabaseError as error:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT query_stats_explain')
+            return [f'EXPLAIN failed: {error}']
+        finally:
+            if savepoint:
+                cursor.execute('RELEASE SAVEPOINT query_stats_explain')
+    finally:
+        cursor.close()
+    # one line per row, the detail column on sqlite
+    return [str(row[-1]) if connection.vendor in ('sqlite', 'postgresql') else ' | '.join(map(str, row))
+            for row in rows]
+
+
+def is_explainable(sql, many):
+    return not many and sql.lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH')
+
+
+slow_queries = registry.counter('db_slow_queries_total', 'Queries slower than SLOW_QUERY_THRESHOLD')
+
+
+class QueryStats:
+    def __init__(self):
+        self.entries = {}
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.flushed_at = None
+
+    def record(self, execute, sql, params, many, context):
+        '''the execute wrapper'''
+        threshold = settings.SLOW_QUERY_THRESHOLD
+        if threshold is None:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = execute(sql, params, many, context)
+            failed = False
+            return result
+        finally:
+            self.add(sql, params, many, context['connection'], time.perf_counter() - started,
+                     threshold, failed)
+
+    def add(self, sql, params, many, connection, seconds, threshold, failed):
+        key, normalized = fingerprint(sql)
+        slow = seconds >= threshold
+        with self.lock:
+            entry = self.entries.get(key)
+            new = entry is None
+            if new:
+                if len(self.entries) >= settings.QUERY_STATS_MAX_FINGERPRINTS:
+                    self.dropped += 1
+                    return
+                entry = self.entries[key] = {'sql': normalized, 'count': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                             'slow': 0, 'origins': {}, 'plan': None}
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            # only the first slow query of a fingerprint is explained
+            explain_now = slow and not failed and entry['plan'] is None and is_explainable(sql, many)
+            if explain_now:
+                entry['plan'] = []
+        if not (new or slow):
+            return
+
+        origin = find_origin(sys._getframe(1))
+        plan = explain(connection, sql, params) if explain_now else None
+        with self.lock:
+            origins = entry['origins']
+            if slow:
+                entry['slow'] += 1
+                origins[origin] = origins.get(origin, 0) + 1
+            else:
+                origins.setdefault(origin, 0)
+            if plan is not None:
+                entry['plan'] = plan
+        if slow:
+            slow_queries.inc()
+
+    def snapshot(self, exited=False):
+        with self.lock:
+            entries = {key: {**entry, 'origins': dict(entry['origins'])} for key, entry in self.entries.items()}
+            dropped = self.dropped
+        return {'pid': os.getpid(), 'exited': exited, 'dropped': dropped, 'queries': entries}
+
+    def reset(self):
+        with self.lock:
+            self.entries.clear()
+            self.dropped = 0
+
+    def flush(self, exited=False):
+        directory = settings.METRICS_DIR
+        self.flushed_at = time.monotonic()
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'queries-{os.getpid()}.json')
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.snapshot(exited), file)
+        os.replace(temporary, path)
+
+    def maybe_flush(self):
+        if settings.METRICS_DIR and (self.flushed_at is None
+                                     or time.monotonic() - self.flushed_at >= settings.METRICS_FLUSH_INTERVAL):
+            self.flush()
+
+
+query_stats = QueryStats()
+
+
+def install(connection):
+    if query_stats.record not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, query_stats.record)
+
+
+def read_snapshots(directory):
+    snapshots = []
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return snapshots
+    for name in names:
+        if not (name.startswith('queries-') and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                snapshots.append((name, json.load(file)))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def fold_exited(directory):
+    '''merges the statistics of exited (or killed) processes into
+    queries-exited.json, like mainapp.metrics.fold_exited'''
+    try:
+        lock = open(os.path.join(directory, '.lock'), 'w')
+    except FileNotFoundError:
+        return
+    with lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        snapshots = read_snapshots(directory)
+        exited = [(name, snapshot) for name, snapshot in snapshots if name != EXITED_FILE
+                  and (snapshot.get('exited') or not is_running(snapshot['pid']))]
+        if not exited:
+            return
+        folded = [snapshot for name, snapshot in snapshots if name == EXITED_FILE]
+        merged = folded + [snapshot for _, snapshot in exited]
+        path = os.path.join(directory, EXITED_FILE)
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump({'pid': None, 'exited': True, 'processes': count_processes(merged),
+                       'dropped': sum(snapshot['dropped'] for snapshot in merged), 'queries': merge(merged)}, file)
+        os.replace(f'{path}.tmp', path)
+        for name, _ in exited:
+            os.remove(os.path.join(directory, name))
+
+
+def count_processes(snapshots):
+    return sum(snapshot.get('processes', 1) for snapshot in snapshots)
+
+
+def merge(snapshots):
+    '''adds up the statistics of the processes per fingerprint'''
+    merged = {}
+    for snapshot in snapshots:
+        for key, entry in snapshot['queries'].items():
+            target = merged.get(key)
+            if target is None:
+                merged[key] = {**entry, 'origins': dict(entry['origins'])}
+                continue
+            target['count'] += entry['count']
+            target['seconds'] += entry['seconds']
+            target['max_seconds'] = max(target['max_seconds'], entry['max_seconds'])
+            target['slow'] += entry['slow']
+            for origin, count in entry['origins'].items():
+                target['origins'][origin] = target['origins'].get(origin, 0) + count
+            target['plan'] = target['plan'] or entry['plan']
+    return merged
+
+
+SORT_KEYS = {
+    'total': lambda entry: entry['seconds'],
+    'count': lambda entry: entry['count'],
+    'mean': lambda entry: entry['seconds'] / entry['count'],
+    'max': lambda entry: entry['max_seconds'],
+    'slow': lambda entry: entry['slow'],
+}
+
+
+def top_queries(entries, sort='total', limit=20):
+    '''[(fingerprint, entry)] of the worst fingerprints, origins ordered by slow queries'''
+    ranked = sorted(entries.items(), key=lambda item: SORT_KEYS[sort](item[1]), reverse=True)[:limit]
+    return [(key, {**entry, 'origins': sorted(entry['origins'].items(), key=lambda item: -item[1])[:MAX_ORIGINS]})
+            for key, entry in ranked]
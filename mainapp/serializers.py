@@ -1,10 +1,33 @@
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from django.contrib.auth import authenticate, get_user_model
 from django.core.validators import ValidationError
-from django.db import transaction
-from mainapp.models import Collection, Product, Customer, Cart, CartItem, Order, OrderItem
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Exists
+from mainapp.caching import invalidate_on_commit
+from mainapp.metrics import registry
+from mainapp.outbox import enqueue
+from mainapp.provisioning import provision_customer
+from mainapp.projections import narrow_fields
+from mainapp.models import Collection, Product, Customer, CustomerSummary, Cart, CartItem, Order, OrderItem
+from mainapp.transactions import conflict_kind, run_in_transaction
 
 
-class CollectionSerializer(serializers.ModelSerializer):
+checkouts = registry.counter('checkouts_total', 'Checkouts by outcome', ['outcome'])
+cart_adds = registry.counter('cart_adds_total', 'Products added to carts')
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    '''takes an additional `fields` argument with the names of the fields to render'''
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            narrow_fields(self, fields)
+
+
+class CollectionSerializer(DynamicFieldsModelSerializer):
     products_count = serializers.IntegerField(read_only=True)
 
     class Meta:
@@ -12,7 +35,7 @@ class CollectionSerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'products_count')
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsModelSerializer):
     collection = serializers.PrimaryKeyRelatedField(
         queryset=Collection.objects.all())
 
@@ -22,12 +45,64 @@ class ProductSerializer(serializers.ModelSerializer):
                   'unit_price', 'inventory', 'collection')
 
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(DynamicFieldsModelSerializer):
+    password = serializers.CharField(write_only=True, required=False, style={'input_type': 'password'})
 
     class Meta:
         model = Customer
         fields = ('id', 'first_name', 'last_name',
-                  'email', 'phone', 'street', 'house', 'korpus', 'flat')
+                  'email', 'phone', 'street', 'house', 'korpus', 'flat', 'password')
+
+    '''signup creates the customer and its user together, see mainapp.provisioning'''
+
+    def create(self, validated_data):
+        try:
+            return provision_customer(**validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError({'email': 'Пользователь с таким email уже существует'})
+
+    '''the user signs in with the email of the customer, both are changed together'''
+
+    def update(self, instance, validated_data):
+        password = validated_data.pop('password', None)
+        if 'email' in validated_data:
+            validated_data['email'] = get_user_model().objects.normalize_email(validated_data['email'])
+        try:
+            with transaction.atomic():
+                if instance.user_id is not None:
+                    self.update_user(instance.user, validated_data.get('email'), password)
+                return super().update(instance, validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError({'email': 'Пользователь с таким email уже существует'})
+
+    def update_user(self, user, email, password):
+        changed = []
+        if email is not None and email != user.email:
+            user.email = email
+            changed.append('email')
+        if password is not None:
+            user.set_password(password)
+            changed.append('password')
+        if changed:
+            user.save(update_fields=changed)
+
+
+class TokenObtainSerializer(serializers.Serializer):
+    email = serializers.EmailField()
+    password = serializers.CharField(write_only=True, style={'input_type': 'password'})
+
+    def validate(self, attrs):
+        user = authenticate(self.context.get('request'), email=attrs['email'], password=attrs['password'])
+        if user is None:
+            raise serializers.ValidationError('Неверный email или пароль')
+        attrs['user'] = user
+        return attrs
+
+
+class CustomerSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerSummary
+        fields = ('order_count', 'lifetime_value', 'last_order_at')
 
 
 class SimpleProductSerializer(serializers.ModelSerializer):
@@ -75,20 +150,24 @@ class AddCartItemSerializer(serializers.ModelSerializer):
     '''if user adds the same product doesn't stack duplicate records 
            and just increases quantity'''
 
-    def save(self, *args, **kwargs):
-        cart_id = self.context['cart_id']
-        product_id = self.validated_data['product_id']
-        quantity = self.validated_data['quantity']
-        try:
-            cart_item = CartItem.objects.get(
-                cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data)
+    def upsert(self, cart_id, product_id, quantity):
+        # the cart row lock, taken by checkout too, makes adds to one cart wait for
+        # each other, so two first adds of a product can not both insert it
+        if not Cart.objects.select_for_update().filter(pk=cart_id).exists():
+            raise NotFound('Не существует корзины с данным ID')
+        cart_item = CartItem.objects.select_for_update()\
+            .filter(cart_id=cart_id, product_id=product_id).first()
+        if cart_item is None:
+            return CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+        cart_item.quantity += quantity
+        cart_item.save(update_fields=['quantity'])
+        return cart_item
 
+    def save(self, *args, **kwargs):
+        self.instance = run_in_transaction(
+            'cart_item_upsert', self.upsert, self.context['cart_id'],
+            self.validated_data['product_id'], self.validated_data['quantity'])
+        cart_adds.inc()
         return self.instance
 
     class Meta:
@@ -102,7 +181,7 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
         fields = ('quantity',)
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(DynamicFieldsModelSerializer):
     product = SimpleProductSerializer(read_only=True)
 
     class Meta:
@@ -110,7 +189,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ('id', 'product', 'quantity')
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsModelSerializer):
     orderitems = OrderItemSerializer(many=True)
 
     class Meta:
@@ -122,37 +201,83 @@ class OrderSerializer(serializers.ModelSerializer):
 class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
-    def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
-            raise ValidationError('Не существует корзины с данным ID')
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
-            raise ValidationError('Пустая корзина')
-        if not Customer.objects.filter(id=self.context['customer_id']).exists():
-            raise ValidationError('Этого пользователя не существует')
-        return cart_id
+    def load_cart(self, cart_id, customer_id):
+        '''cart items with their products and whether the customer exists in one query,
+        one row with null items for an empty cart and no rows for a missing cart.
+        Locks the cart row until the end of the transaction, a concurrent checkout
+        of the same cart waits and then finds no cart'''
+        return list(Cart.objects.select_for_update(of=('self',)).filter(pk=cart_id)
+                    .annotate(customer_exists=Exists(Customer.objects.filter(pk=customer_id)))
+                    .values_list('customer_exists', 'items__product_id', 'items__quantity',
+                                 'items__product__title', 'items__product__unit_price'))
 
     '''converts cart and cart items to order and order items 
     objects and deletes cart object afterwards'''
 
-    def save(self, **kwargs):
-        with transaction.atomic():
-            customer = Customer.objects.get(id=self.context['customer_id'])
-            order = Order.objects.create(customer=customer)
-
-            cart_items = CartItem.objects.select_related('product')\
-                .filter(cart_id=self.validated_data['cart_id'])
+    def create_order(self, cart_id, customer_id):
+        rows = self.load_cart(cart_id, customer_id)
+        if not rows:
+            raise serializers.ValidationError({'cart_id': ['Не существует корзины с данным ID']}, code='missing_cart')
+        if not rows[0][0]:
+            raise serializers.ValidationError({'cart_id': ['Этого пользователя не существует']}, code='unknown_customer')
+        if rows[0][1] is None:
+            raise serializers.ValidationError({'cart_id': ['Пустая корзина']}, code='empty_cart')
+
+        order = Order.objects.create(customer_id=customer_id)
+        order_items = OrderItem.objects.bulk_create([OrderItem(
+            order=order, quantity=quantity, unit_price=unit_price,
+            product=Product.from_db(Product.objects.db, ['id', 'title', 'unit_price'],
+                                    [product_id, title, unit_price]))
+            for _, product_id, quantity, title, unit_price in rows])
+
+        enqueue('order_placed', {
+            'order_id': order.id,
+            'customer_id': customer_id,
+            'items': [{'product_id': item.product_id, 'quantity': item.quantity}
+                      for item in order_items]})
+
+        # the lock makes a second delete impossible on databases with row locks,
+        # this catches a concurrent checkout on the others (sqlite)
+        if not Cart.objects.filter(pk=cart_id).delete()[1].get(Cart._meta.label):
+            raise serializers.ValidationError({'cart_id': ['Не существует корзины с данным ID']}, code='missing_cart')
+        invalidate_on_commit(f'cart:{cart_id}')
+        return order, order_items
 
-            order_items = [OrderItem(
-                order=order, product=item.product, quantity=item.quantity) for item in cart_items]
-
-            OrderItem.objects.bulk_create(order_items)
-
-            Cart.objects.filter(pk=self.validated_data['cart_id']).delete()
+    def save(self, **kwargs):
+        # the customer resolved for the request by CustomerMiddleware
+        customer = self.context['customer']
+        try:
+            order, order_items = run_in_transaction(
+                'checkout', self.create_order, self.validated_data['cart_id'], customer.id)
+        except serializers.ValidationError as error:
+            checkouts.inc(outcome=error.get_codes()['cart_id'][0])
+            raise
+        except DatabaseError as error:
+            checkouts.inc(outcome='conflict' if conflict_kind(error) else 'error')
+            raise
+        checkouts.inc(outcome='placed')
 
-            return order
+        # OrderSerializer renders the items without querying them again
+        order._prefetched_objects_cache = {'orderitems': order_items}
+        return order
 
 
 class UpdateOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['payment_status']
+
+    '''the summary change is computed from the status loaded under the row lock,
+    two concurrent updates can not both move the order total'''
+
+    def update_locked(self, order_id, validated_data):
+        order = Order.objects.select_for_update().get(pk=order_id)
+        return super().update(order, validated_data)
+
+    def update(self, instance, validated_data):
+        return run_in_transaction('order_payment_status', self.update_locked, instance.pk, validated_data)
+
+
+class BulkUpdateOrderSerializer(serializers.Serializer):
+    updates = serializers.ListField(
+        child=serializers.DictField(), allow_empty=False, max_length=10000)
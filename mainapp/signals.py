@@ -1,13 +1,100 @@
 from django.dispatch import receiver
-from django.db.models.signals import post_save
-from django.contrib.auth import get_user_model
-from mainapp.models import Customer
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from mainapp.caching import invalidate_on_commit
+from mainapp.catalog import ProductRow, get_snapshot
+from mainapp.middleware import customer_cache
+from mainapp.models import Collection, Customer, CartItem, Order, OrderItem, Product, ProductChange
+from mainapp.query_stats import install as install_query_stats
+from mainapp.summaries import record_item_change, record_order_deleted, record_order_placed, \
+    record_payment_status_change
 
 
-User = get_user_model()
+@receiver(post_save, sender=Order)
+def update_customer_summary(sender, instance, created, **kwargs):
+    if created:
+        record_order_placed(instance)
+    else:
+        old_status = getattr(instance, '_loaded_values', {}).get('payment_status')
+        if old_status is not None:
+            record_payment_status_change(instance, old_status)
+    instance._loaded_values = {'payment_status': instance.payment_status}
 
 
-@receiver(post_save, sender=Customer)
-def create_token_for_new_customer(sender, **kwargs):
-    if kwargs['created']:
-        User.objects.create(user=kwargs['instance'])
+'''archive_orders deletes without signals, archived orders stay in the summaries'''
+
+
+@receiver(post_delete, sender=Order)
+def remove_from_customer_summary(sender, instance, **kwargs):
+    record_order_deleted(instance)
+
+
+@receiver(post_save, sender=OrderItem)
+def update_summary_for_item(sender, instance, created, **kwargs):
+    old_quantity = 0 if created else getattr(instance, '_loaded_values', {}).get('quantity')
+    if old_quantity is not None:
+        record_item_change(instance, instance.quantity - old_quantity)
+    instance._loaded_values = {'quantity': instance.quantity}
+
+
+@receiver(post_delete, sender=OrderItem)
+def remove_item_from_summary(sender, instance, **kwargs):
+    record_item_change(instance, -instance.quantity)
+
+
+'''every product change is logged in its transaction for the snapshots of the
+other workers. The overlay of this worker is changed once the transaction
+commits, a rolled back change must not be served'''
+
+
+@receiver(post_save, sender=Product)
+def update_catalog_snapshot(sender, instance, using, **kwargs):
+    ProductChange.objects.using(using).create(product_id=instance.id)
+    row = ProductRow.from_product(instance)
+    transaction.on_commit(lambda: set_snapshot_row(row.id, row), using=using)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_catalog_snapshot(sender, instance, using, **kwargs):
+    product_id = instance.id
+    ProductChange.objects.using(using).create(product_id=product_id)
+    transaction.on_commit(lambda: set_snapshot_row(product_id, None), using=using)
+
+
+def set_snapshot_row(product_id, row):
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        snapshot.set(product_id, row)
+
+
+'''tags of the app_cache entries, see mainapp.caching. Collections
+are tagged with products too because they show products_count. Carts are
+invalidated where they and their items are deleted (no delete receivers, so
+that deleting a cart deletes its items without loading them)'''
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_cache(sender, instance, using, **kwargs):
+    invalidate_on_commit('products', 'collections', using=using)
+
+
+@receiver([post_save, post_delete], sender=Collection)
+def invalidate_collection_cache(sender, instance, using, **kwargs):
+    invalidate_on_commit('collections', using=using)
+
+
+@receiver(post_save, sender=CartItem)
+def invalidate_cart_item_cache(sender, instance, using, **kwargs):
+    invalidate_on_commit(f'cart:{instance.cart_id}', using=using)
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def forget_cached_customer(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        customer_cache.forget(instance.user_id)
+
+
+@receiver(connection_created)
+def instrument_queries(sender, connection, **kwargs):
+    install_query_stats(connection)
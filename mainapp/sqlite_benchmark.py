@@ -0,0 +1,116 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from django.db import DatabaseError, connections, transaction
+from mainapp.loadtest import percentile
+from mainapp.transactions import conflict_kind
+
+
+'''reader and writer throughput of a sqlite file with the default backend and
+with the tuned one (mainapp.backends.sqlite3). Each profile gets a fresh file
+in a temporary directory, registered as an extra database alias for the run.
+Readers look up rows by primary key outside of transactions, writers read a
+row and then update it in one transaction, as checkout and the cart item
+upsert do'''
+
+PROFILES = {
+    'default': 'django.db.backends.sqlite3',
+    'tuned': 'mainapp.backends.sqlite3',
+}
+
+
+def add_database(alias, engine, name, options=None):
+    connections.settings[alias] = connections.configure_settings({
+        'default': {}, alias: {'ENGINE': engine, 'NAME': name, 'OPTIONS': options or {}}})[alias]
+    return connections[alias]
+
+
+def remove_database(alias):
+    connections[alias].close()
+    del connections[alias]
+    del connections.settings[alias]
+
+
+def create_table(alias, rows):
+    with connections[alias].cursor() as cursor:
+        cursor.execute('CREATE TABLE benchmark_item '
+                       '(id INTEGER PRIMARY KEY, value INTEGER NOT NULL, payload TEXT NOT NULL)')
+        cursor.executemany('INSERT INTO benchmark_item (id, value, payload) VALUES (%s, 0, %s)',
+                           [(index, 'x' * 200) for index in range(1, rows + 1)])
+
+
+class WorkerStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+
+def read(alias, rows, rng):
+    with connections[alias].cursor() as cursor:
+        cursor.execute('SELECT value, payload FROM benchmark_item WHERE id = %s', [rng.randint(1, rows)])
+        cursor.fetchone()
+
+
+def write(alias, rows, rng):
+    with transaction.atomic(using=alias):
+        with connections[alias].cursor() as cursor:
+            row_id = rng.randint(1, rows)
+            cursor.execute('SELECT value FROM benchmark_item WHERE id = %s', [row_id])
+            value = cursor.fetchone()[0]
+            cursor.execute('UPDATE benchmark_item SET value = %s WHERE id = %s', [value + 1, row_id])
+
+
+def run_worker(operation, alias, rows, stop, stats, seed):
+    rng = random.Random(seed)
+    try:
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                operation(alias, rows, rng)
+            except DatabaseError as error:
+                if conflict_kind(error) is None:
+                    raise
+                stats.errors += 1
+                continue
+            stats.latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        connections[alias].close()
+
+
+def run_profile(engine, readers=4, writers=4, duration=5.0, rows=10000, options=None):
+    '''runs the readers and writers against a fresh database file for duration
+    seconds, returns reads and writes per second, their p95 latency and the
+    number of locked errors'''
+    alias = f'sqlite_benchmark_{threading.get_ident()}'
+    with tempfile.TemporaryDirectory() as directory:
+        add_database(alias, engine, os.path.join(directory, 'benchmark.sqlite3'), options)
+        try:
+            create_table(alias, rows)
+            stop = threading.Event()
+            workers = [(read, WorkerStats()) for _ in range(readers)] + \
+                      [(write, WorkerStats()) for _ in range(writers)]
+            threads = [threading.Thread(target=run_worker, args=(operation, alias, rows, stop, stats, index))
+                       for index, (operation, stats) in enumerate(workers)]
+            for thread in threads:
+                thread.start()
+            time.sleep(duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            with connections[alias].cursor() as cursor:
+                journal_mode = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+        finally:
+            remove_database(alias)
+
+    result = {'journal_mode': journal_mode}
+    for name, operation in (('reads', read), ('writes', write)):
+        latencies = [latency for worker_operation, stats in workers if worker_operation is operation
+                     for latency in stats.latencies]
+        result[name] = {
+            'per_second': len(latencies) / duration,
+            'p95': percentile(latencies, 95),
+            'errors': sum(stats.errors for worker_operation, stats in workers if worker_operation is operation),
+        }
+    return result
@@ -0,0 +1,46 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from django.conf import settings
+
+
+'''how long a fresh worker takes to become ready and to answer its first
+requests. Every run is a new interpreter, so nothing is imported or cached
+before the measurement starts'''
+
+PROBE = '''
+import json, os, sys, time
+started = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+ready = time.perf_counter() - started
+import django.test
+client = django.test.Client(HTTP_HOST=sys.argv[2])
+latencies, statuses = [], []
+for _ in range(2):
+    request_started = time.perf_counter()
+    statuses.append(client.get(sys.argv[1]).status_code)
+    latencies.append(time.perf_counter() - request_started)
+print(json.dumps({'ready': ready, 'first_request': latencies[0],
+                  'second_request': latencies[1], 'statuses': statuses}))
+'''
+
+
+def probe(settings_module, path, host='localhost', env=None):
+    '''one interpreter: seconds until the wsgi application is ready and the
+    latency of the first two requests to path'''
+    env = {**os.environ, **(env or {}), 'DJANGO_SETTINGS_MODULE': settings_module}
+    result = subprocess.run([sys.executable, '-c', PROBE, path, host], env=env,
+                            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(settings_module, path, runs=5, host='localhost', env=None):
+    '''medians of `runs` probes, in milliseconds'''
+    probes = [probe(settings_module, path, host, env) for _ in range(runs)]
+    summary = {name: statistics.median(run[name] for run in probes) * 1000
+               for name in ('ready', 'first_request', 'second_request')}
+    summary['statuses'] = sorted({status for run in probes for status in run['statuses']})
+    return summary
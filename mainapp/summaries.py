@@ -0,0 +1,116 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, Max, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from mainapp.models import ArchivedOrder, ArchivedOrderItem, Customer, CustomerSummary, Order, OrderItem
+
+
+'''per customer order aggregates. The lifetime value counts orders with the
+complete payment status only, at the item prices of the time they were placed'''
+
+item_total = ExpressionWrapper(F('quantity') * F('unit_price'),
+                               output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def order_totals(order_ids):
+    return dict(OrderItem.objects.filter(order_id__in=order_ids)
+                .values_list('order_id').annotate(total=Sum(item_total)))
+
+
+def add_to_summary(customer_id, orders=0, value=Decimal(0), placed_at=None):
+    # an insert that ignores an existing row instead of get_or_create's select and savepoint
+    CustomerSummary.objects.bulk_create([CustomerSummary(customer_id=customer_id)], ignore_conflicts=True)
+    updates = {'order_count': F('order_count') + orders,
+               'lifetime_value': F('lifetime_value') + value}
+    if placed_at is not None:
+        updates['last_order_at'] = Greatest(
+            Coalesce(F('last_order_at'), Value(placed_at)), Value(placed_at))
+    CustomerSummary.objects.filter(customer_id=customer_id).update(**updates)
+
+
+def add_values_to_summaries(values):
+    '''adds {customer_id: value} to the lifetime values with one UPDATE per chunk'''
+    customer_ids = list(values)
+    for start in range(0, len(customer_ids), 500):
+        chunk = customer_ids[start:start + 500]
+        CustomerSummary.objects.bulk_create(
+            [CustomerSummary(customer_id=customer_id) for customer_id in chunk], ignore_conflicts=True)
+        CustomerSummary.objects.filter(customer_id__in=chunk).update(
+            lifetime_value=F('lifetime_value') + Case(
+                *[When(customer_id=customer_id, then=Value(values[customer_id])) for customer_id in chunk],
+                default=Value(Decimal(0)), output_field=DecimalField(max_digits=12, decimal_places=2)))
+
+
+def record_order_placed(order):
+    value = Decimal(0)
+    if order.payment_status == Order.PAYMENT_STATUS_COMPLETE:
+        value = order_totals([order.id]).get(order.id, Decimal(0))
+    add_to_summary(order.customer_id, orders=1, value=value, placed_at=order.placed_at)
+
+
+def record_payment_status_change(order, old_status):
+    '''moves the order total in or out of the lifetime value when
+    the order becomes complete or stops being complete'''
+    complete = Order.PAYMENT_STATUS_COMPLETE
+    if (old_status == complete) == (order.payment_status == complete):
+        return
+    total = order_totals([order.id]).get(order.id, Decimal(0))
+    sign = 1 if order.payment_status == complete else -1
+    add_to_summary(order.customer_id, value=sign * total)
+
+
+def record_order_deleted(order):
+    '''order items are protected, an order is deleted after its items
+    and they have taken their value out already, see record_item_change'''
+    add_to_summary(order.customer_id, orders=-1)
+    last_order_at = max(filter(None, (
+        model.objects.filter(customer_id=order.customer_id).aggregate(last=Max('placed_at'))['last']
+        for model in (Order, ArchivedOrder))), default=None)
+    CustomerSummary.objects.filter(customer_id=order.customer_id).update(last_order_at=last_order_at)
+
+
+def record_item_change(item, quantity_change):
+    '''moves the value of items added to, changed in or deleted
+    from a complete order in or out of the lifetime value'''
+    if not quantity_change:
+        return
+    order = Order.objects.only('customer_id', 'payment_status').get(pk=item.order_id)
+    if order.payment_status == Order.PAYMENT_STATUS_COMPLETE:
+        add_to_summary(order.customer_id, value=quantity_change * item.unit_price)
+
+
+def rebuild_summaries(customer_ids=None):
+    '''recomputes the summaries from the order tables (hot and archived)
+    with two grouped queries per table'''
+    customers = Customer.objects.all()
+    if customer_ids is not None:
+        customers = customers.filter(id__in=customer_ids)
+
+    counts, values, last_order_at = defaultdict(int), defaultdict(Decimal), {}
+    for order_model, item_model in ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)):
+        orders = order_model.objects.all()
+        if customer_ids is not None:
+            orders = orders.filter(customer_id__in=customer_ids)
+        for customer_id, order_count, placed_at in orders.values_list('customer_id')\
+                .annotate(order_count=Count('id'), last_order_at=Max('placed_at')):
+            counts[customer_id] += order_count
+            last_order_at[customer_id] = max(
+                placed_at, last_order_at.get(customer_id, placed_at))
+        for customer_id, total in item_model.objects\
+                .filter(order__in=orders.filter(payment_status=Order.PAYMENT_STATUS_COMPLETE))\
+                .values_list('order__customer_id').annotate(total=Sum(item_total)):
+            values[customer_id] += total or Decimal(0)
+
+    summaries = [CustomerSummary(
+        customer_id=customer_id,
+        order_count=counts[customer_id],
+        lifetime_value=values[customer_id],
+        last_order_at=last_order_at.get(customer_id))
+        for customer_id in customers.values_list('id', flat=True)]
+
+    existing = CustomerSummary.objects.all()
+    if customer_ids is not None:
+        existing = existing.filter(customer_id__in=customer_ids)
+    existing.delete()
+    CustomerSummary.objects.bulk_create(summaries, batch_size=1000)
+    return len(summaries)
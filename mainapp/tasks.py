@@ -0,0 +1,54 @@
+import logging
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from templated_mail.mail import BaseEmailMessage
+from mainapp.metrics import registry
+from mainapp.models import Order, Product, ProductChange, StockSync
+from mainapp.outbox import handler
+
+
+analytics_logger = logging.getLogger('mainapp.analytics')
+inventory_shortfalls = registry.counter(
+    'inventory_shortfalls_total', 'Ordered items with less stock left than ordered, the stock is set to 0')
+
+'''side effects of checkout, enqueued in the order transaction
+and executed by the run_outbox_worker command'''
+
+
+@handler('order_placed')
+def send_order_confirmation(payload):
+    order = Order.objects.select_related('customer').get(pk=payload['order_id'])
+    items = order.orderitems.select_related('product')
+    message = BaseEmailMessage(
+        template_name='emails/order_confirmation.html',
+        context={'order': order, 'customer': order.customer, 'items': items})
+    message.send([order.customer.email])
+
+
+@handler('order_placed')
+def sync_stock(payload):
+    '''the order is recorded in the transaction of the inventory updates,
+    a message delivered again after they were committed is skipped'''
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                StockSync.objects.create(order_id=payload['order_id'])
+        except IntegrityError:
+            return
+        for item in payload['items']:
+            products = Product.objects.filter(pk=item['product_id'])
+            # the second update only runs for an oversold product
+            if not products.filter(inventory__gte=item['quantity'])\
+                    .update(inventory=F('inventory') - item['quantity'], updated_at=timezone.now()):
+                if products.update(inventory=Greatest(F('inventory') - item['quantity'], 0),
+                                   updated_at=timezone.now()):
+                    inventory_shortfalls.inc()
+        # queryset.update() sends no signals, the catalog snapshots learn of the changes here
+        ProductChange.record(item['product_id'] for item in payload['items'])
+
+
+@handler('order_placed')
+def track_order_placed(payload):
+    analytics_logger.info('order_placed', extra=payload)
@@ -0,0 +1,139 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from mainapp.metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+'''transactions that are retried when they lose a conflict with a concurrent one:
+deadlocks, serialization failures and "database is locked" on SQLite. The whole
+transaction is run again after a jittered exponential backoff, so the retried
+function must not have side effects outside the database.
+
+Only the outermost transaction can be retried, a conflict rolls the whole
+transaction back on Postgres. Inside an atomic block the function runs once
+in a savepoint and the error goes up to the retrying transaction around it'''
+
+
+def get_max_attempts():
+    return getattr(settings, 'TRANSACTION_MAX_ATTEMPTS', 5)
+
+
+def get_backoff():
+    return (getattr(settings, 'TRANSACTION_RETRY_BASE_DELAY', 0.01),
+            getattr(settings, 'TRANSACTION_RETRY_MAX_DELAY', 0.5))
+
+
+def conflict_kind(error):
+    '''deadlock, serialization or locked for errors a retry can fix, otherwise None'''
+    if not isinstance(error, OperationalError):
+        return None
+    message = str(error).lower()
+    pgcode = getattr(error.__cause__, 'pgcode', None)
+    if 'deadlock' in message or pgcode == '40P01':
+        return 'deadlock'
+    if 'could not serialize' in message or pgcode == '40001':
+        return 'serialization'
+    if 'is locked' in message or pgcode == '55P03':
+        return 'locked'
+    return None
+
+
+def retry_delay(attempt):
+    '''full jitter over an exponential backoff, attempt counts from 1'''
+    base_delay, max_delay = get_backoff()
+    return random.uniform(0, min(base_delay * 2 ** (attempt - 1), max_delay))
+
+
+class RetryMetrics:
+    '''per transaction name: transactions run, retries by conflict kind and
+    transactions that failed after the last attempt'''
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, name, event):
+        with self.lock:
+            self.counts[name, event] += 1
+
+    def snapshot(self):
+        with self.lock:
+            counts = dict(self.counts)
+        stats = {}
+        for (name, event), value in counts.items():
+            stats.setdefault(name, {'transactions': 0, 'retries': {}, 'exhausted': 0})
+            if event in ('transactions', 'exhausted'):
+                stats[name][event] = value
+            else:
+                stats[name]['retries'][event] = value
+        return stats
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+
+retry_metrics = RetryMetrics()
+
+
+@registry.collector
+def collect_retries():
+    stats = retry_metrics.snapshot()
+    return {
+        'transactions_total': {
+            'type': 'counter', 'help': 'Retrying transactions run',
+            'samples': [[{'name': name}, counts['transactions']] for name, counts in stats.items()]},
+        'transaction_retries_total': {
+            'type': 'counter', 'help': 'Transactions run again after a conflict, by conflict kind',
+            'samples': [[{'name': name, 'kind': kind}, value] for name, counts in stats.items()
+                        for kind, value in counts['retries'].items()]},
+        'transactions_exhausted_total': {
+            'type': 'counter', 'help': 'Transactions that failed after the last attempt',
+            'samples': [[{'name': name}, counts['exhausted']] for name, counts in stats.items()]},
+    }
+
+
+def run_in_transaction(name, func, *args, using=DEFAULT_DB_ALIAS, retry_on=(), **kwargs):
+    '''runs func in transaction.atomic(), retrying conflicts up to
+    TRANSACTION_MAX_ATTEMPTS times. retry_on adds exception types that are
+    retried too, e.g. the IntegrityError of a concurrent insert'''
+    if connections[using].in_atomic_block:
+        with transaction.atomic(using=using):
+            return func(*args, **kwargs)
+
+    retry_metrics.count(name, 'transactions')
+    max_attempts = get_max_attempts()
+    for attempt in range(1, max_attempts + 1):
+        try:
+            with transaction.atomic(using=using):
+                return func(*args, **kwargs)
+        except Exception as error:
+            kind = conflict_kind(error)
+            if kind is None and isinstance(error, tuple(retry_on)):
+                kind = type(error).__name__
+            if kind is None:
+                raise
+            if attempt == max_attempts:
+                retry_metrics.count(name, 'exhausted')
+                logger.warning('transaction %s failed after %s attempts: %s', name, attempt, error)
+                raise
+            retry_metrics.count(name, kind)
+        time.sleep(retry_delay(attempt))
+
+
+def retrying_transaction(name, **options):
+    '''decorator form of run_in_transaction'''
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return run_in_transaction(name, func, *args, **options, **kwargs)
+        return wrapper
+    return decorator
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework_nested.routers import DefaultRouter, NestedDefaultRouter
-from mainapp.views import CollectionViewSet, OrderViewSet, OrderItemViewSet, ProductViewSet, CustomerViewSet, CartViewSet, CartItemViewSet
+from mainapp.views import metrics, AuthViewSet, CollectionViewSet, CustomerOrderViewSet, OrderViewSet, OrderItemViewSet, ProductViewSet, CustomerViewSet, CartViewSet, CartItemViewSet
 
 router = DefaultRouter()
 
@@ -9,16 +9,22 @@ router.register('products', ProductViewSet, basename='products')
 router.register('customers', CustomerViewSet)
 router.register('carts', CartViewSet)
 router.register('orders', OrderViewSet, basename='orders')
+router.register('auth', AuthViewSet, basename='auth')
 
 
 carts_router = NestedDefaultRouter(router, 'carts', lookup='cart')
 carts_router.register('items', CartItemViewSet, basename='cart-items')
 
+customers_router = NestedDefaultRouter(router, 'customers', lookup='customer')
+customers_router.register('orders', CustomerOrderViewSet, basename='customer-orders')
+
 orders_router = NestedDefaultRouter(router, 'orders', lookup='order')
 orders_router.register('items', OrderItemViewSet, basename='order-items')
 
 urlpatterns = [
+    path('metrics', metrics, name='metrics'),
     path('', include(router.urls)),
     path('', include(carts_router.urls)),
+    path('', include(customers_router.urls)),
     path('', include(orders_router.urls)),
 ]
@@ -1,25 +1,50 @@
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
-from rest_framework.mixins import RetrieveModelMixin, DestroyModelMixin, CreateModelMixin
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.mixins import ListModelMixin, RetrieveModelMixin, DestroyModelMixin, CreateModelMixin
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser, AllowAny, IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from django.db.models.aggregates import Count
-from mainapp.permissions import IsAdminOrReadOnly
-from mainapp.pagination import DefaultPagination
-from mainapp.filters import ProductFilter
-from mainapp.models import Collection, Product, Customer, Cart, CartItem, Order, OrderItem
-from mainapp.serializers import AddCartItemSerializer, CollectionSerializer, CreateOrderSerializer, ProductSerializer, CustomerSerializer, CartSerializer, CartItemSerializer, UpdateCartItemSerializer, OrderSerializer, OrderItemSerializer, UpdateOrderSerializer
+from django.conf import settings
+from mainapp.permissions import IsAdminOrReadOnly, IsAdminOrOwnCustomer, IsAdminOrMetricsScraper
+from mainapp import catalog, facets
+from mainapp.authentication import issue_token, revocations
+from mainapp.caching import app_cache, cache_key, invalidate_on_commit
+from mainapp.idempotency import idempotent
+from mainapp import metrics as app_metrics
+from mainapp.order_status import bulk_update_payment_status
+from mainapp.projections import ProjectionMixin
+from mainapp.pagination import DefaultPagination, OrderHistoryPagination
+from mainapp.filters import ProductFilter, CustomerSearchFilter
+from mainapp.models import Collection, Product, Customer, CustomerSummary, Cart, CartItem, Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+from mainapp.serializers import AddCartItemSerializer, BulkUpdateOrderSerializer, CollectionSerializer, CreateOrderSerializer, ProductSerializer, CustomerSerializer, CustomerSummarySerializer, TokenObtainSerializer, CartSerializer, CartItemSerializer, UpdateCartItemSerializer, OrderSerializer, OrderItemSerializer, UpdateOrderSerializer
 
 
-class CollectionViewSet(ModelViewSet):
+class CollectionViewSet(ProjectionMixin, ModelViewSet):
     serializer_class = CollectionSerializer
     queryset = Collection.objects.annotate(
         products_count=Count('product')).all()
     permission_classes = [IsAdminOrReadOnly]
 
+    '''list and retrieve responses go through app_cache, invalidated by
+    the Collection and Product signals'''
+
+    def list(self, request, *args, **kwargs):
+        return Response(app_cache.get_or_set(
+            cache_key('collections', request.query_params),
+            lambda: super(CollectionViewSet, self).list(request, *args, **kwargs).data,
+            settings.APP_CACHE_TIMEOUT, tags=['collections']))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(app_cache.get_or_set(
+            cache_key(f'collection:{kwargs["pk"]}', request.query_params),
+            lambda: super(CollectionViewSet, self).retrieve(request, *args, **kwargs).data,
+            settings.APP_CACHE_TIMEOUT, tags=['collections']))
+
     def destroy(self, request, pk):
         collection = get_object_or_404(Collection, pk=pk)
         product = Product.objects.filter(collection=collection).count()
@@ -29,7 +54,7 @@ class CollectionViewSet(ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ProjectionMixin, ModelViewSet):
     serializer_class = ProductSerializer
     queryset = Product.objects.all()
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -39,19 +64,62 @@ class ProductViewSet(ModelViewSet):
     search_fields = ['title', 'description']
     ordering_fields = ['unit_price']
 
+    '''filtering, ordering and counting go to the catalog snapshot when one is
+    loaded and the query only uses what it holds. The page is served from the
+    snapshot when the requested fields allow it, otherwise its rows are
+    fetched by primary key'''
+
+    def list(self, request, *args, **kwargs):
+        snapshot = catalog.get_snapshot()
+        params = catalog.parse_params(request.query_params) if snapshot else None
+        if params is None:
+            return super().list(request, *args, **kwargs)
+
+        snapshot = catalog.refresh_snapshot()
+        page = self.paginate_queryset(snapshot.query(**params))
+        fields = self.get_requested_fields()
+        if fields is None or not set(fields) <= catalog.FIELDS:
+            products = self.filter_queryset(self.get_queryset())\
+                .in_bulk([row.id for row in page])
+            page = [products[row.id] for row in page if row.id in products]
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    '''products per collection and per price bucket for the list parameters,
+    one grouped query or none when the snapshot engine can answer'''
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        def compute():
+            bounds = facets.price_bounds()
+            snapshot = catalog.get_snapshot()
+            params = catalog.parse_params(request.query_params) \
+                if snapshot and snapshot.engine else None
+            if params is None:
+                groups = facets.facet_groups(self.filter_queryset(self.get_queryset()), bounds)
+            else:
+                groups = catalog.refresh_snapshot().engine.facet_groups(bounds, **params)
+            return facets.build_facets(groups, bounds)
+
+        return Response(app_cache.get_or_set(facets.cache_key(request.query_params), compute,
+                                             settings.FACETS_CACHE_TIMEOUT, tags=['products']))
+
     def destroy(self, request, pk):
         product = get_object_or_404(Product, pk=pk)
-        orderitems = OrderItem.objects.filter(product=product).count()
+        orderitems = OrderItem.objects.filter(product=product).count() + \
+            ArchivedOrderItem.objects.filter(product=product).count()
         if orderitems > 0:
             return Response({'error': 'Нельзя удалить продукт т.к. этот продукт есть в существующих заказах'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         product.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class CustomerViewSet(ModelViewSet):
+class CustomerViewSet(ProjectionMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'put', 'patch', 'delete']
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
+    filter_backends = [CustomerSearchFilter]
+    pagination_class = DefaultPagination
 
     def get_permissions(self):
         if self.request.method == 'POST':
@@ -60,18 +128,62 @@ class CustomerViewSet(ModelViewSet):
 
     def destroy(self, request, pk):
         customer = Customer.objects.filter(pk=pk).first()
-        order = Order.objects.filter(customer=customer).count()
+        order = Order.objects.filter(customer=customer).count() + \
+            ArchivedOrder.objects.filter(customer=customer).count()
         if order > 0:
             return Response({'error': 'Нельзя удалить клиента у которого есть незавершенный заказ'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         customer.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class AuthViewSet(GenericViewSet):
+    '''access tokens for API clients, see mainapp.authentication'''
+    serializer_class = TokenObtainSerializer
+
+    def get_permissions(self):
+        if self.action == 'token':
+            return [AllowAny()]
+        return [IsAuthenticated()]
+
+    @action(detail=False, methods=['post'])
+    def token(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        customer_id = Customer.objects.filter(user=user).values_list('id', flat=True).first()
+        return Response({'access': issue_token(user, customer_id),
+                         'expires_in': settings.JWT_ACCESS_TOKEN_LIFETIME})
+
+    @action(detail=False, methods=['post'])
+    def revoke(self, request):
+        if not isinstance(request.auth, dict):
+            return Response({'error': 'Запрос выполнен без токена'}, status=status.HTTP_400_BAD_REQUEST)
+        revocations.revoke(request.auth['jti'], request.auth['exp'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class CartViewSet(RetrieveModelMixin, CreateModelMixin, DestroyModelMixin, GenericViewSet):
     serializer_class = CartSerializer
     '''use prefetch_related because of duplicate queries on items and products'''
     queryset = Cart.objects.prefetch_related('items__product').all()
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    '''cached until the cart or its items change. Product titles and prices
+    show up to APP_CACHE_TIMEOUT late, checkout reads the current ones'''
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(app_cache.get_or_set(
+            cache_key(f'cart:{kwargs["pk"]}', request.query_params),
+            lambda: super(CartViewSet, self).retrieve(request, *args, **kwargs).data,
+            settings.APP_CACHE_TIMEOUT, tags=[f'cart:{kwargs["pk"]}']))
+
+    def perform_destroy(self, instance):
+        invalidate_on_commit(f'cart:{instance.pk}')
+        instance.delete()
+
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch',
@@ -91,39 +203,81 @@ class CartItemViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'cart_id': self.kwargs['cart_pk']}
 
+    def perform_destroy(self, instance):
+        invalidate_on_commit(f'cart:{instance.cart_id}')
+        instance.delete()
 
-class OrderViewSet(ModelViewSet):
+
+class OrderViewSet(ProjectionMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
 
     def get_permissions(self):
-        if self.request.method in ['PATCH', 'DELETE']:
+        if self.request.method in ['PATCH', 'DELETE'] or self.action == 'bulk_update_status':
             return [IsAdminUser()]
         return [AllowAny()]
 
+    '''takes {"updates": [{"order_id": 1, "payment_status": "C"}, ...]} from the
+    payment provider reconciliation and reports missing and invalid rows'''
+
+    @action(detail=False, methods=['post'])
+    def bulk_update_status(self, request):
+        serializer = BulkUpdateOrderSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(bulk_update_payment_status(serializer.validated_data['updates']))
+
     '''after creating an order returns order object, not cart_id'''
 
+    @idempotent
     def create(self, request, *args, **kwargs):
+        if not request.customer:
+            # an authenticated user without a customer (e.g. staff) will not be let in by logging in again
+            if request.user.is_authenticated:
+                return Response({'error': 'Оформить заказ может только покупатель'}, status=status.HTTP_403_FORBIDDEN)
+            return Response({'error': 'Оформить заказ может только авторизованный покупатель'}, status=status.HTTP_401_UNAUTHORIZED)
         serializer = CreateOrderSerializer(data=request.data,
-                                           context={'customer_id': self.request.customer.id})
+                                           context={'customer': request.customer})
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
         serializer = OrderSerializer(order)
-        return Response(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def get_serializer_class(self):
+        if self.action == 'bulk_update_status':
+            return BulkUpdateOrderSerializer
         if self.request.method == 'POST':
             return CreateOrderSerializer
         elif self.request.method == 'PATCH':
             return UpdateOrderSerializer
         return OrderSerializer
 
+    '''staff read the archive tables with ?archived=true, retrieving an order
+    that is no longer in the hot table falls back to the archive'''
+
+    read_archive = False
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.read_archive = request.user.is_staff and self.action in ('list', 'retrieve') \
+            and request.query_params.get('archived') == 'true'
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            if self.read_archive or not request.user.is_staff:
+                raise
+            self.read_archive = True
+            return super().retrieve(request, *args, **kwargs)
+
     def get_queryset(self):
+        if self.read_archive:
+            return ArchivedOrder.objects.all()
         if self.request.user.is_staff:
             return Order.objects.all()
 
-        customer_id = Customer.objects.get(
-            'customer_id').get(customer_id=self.request.customer.id)
-        return Order.objects.filter(customer_id=customer_id)
+        if not self.request.customer:
+            return Order.objects.none()
+        return Order.objects.filter(customer_id=self.request.customer.id)
 
     def destroy(self, request, pk):
         order = get_object_or_404(Order, pk=pk)
@@ -133,7 +287,26 @@ class OrderViewSet(ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class OrderItemViewSet(ModelViewSet):
+class CustomerOrderViewSet(ProjectionMixin, ListModelMixin, GenericViewSet):
+    '''order history of one customer, newest first, with the precomputed summary'''
+    serializer_class = OrderSerializer
+    pagination_class = OrderHistoryPagination
+    permission_classes = [IsAdminOrOwnCustomer]
+
+    def get_queryset(self):
+        return Order.objects.filter(customer_id=self.kwargs['customer_pk'])
+
+    def list(self, request, *args, **kwargs):
+        if not Customer.objects.filter(pk=self.kwargs['customer_pk']).exists():
+            raise Http404
+        response = super().list(request, *args, **kwargs)
+        summary = CustomerSummary.objects.filter(customer_id=self.kwargs['customer_pk']).first()\
+            or CustomerSummary(customer_id=self.kwargs['customer_pk'])
+        response.data['summary'] = CustomerSummarySerializer(summary).data
+        return response
+
+
+class OrderItemViewSet(ProjectionMixin, ModelViewSet):
     http_method_names = ['get', 'put',
                          'delete', 'head', 'options']
 
@@ -144,3 +317,14 @@ class OrderItemViewSet(ModelViewSet):
         if self.request.user.is_staff:
             return OrderItem.objects.all()
         return OrderItem.objects.filter(order_id=self.kwargs['order_pk'])
+
+
+'''the metrics of all workers in the Prometheus text format, for staff
+and the scrapers listed in METRICS_ALLOWED_IPS'''
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminOrMetricsScraper])
+def metrics(request):
+    return HttpResponse(app_metrics.render(app_metrics.collect()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,40 @@
+import inspect
+from django.apps import apps
+from django.urls import get_resolver
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+
+'''work a worker would otherwise do in its first requests, run by
+MainappConfig.ready when WARM_UP_ON_READY is set. It makes no database
+queries, so it is safe in the gunicorn master before the workers fork
+and the warmed state is shared with them'''
+
+API_SETTINGS = [
+    'DEFAULT_AUTHENTICATION_CLASSES', 'DEFAULT_PERMISSION_CLASSES', 'DEFAULT_RENDERER_CLASSES',
+    'DEFAULT_PARSER_CLASSES', 'DEFAULT_CONTENT_NEGOTIATION_CLASS', 'DEFAULT_METADATA_CLASS',
+    'DEFAULT_VERSIONING_CLASS', 'DEFAULT_THROTTLE_CLASSES', 'EXCEPTION_HANDLER',
+]
+
+
+def warm_up():
+    # imports the urlconf with the views and serializers and builds the lookup tables
+    resolver = get_resolver()
+    resolver.reverse_dict
+
+    # drf imports the classes named in its settings on first access
+    for name in API_SETTINGS:
+        getattr(api_settings, name)
+
+    for model in apps.get_models():
+        model._meta.get_fields()
+
+    # model serializers without Meta are bases of the others
+    from mainapp import serializers as mainapp_serializers
+    for _, serializer_class in inspect.getmembers(mainapp_serializers, inspect.isclass):
+        if serializer_class.__module__ != mainapp_serializers.__name__ \
+                or not issubclass(serializer_class, serializers.Serializer):
+            continue
+        if issubclass(serializer_class, serializers.ModelSerializer) and not hasattr(serializer_class, 'Meta'):
+            continue
+        serializer_class().fields
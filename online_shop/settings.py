@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,12 +45,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mainapp.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     "debug_toolbar.middleware.DebugToolbarMiddleware",
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'mainapp.middleware.CustomerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -78,14 +81,37 @@ WSGI_APPLICATION = 'online_shop.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# SQLITE_TUNING=1 opts into the tuned sqlite backend for deployments with several
+# workers on one file: WAL, busy timeout, mmap and BEGIN IMMEDIATE transactions,
+# see mainapp/backends/sqlite3/base.py and the benchmark_sqlite command
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'mainapp.backends.sqlite3' if os.environ.get('SQLITE_TUNING') else 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
 
 
+# the shared tier of mainapp.caching, redis through django-redis when REDIS_URL is set
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+        }
+    }
+
+# mainapp.caching: in-process LRU size and ttl (seconds, also the delay before an invalidation
+# from another worker is seen), recomputation lock timeout and the early expiration factor
+APP_CACHE_ALIAS = 'default'
+APP_CACHE_LOCAL_SIZE = 1024
+APP_CACHE_LOCAL_TTL = 2
+APP_CACHE_LOCK_TIMEOUT = 10
+APP_CACHE_BETA = 1.0
+APP_CACHE_TIMEOUT = 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -110,7 +136,79 @@ INTERNAL_IPS = [
 
 STATIC_URL = "static/"
 
-AUTH_USER_MODEL = 'users.CustomUser'
+AUTH_USER_MODEL = 'mainapp.CustomUser'
+
+# pbkdf2_sha256 with the cost of PASSWORD_HASHER_ITERATIONS, stored hashes with
+# another iteration count are rehashed on the next successful login
+PASSWORD_HASHERS = [
+    'mainapp.hashers.ConfigurablePBKDF2PasswordHasher',
+]
+PASSWORD_HASHER_ITERATIONS = 390000
+
+# session authentication stays first so that anonymous requests keep getting 403
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'mainapp.authentication.JWTAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+}
+
+# access tokens of mainapp.authentication: new tokens are signed with the active key,
+# every key listed is accepted (secrets for HS*, {'private': ..., 'public': ...} PEM keys otherwise)
+JWT_ALGORITHM = 'HS256'
+JWT_SIGNING_KEYS = {'default': SECRET_KEY}
+JWT_ACTIVE_KEY_ID = 'default'
+JWT_ACCESS_TOKEN_LIFETIME = 15 * 60
+JWT_REVOCATION_CACHE_SIZE = 10000
+# revoked token ids, this cache has to be shared by all the workers (not locmem)
+JWT_REVOCATION_CACHE_ALIAS = 'default'
+
+# request.customer of session users is cached per worker for CUSTOMER_CACHE_TTL seconds
+CUSTOMER_CACHE_SIZE = 10000
+CUSTOMER_CACHE_TTL = 30
+
+# how long a stored response is replayed for a repeated Idempotency-Key (seconds)
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+
+# outbox worker: failed messages are retried with backoff up to OUTBOX_MAX_ATTEMPTS,
+# a claimed message is invisible to other workers for OUTBOX_LEASE seconds
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_LEASE = 300
+
+# catalog snapshot written by build_catalog_snapshot and memory-mapped by every worker,
+# product changes made by other workers are polled every REFRESH_INTERVAL seconds. Ids of
+# the change log skipped by a poll (transactions that commit late) are polled again for
+# GAP_TIMEOUT seconds, transactions writing products have to commit within that time
+CATALOG_SNAPSHOT_PATH = BASE_DIR / 'catalog.snapshot'
+CATALOG_SNAPSHOT_REFRESH_INTERVAL = 5
+CATALOG_CHANGE_GAP_TIMEOUT = 60
+# changed products kept per worker on top of the snapshot, past that the snapshot is rebuilt
+CATALOG_SNAPSHOT_MAX_CHANGES = 10000
+
+# upper bounds of the price buckets counted by /products/facets/, the last bucket is open,
+# facet counts are cached per normalized query for FACETS_CACHE_TIMEOUT seconds
+FACET_PRICE_BUCKETS = ['10', '50', '100', '500', '1000']
+FACETS_CACHE_TIMEOUT = 60
+
+# mainapp.metrics: every process writes its metrics to METRICS_DIR at most every
+# METRICS_FLUSH_INTERVAL seconds and /metrics adds them up, without it /metrics shows
+# the metrics of the worker answering. /metrics answers staff and METRICS_ALLOWED_IPS, a comma
+# separated list of scraper addresses. Empty by default: behind a reverse proxy on the same
+# host every request comes from 127.0.0.1, so allowing it would make /metrics public
+METRICS_DIR = os.environ.get('METRICS_DIR') or os.environ.get('GUNICORN_METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 1
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+
+# mainapp.query_stats: count and time of every query per SQL fingerprint, queries taking
+# SLOW_QUERY_THRESHOLD seconds or more are traced to their view or serializer and explained.
+# None turns it off. Written to METRICS_DIR like the metrics, read by top_queries
+SLOW_QUERY_THRESHOLD = 0.1
+QUERY_STATS_MAX_FINGERPRINTS = 1000
+
+# resolve the urlconf and build the serializers in MainappConfig.ready instead of on the
+# first requests (mainapp/warmup.py), on in the production profile
+WARM_UP_ON_READY = False
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.0/topics/i18n/
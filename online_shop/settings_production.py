@@ -0,0 +1,40 @@
+"""
+Production profile: DJANGO_SETTINGS_MODULE=online_shop.settings_production
+
+Leaves out the debug-only apps and middleware and warms the worker up in
+MainappConfig.ready. DJANGO_SECRET_KEY and REDIS_URL (the cache shared by the
+workers, token revocations are kept there) are required, DJANGO_ALLOWED_HOSTS
+is a comma separated list.
+"""
+
+import os
+from online_shop.settings import *  # noqa: F401,F403
+from online_shop.settings import INSTALLED_APPS, MIDDLEWARE
+
+DEBUG = False
+
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+JWT_SIGNING_KEYS = {'default': SECRET_KEY}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+    }
+}
+
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',') if host]
+
+DEBUG_APPS = ['debug_toolbar']
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in DEBUG_APPS]
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE
+              if not any(middleware.startswith(f'{app}.') for app in DEBUG_APPS)]
+
+# the browsable api renders html with the template engine on every browser request
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,  # noqa: F405
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+}
+
+WARM_UP_ON_READY = True
@@ -1,6 +1,16 @@
 import pytest
 from rest_framework.test import APIClient
-from django.contrib.auth.models import User
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from model_bakery import baker
+from mainapp import catalog
+from mainapp.authentication import revocations
+from mainapp.caching import app_cache
+from mainapp.metrics import registry
+from mainapp.middleware import customer_cache
+from mainapp.models import Customer
+from mainapp.query_stats import query_stats
+from mainapp.transactions import retry_metrics
 
 
 @pytest.fixture
@@ -11,7 +21,30 @@ def api_client():
 
 @pytest.fixture
 def auth_user(api_client):
+    '''authenticates a saved user, users who are not staff get a customer'''
     def do_auth_user(is_staff=False):
-        return api_client.force_authenticate(user=User(is_staff=is_staff))
+        user = baker.make(get_user_model(), is_staff=is_staff)
+        if not is_staff:
+            baker.make(Customer, user=user)
+        return api_client.force_authenticate(user=user)
     return do_auth_user
 
+
+@pytest.fixture(autouse=True)
+def no_catalog_snapshot():
+    '''a snapshot built from a development database must not answer test requests'''
+    catalog.unload_snapshot()
+    yield
+    catalog.unload_snapshot()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    app_cache.local.clear()
+    app_cache.metrics.reset()
+    revocations.clear()
+    customer_cache.clear()
+    retry_metrics.reset()
+    registry.reset()
+    query_stats.reset()
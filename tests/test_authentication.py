@@ -0,0 +1,144 @@
+import time
+import jwt
+import pytest
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from model_bakery import baker
+from mainapp.authentication import check_revocation_cache, issue_token
+from mainapp.models import Customer, CustomUser
+from mainapp.provisioning import provision_customer
+
+
+token_url = '/auth/token/'
+
+
+@pytest.fixture(autouse=True)
+def cheap_hasher(settings):
+    settings.PASSWORD_HASHER_ITERATIONS = 1000
+
+
+@pytest.fixture
+def token_client(api_client):
+    def do_token_client(user, customer_id=None):
+        api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_token(user, customer_id)}')
+        return api_client
+    return do_token_client
+
+
+class TestTokenObtain:
+    @pytest.mark.django_db
+    def test_token_carries_claims(self, api_client, settings):
+        customer = provision_customer('a@example.com', 'secret', first_name='a', last_name='b',
+                                      phone='1', street='c', house='1', flat='2')
+
+        response = api_client.post(token_url, {'email': 'a@example.com', 'password': 'secret'})
+
+        assert response.status_code == status.HTTP_200_OK
+        claims = jwt.decode(response.data['access'], settings.SECRET_KEY, algorithms=['HS256'])
+        assert claims['user_id'] == customer.user_id
+        assert claims['customer_id'] == customer.id
+        assert claims['is_staff'] is False
+        assert jwt.get_unverified_header(response.data['access'])['kid'] == 'default'
+
+    @pytest.mark.django_db
+    def test_wrong_password_returns_400(self, api_client):
+        CustomUser.objects.create_user('a@example.com', 'secret')
+
+        response = api_client.post(token_url, {'email': 'a@example.com', 'password': 'wrong'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestJWTAuthentication:
+    @pytest.mark.django_db
+    def test_staff_token_needs_no_user_query(self, token_client):
+        user = baker.make(CustomUser, is_staff=True)
+        baker.make(Customer)
+
+        with CaptureQueriesContext(connection) as context:
+            response = token_client(user).get('/customers/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert not any('mainapp_customuser' in query['sql'] for query in context.captured_queries)
+
+    @pytest.mark.django_db
+    def test_non_staff_token_is_forbidden(self, token_client):
+        user = baker.make(CustomUser, is_staff=False)
+
+        response = token_client(user).get('/customers/')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    @pytest.mark.django_db
+    def test_expired_token_is_rejected(self, api_client, settings):
+        settings.JWT_ACCESS_TOKEN_LIFETIME = -1
+        user = baker.make(CustomUser, is_staff=True)
+        api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_token(user)}')
+
+        response = api_client.get('/customers/')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+        assert response.data['detail'] == 'Срок действия токена истек'
+
+    @pytest.mark.django_db
+    def test_key_rotation(self, api_client, settings):
+        user = baker.make(CustomUser, is_staff=True)
+        old_token = issue_token(user)
+
+        settings.JWT_SIGNING_KEYS = {'default': settings.SECRET_KEY, '2': 'new secret'}
+        settings.JWT_ACTIVE_KEY_ID = '2'
+        new_token = issue_token(user)
+        assert jwt.get_unverified_header(new_token)['kid'] == '2'
+        for token in (old_token, new_token):
+            api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+            assert api_client.get('/customers/').status_code == status.HTTP_200_OK
+
+        settings.JWT_SIGNING_KEYS = {'2': 'new secret'}
+        api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {old_token}')
+        response = api_client.get('/customers/')
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+        assert response.data['detail'] == 'Токен подписан неизвестным ключом'
+
+    @pytest.mark.django_db
+    def test_forged_token_is_rejected(self, api_client):
+        token = jwt.encode({'user_id': 1, 'is_staff': True, 'iat': int(time.time()),
+                            'exp': int(time.time()) + 60, 'jti': 'x'},
+                           'guess', algorithm='HS256', headers={'kid': 'default'})
+        api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        response = api_client.get('/customers/')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    @pytest.mark.django_db
+    def test_revoked_token_is_rejected(self, token_client):
+        client = token_client(baker.make(CustomUser, is_staff=True))
+
+        response = client.post('/auth/revoke/')
+
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        response = client.get('/customers/')
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+        assert response.data['detail'] == 'Токен отозван'
+
+
+class TestRevocationCacheCheck:
+    def test_process_local_cache_is_an_error(self, settings):
+        settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+        assert [error.id for error in check_revocation_cache(None)] == ['mainapp.E001']
+
+    def test_shared_cache_passes(self, settings):
+        settings.CACHES = {'default': {'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': 'redis://cache'}}
+
+        assert check_revocation_cache(None) == []
+
+    def test_worker_does_not_start_without_shared_cache(self, settings):
+        settings.DEBUG = False
+        settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+        with pytest.raises(ImproperlyConfigured):
+            apps.get_app_config('mainapp').ready()
@@ -0,0 +1,307 @@
+import threading
+import time
+import pytest
+from rest_framework import status
+from model_bakery import baker
+from mainapp.caching import LOCK_PREFIX, TieredCache
+from mainapp.models import Cart, CartItem, Collection, Product
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeRemote:
+    '''the part of the django cache api used by TieredCache, expiring on the fake clock'''
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.data = {}
+
+    def get(self, key, default=None):
+        value, expires_at = self.data.get(key, (default, None))
+        if expires_at is not None and expires_at <= self.clock():
+            del self.data[key]
+            return default
+        return value
+
+    def get_many(self, keys):
+        return {key: self.get(key) for key in keys if self.get(key) is not None}
+
+    def set(self, key, value, timeout):
+        self.data[key] = (value, None if timeout is None else self.clock() + timeout)
+
+    def set_many(self, values, timeout):
+        for key, value in values.items():
+            self.set(key, value, timeout)
+
+    def add(self, key, value, timeout):
+        if self.get(key) is not None:
+            return False
+        self.set(key, value, timeout)
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def remote(clock):
+    return FakeRemote(clock)
+
+
+@pytest.fixture
+def make_cache(clock, remote):
+    def do_make_cache(**kwargs):
+        kwargs = {'local_ttl': 2, 'random': lambda: 0.0, **kwargs}
+        return TieredCache(remote=remote, clock=clock, sleep=clock.sleep, **kwargs)
+    return do_make_cache
+
+
+class Compute:
+    def __init__(self, value='value'):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+class TestTieredCache:
+    def test_tiers_are_read_in_order(self, clock, make_cache):
+        cache = make_cache()
+        compute = Compute()
+
+        assert [cache.get_or_set('key', compute, 60) for _ in range(3)] == ['value'] * 3
+        clock.now += 5
+        assert cache.get_or_set('key', compute, 60) == 'value'
+
+        assert compute.calls == 1
+        stats = cache.stats()
+        assert stats['local'] == {'hits': 2, 'misses': 2, 'hit_ratio': 0.5}
+        assert stats['remote'] == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5}
+        assert stats['recomputes'] == 1
+
+    def test_expired_value_is_recomputed(self, clock, make_cache):
+        cache = make_cache()
+        compute = Compute()
+        cache.get_or_set('key', compute, 60)
+
+        clock.now += 61
+
+        cache.get_or_set('key', compute, 60)
+        assert compute.calls == 2
+
+    def test_local_tier_is_bounded(self, make_cache):
+        cache = make_cache(local_size=2)
+        for key in ('a', 'b', 'a', 'c'):
+            cache.get_or_set(key, Compute(key), 60)
+
+        assert list(cache.local.entries) == ['a', 'c']
+
+    def test_invalidated_tags_are_misses_in_every_worker(self, clock, make_cache):
+        worker, other_worker = make_cache(), make_cache()
+        compute = Compute()
+        worker.get_or_set('key', compute, 60, tags=['products'])
+        other_worker.get_or_set('key', compute, 60, tags=['products'])
+        other_worker.get_or_set('untagged', compute, 60)
+
+        worker.invalidate_tags('products')
+
+        worker.get_or_set('key', compute, 60, tags=['products'])
+        assert compute.calls == 3
+        other_worker.get_or_set('key', compute, 60, tags=['products'])
+        assert compute.calls == 3
+        clock.now += 2
+        other_worker.get_or_set('key', compute, 60, tags=['products'])
+        other_worker.get_or_set('untagged', compute, 60)
+        assert compute.calls == 3
+
+    def test_evicted_tag_invalidates_entries(self, remote, make_cache):
+        cache = make_cache()
+        compute = Compute()
+        cache.get_or_set('key', compute, 60, tags=['products'])
+
+        cache.local.clear()
+        remote.delete('cache-tag:products')
+
+        cache.get_or_set('key', compute, 60, tags=['products'])
+        assert compute.calls == 2
+
+    def test_early_expiration(self, clock, make_cache):
+        draws = [0.0]
+        cache = make_cache(random=lambda: draws[0])
+        compute = Compute()
+
+        def clock_compute():
+            clock.sleep(1)
+            return compute()
+        cache.get_or_set('key', clock_compute, 60)
+
+        clock.now += 50
+        cache.get_or_set('key', clock_compute, 60)
+        assert compute.calls == 1
+
+        # -log(1 - 0.99999) is about 11.5 recomputation times before expiry
+        draws[0] = 0.99999
+        cache.local.clear()
+        cache.get_or_set('key', clock_compute, 60)
+        assert compute.calls == 2
+        assert cache.stats()['early_recomputes'] == 1
+
+    def test_locked_key_serves_stale_value(self, clock, remote, make_cache):
+        cache = make_cache(random=lambda: 0.99999)
+        cache.get_or_set('key', lambda: (clock.sleep(1), 'old')[1], 60)
+        clock.now += 55
+        cache.local.clear()
+
+        remote.add(LOCK_PREFIX + 'key', 1, 10)
+
+        assert cache.get_or_set('key', Compute('new'), 60) == 'old'
+        assert cache.stats()['stale_served'] == 1
+
+    def test_locked_key_waits_for_other_worker(self, clock, remote, make_cache):
+        worker, other_worker = make_cache(lock_timeout=10), make_cache()
+        remote.add(LOCK_PREFIX + 'key', 1, 10)
+
+        def sleep(seconds):
+            clock.sleep(seconds)
+            if clock.now > 1001:
+                other_worker.store('key', Compute('other'), 60, {})
+        worker.sleep = sleep
+        compute = Compute()
+
+        assert worker.get_or_set('key', compute, 60) == 'other'
+        assert compute.calls == 0
+        assert worker.stats()['waits'] == 1
+
+    def test_single_flight_in_worker(self, make_cache):
+        cache = make_cache()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'value'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(cache.get_or_set('key', compute, 60)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(cache.get_or_set('key', compute, 60)))
+                     for _ in range(5)]
+        for thread in followers:
+            thread.start()
+        while cache.stats()['waits'] < 5:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        assert results == ['value'] * 6
+        assert len(calls) == 1
+
+    def test_failed_computation_is_not_cached(self, make_cache):
+        cache = make_cache()
+
+        def compute():
+            raise ValueError
+
+        with pytest.raises(ValueError):
+            cache.get_or_set('key', compute, 60)
+        assert cache.get_or_set('key', Compute(), 60) == 'value'
+        assert not cache.flights
+
+
+class TestCachedEndpoints:
+    @pytest.mark.django_db
+    def test_collection_list_is_invalidated_by_product(self, api_client, django_assert_num_queries,
+                                                       django_capture_on_commit_callbacks):
+        collection = baker.make(Collection)
+        api_client.get('/collections/')
+
+        with django_assert_num_queries(0):
+            response = api_client.get('/collections/')
+        assert response.data[0]['products_count'] == 0
+
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make(Product, collection=collection)
+        response = api_client.get('/collections/')
+        assert response.data[0]['products_count'] == 1
+
+    @pytest.mark.django_db
+    def test_tags_are_invalidated_on_commit(self, api_client, django_capture_on_commit_callbacks):
+        collection = baker.make(Collection)
+        api_client.get('/collections/')
+
+        with django_capture_on_commit_callbacks() as callbacks:
+            baker.make(Product, collection=collection)
+            # a request before the commit must not cache the change, nor drop the entry
+            assert api_client.get('/collections/').data[0]['products_count'] == 0
+        for callback in callbacks:
+            callback()
+
+        assert api_client.get('/collections/').data[0]['products_count'] == 1
+
+    @pytest.mark.django_db
+    def test_cart_is_invalidated_by_items(self, api_client, django_assert_num_queries,
+                                          django_capture_on_commit_callbacks):
+        cart = baker.make(Cart)
+        api_client.get(f'/carts/{cart.id}/')
+
+        with django_assert_num_queries(0):
+            response = api_client.get(f'/carts/{cart.id}/')
+        assert response.data['items'] == []
+
+        with django_capture_on_commit_callbacks(execute=True):
+            item = baker.make(CartItem, cart=cart)
+        response = api_client.get(f'/carts/{cart.id}/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['items']) == 1
+
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.delete(f'/carts/{cart.id}/items/{item.id}/')
+        response = api_client.get(f'/carts/{cart.id}/')
+
+        assert response.data['items'] == []
+
+    @pytest.mark.django_db
+    def test_cart_is_not_invalidated_by_products(self, api_client, django_assert_num_queries,
+                                                 django_capture_on_commit_callbacks):
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart)
+        api_client.get(f'/carts/{cart.id}/')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make(Product)
+        with django_assert_num_queries(0):
+            api_client.get(f'/carts/{cart.id}/')
+
+    @pytest.mark.django_db
+    def test_checkout_invalidates_cart(self, api_client, auth_user, django_capture_on_commit_callbacks):
+        auth_user(is_staff=False)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart)
+        api_client.get(f'/carts/{cart.id}/')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.post('/orders/', {'cart_id': cart.id})
+        response = api_client.get(f'/carts/{cart.id}/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -1,8 +1,12 @@
 import pytest
+import threading
 from uuid import uuid4
+from django.db import connection
 from rest_framework import status
 from model_bakery import baker
-from mainapp.models import CartItem, Cart
+from mainapp.models import CartItem, Cart, Product
+from mainapp.serializers import AddCartItemSerializer
+from mainapp.transactions import retry_metrics
 
 
 '''permissions are AllowAny'''
@@ -98,6 +102,48 @@ class TestCartItemCreate:
 
         assert response.status_code == status.HTTP_400_BAD_REQUEST
 
+    @pytest.mark.django_db
+    def test_create_cartitem_in_missing_cart_returns_404(self, api_client, get_cartitem_url):
+        product = baker.make(Product)
+
+        response = api_client.post(get_cartitem_url(uuid4()), {'product_id': product.pk, 'quantity': 1})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert not CartItem.objects.exists()
+        assert 'cart_item_upsert' not in retry_metrics.snapshot()
+
+    @pytest.mark.django_db(transaction=True)
+    def test_concurrent_first_adds_make_one_item(self, settings):
+        settings.TRANSACTION_MAX_ATTEMPTS = 50
+        settings.TRANSACTION_RETRY_BASE_DELAY = 0.001
+        cart = baker.make(Cart, id=uuid4())
+        product = baker.make(Product)
+        threads_count = 8
+        barrier = threading.Barrier(threads_count)
+        saved = []
+
+        # validated before the barrier, the upserts are what runs concurrently
+        def add():
+            try:
+                serializer = AddCartItemSerializer(
+                    data={'product_id': product.pk, 'quantity': 1}, context={'cart_id': cart.id})
+                serializer.is_valid(raise_exception=True)
+                barrier.wait()
+                serializer.save()
+                saved.append(serializer.instance.pk)
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=add) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(saved) == threads_count
+        item = CartItem.objects.get(cart=cart)
+        assert item.product_id == product.pk
+        assert item.quantity == threads_count
+
 
 class TestCartItemUpdate:
     @pytest.mark.django_db
@@ -1,5 +1,6 @@
 import pytest
 from rest_framework import status
+from rest_framework.test import APIClient
 from model_bakery import baker
 from mainapp.models import Cart
 
@@ -50,6 +51,42 @@ class TestCartCreate:
         assert response.status_code == status.HTTP_201_CREATED
         assert Cart.objects.count() > 0
 
+    @pytest.mark.django_db
+    def test_create_cart_with_repeated_idempotency_key(self, api_client, auth_user):
+        auth_user(is_staff=False)
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'test-key'}
+
+        first_response = api_client.post(cart_url, **headers)
+        second_response = api_client.post(cart_url, **headers)
+
+        assert second_response.status_code == status.HTTP_201_CREATED
+        assert second_response.data['id'] == first_response.data['id']
+        assert second_response['Idempotent-Replayed'] == 'true'
+        assert Cart.objects.count() == 1
+
+    @pytest.mark.django_db
+    def test_create_cart_idempotency_key_reused_with_other_data_returns_422(self, api_client, auth_user):
+        auth_user(is_staff=False)
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'test-key'}
+        api_client.post(cart_url, **headers)
+
+        response = api_client.post(cart_url, {'test': 'test'}, **headers)
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert Cart.objects.count() == 1
+
+    @pytest.mark.django_db
+    def test_idempotency_key_of_anonymous_clients_is_ignored(self):
+        '''another anonymous client sending the same key must not get the first cart'''
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'test-key'}
+
+        first_response = APIClient().post(cart_url, **headers)
+        second_response = APIClient().post(cart_url, **headers)
+
+        assert second_response.status_code == status.HTTP_201_CREATED
+        assert second_response.data['id'] != first_response.data['id']
+        assert Cart.objects.count() == 2
+
 
 class TestCartUpdate:
     @pytest.mark.django_db
@@ -0,0 +1,256 @@
+import pytest
+from decimal import Decimal
+from django.db import transaction
+from rest_framework import status
+from model_bakery import baker
+from mainapp import catalog
+from mainapp.caching import app_cache
+from mainapp.models import Collection, Product, ProductChange
+from mainapp.tasks import sync_stock
+
+
+product_url = '/products/'
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def snapshot(request, tmp_path):
+    '''every test runs with the vectorized filter engine and with the python scan'''
+    def do_snapshot():
+        path = tmp_path / 'catalog.snapshot'
+        catalog.build_snapshot(path)
+        loaded = catalog.load_snapshot(path)
+        if request.param == 'python':
+            loaded.engine = None
+        return loaded
+    return do_snapshot
+
+
+class TestCatalogSnapshot:
+    @pytest.mark.django_db
+    def test_query_filters_and_orders(self, snapshot):
+        collection = baker.make(Collection)
+        cheap = baker.make(Product, title='b', unit_price=Decimal('5.00'), collection=collection)
+        expensive = baker.make(Product, title='a', unit_price=Decimal('50.00'), collection=collection)
+        baker.make(Product, title='c', unit_price=Decimal('20.00'))
+
+        result = snapshot().query(collection_ids={collection.id}, ordering='unit_price')
+
+        assert [row.id for row in result[:]] == [cheap.id, expensive.id]
+        assert result[1].unit_price == Decimal('50.00')
+
+    @pytest.mark.django_db
+    def test_changes_after_build_are_applied(self, snapshot, django_capture_on_commit_callbacks):
+        product = baker.make(Product, title='a', unit_price=Decimal('5.00'))
+        loaded = snapshot()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            product.unit_price = Decimal('500.00')
+            product.save()
+            added = baker.make(Product, title='b', unit_price=Decimal('1.00'))
+
+        result = loaded.query(price_gt=Decimal('100'))
+        assert [row.id for row in result[:]] == [product.id]
+        assert [row.id for row in loaded.query()[:]] == [product.id, added.id]
+
+    @pytest.mark.django_db
+    def test_combined_filters(self, snapshot):
+        first, second, other = baker.make(Collection, _quantity=3)
+        in_stock = baker.make(Product, title='a', unit_price=Decimal('10.00'), inventory=5, collection=first)
+        sold_out = baker.make(Product, title='b', unit_price=Decimal('12.00'), inventory=0, collection=first)
+        cheap = baker.make(Product, title='c', unit_price=Decimal('1.00'), inventory=5, collection=second)
+        expensive = baker.make(Product, title='d', unit_price=Decimal('30.50'), inventory=5, collection=second)
+        baker.make(Product, title='e', unit_price=Decimal('15.00'), inventory=5, collection=other)
+        loaded = snapshot()
+
+        result = loaded.query(collection_ids={first.id, second.id}, price_gt=Decimal('1.00'),
+                              price_lt=Decimal('30.505'), in_stock=True, ordering='-unit_price')
+        assert [row.id for row in result[:]] == [expensive.id, in_stock.id]
+        result = loaded.query(collection_ids={first.id, second.id}, in_stock=False)
+        assert [row.id for row in result[:]] == [sold_out.id]
+        assert len(loaded.query(price_gt=Decimal('0.99'), price_lt=Decimal('1.01'))) == 1
+        assert loaded.query(price_lt=Decimal('1E+30'), ordering='unit_price')[0].id == cheap.id
+
+    @pytest.mark.django_db
+    def test_changed_rows_are_merged_in_order(self, snapshot, django_capture_on_commit_callbacks):
+        products = [baker.make(Product, title=title, unit_price=Decimal(price))
+                    for title, price in (('a', '1.00'), ('c', '3.00'), ('e', '5.00'))]
+        loaded = snapshot()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            products[0].title, products[0].unit_price = 'f', Decimal('4.00')
+            products[0].save()
+            added = baker.make(Product, title='b', unit_price=Decimal('3.00'))
+            products[2].delete()
+
+        by_title = loaded.query()
+        assert [row.id for row in by_title[:]] == [added.id, products[1].id, products[0].id]
+        assert by_title[-1].title == 'f'
+        by_price = loaded.query(ordering='unit_price')
+        assert [row.id for row in by_price[:]] == \
+            sorted([products[1].id, added.id]) + [products[0].id]
+        by_price_descending = loaded.query(ordering='-unit_price')
+        assert [row.id for row in by_price_descending[:]] == \
+            [products[0].id] + sorted([products[1].id, added.id], reverse=True)
+        assert by_price_descending[1:2][0].id == max(products[1].id, added.id)
+
+    @pytest.mark.django_db
+    def test_rolled_back_change_is_not_applied(self, snapshot, django_capture_on_commit_callbacks):
+        product = baker.make(Product, title='a', unit_price=Decimal('5.00'))
+        loaded = snapshot()
+
+        with django_capture_on_commit_callbacks(execute=True), pytest.raises(RuntimeError):
+            with transaction.atomic():
+                product.unit_price = Decimal('500.00')
+                product.save()
+                raise RuntimeError
+
+        assert loaded.changes == {}
+        assert loaded.query()[0].unit_price == Decimal('5.00')
+
+    @pytest.mark.django_db
+    def test_delete_by_other_worker_is_applied(self, snapshot):
+        kept, deleted = baker.make(Product, _quantity=2)
+        loaded = snapshot()
+
+        # without the on_commit callbacks of this worker the delete is only in the change log
+        deleted.delete()
+        loaded.refresh(force=True)
+
+        result = loaded.query()
+        assert [row.id for row in result[:]] == [kept.id]
+        assert result.count() == 1
+
+    @pytest.mark.django_db
+    def test_change_committed_after_a_later_one_is_polled_again(self, snapshot):
+        early, late = baker.make(Product, unit_price=Decimal('10.00'), _quantity=2)
+        loaded = snapshot()
+        loaded.refresh(force=True)
+        sequence = loaded.sequence
+
+        # the transaction of late took the lower id but commits second
+        Product.objects.filter(pk=early.pk).update(unit_price=Decimal('20.00'))
+        ProductChange.objects.create(id=sequence + 2, product_id=early.id)
+        loaded.refresh(force=True)
+        assert set(loaded.gaps) == {sequence + 1}
+        Product.objects.filter(pk=late.pk).update(unit_price=Decimal('30.00'))
+        ProductChange.objects.create(id=sequence + 1, product_id=late.id)
+        loaded.refresh(force=True)
+
+        assert loaded.gaps == {}
+        assert [(row.id, row.unit_price) for row in loaded.query(ordering='unit_price')[:]] == \
+            [(early.id, Decimal('20.00')), (late.id, Decimal('30.00'))]
+
+    @pytest.mark.django_db
+    def test_stock_sync_is_applied(self, snapshot):
+        product = baker.make(Product, inventory=2)
+        loaded = snapshot()
+
+        sync_stock({'order_id': 1, 'items': [{'product_id': product.id, 'quantity': 2}]})
+        loaded.refresh(force=True)
+
+        assert [row.id for row in loaded.query(in_stock=False)[:]] == [product.id]
+
+    @pytest.mark.django_db
+    def test_python_count_without_filters_and_overlay_needs_no_scan(self, snapshot):
+        baker.make(Product, _quantity=3)
+        loaded = snapshot()
+        loaded.engine = None
+
+        assert loaded.query()._count == 3
+
+    @pytest.mark.django_db
+    def test_rebuilt_file_is_mapped_again(self, snapshot, settings):
+        settings.CATALOG_SNAPSHOT_REFRESH_INTERVAL = 0
+        # the builds are current to the last change, nothing is polled again
+        settings.CATALOG_CHANGE_GAP_TIMEOUT = 0
+        loaded = snapshot()
+        product = baker.make(Product)
+        catalog.build_snapshot(loaded.path)
+
+        reloaded = catalog.refresh_snapshot()
+
+        assert reloaded is not loaded and reloaded is catalog.get_snapshot()
+        assert reloaded.changes == {}
+        assert not ProductChange.objects.exists()
+        assert [row.id for row in reloaded.query()[:]] == [product.id]
+
+    @pytest.mark.django_db
+    def test_overlay_over_the_limit_is_folded_into_the_snapshot(self, snapshot, settings):
+        settings.CATALOG_SNAPSHOT_REFRESH_INTERVAL = 0
+        # the builds are current to the last change, nothing is polled again
+        settings.CATALOG_CHANGE_GAP_TIMEOUT = 0
+        settings.CATALOG_SNAPSHOT_MAX_CHANGES = 1
+        loaded = snapshot()
+        products = baker.make(Product, _quantity=2)
+        loaded.refresh(force=True)
+        assert len(loaded.changes) == 2
+
+        folded = catalog.refresh_snapshot()
+
+        assert folded is not loaded
+        assert folded.count == 2
+        assert folded.changes == {}
+        assert sorted(row.id for row in folded.query()[:]) == sorted(product.id for product in products)
+
+
+class TestProductListFromSnapshot:
+    @pytest.mark.django_db
+    def test_list_products_from_snapshot(self, api_client, snapshot, django_assert_num_queries):
+        baker.make(Product, unit_price=Decimal('10.00'), _quantity=12)
+        snapshot().refresh(force=True)
+
+        with django_assert_num_queries(0):
+            response = api_client.get(product_url, {'fields': 'id,title,unit_price',
+                                                    'ordering': '-unit_price'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 12
+        assert len(response.data['results']) == 10
+        assert set(response.data['results'][0]) == {'id', 'title', 'unit_price'}
+
+    @pytest.mark.django_db
+    def test_list_products_hydrates_page(self, api_client, snapshot):
+        products = baker.make(Product, description='test', _quantity=3)
+        snapshot()
+
+        response = api_client.get(product_url, {'collection_id': products[0].collection_id})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [product['id'] for product in response.data['results']] == [products[0].id]
+        assert response.data['results'][0]['description'] == 'test'
+
+    @pytest.mark.django_db
+    def test_facets_from_snapshot(self, api_client, snapshot, django_assert_num_queries):
+        collections = baker.make(Collection, _quantity=2)
+        for price in ('5.00', '10.00', '99.99', '2000.00'):
+            baker.make(Product, unit_price=Decimal(price), inventory=0, collection=collections[0])
+        baker.make(Product, unit_price=Decimal('50.00'), inventory=1, collection=collections[1])
+        params = {'unit_price__gt': '5', 'in_stock': 'false'}
+        expected = api_client.get(product_url + 'facets/', params).data
+        loaded = snapshot()
+        loaded.refresh(force=True)
+        app_cache.invalidate_tags('products')
+
+        with django_assert_num_queries(0 if loaded.engine else 1):
+            response = api_client.get(product_url + 'facets/', params)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == expected
+        assert api_client.get(product_url + 'facets/').data['prices'][2]['count'] == 2
+
+    @pytest.mark.django_db
+    def test_list_products_by_collection_set_and_stock(self, api_client, snapshot):
+        collections = baker.make(Collection, _quantity=3)
+        for collection in collections:
+            baker.make(Product, collection=collection, inventory=0)
+            baker.make(Product, collection=collection, inventory=3)
+        params = {'collection_id__in': f'{collections[0].id},{collections[1].id}', 'in_stock': 'true',
+                  'ordering': 'unit_price'}
+        expected = api_client.get(product_url, params).data
+        snapshot()
+
+        response = api_client.get(product_url, params)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == expected['count'] == 2
+        assert response.data['results'] == expected['results']
@@ -0,0 +1,43 @@
+import pytest
+from django.core.management import call_command
+from mainapp.checkout_benchmark import create_carts, create_products, run_checkouts
+from mainapp.models import Cart, Customer, IdempotencyKey, Order, Product, StockSync
+
+
+class TestCheckoutBenchmark:
+    @pytest.mark.django_db(transaction=True)
+    def test_hot_workload_puts_a_hot_product_in_every_cart(self):
+        products = create_products(10)
+
+        jobs = create_carts(20, products, items_per_cart=3, workload='hot', hot_products=2, seed=1)
+
+        hot = {products[0].pk, products[1].pk}
+        assert all(job['items'][0]['product_id'] in hot for job in jobs)
+        assert all(len({item['product_id'] for item in job['items']}) == 3 for job in jobs)
+        assert Cart.objects.count() == 20
+
+    @pytest.mark.django_db(transaction=True)
+    def test_run_checkouts(self):
+        products = create_products(5)
+        jobs = create_carts(12, products, items_per_cart=2, workload='hot', hot_products=1)
+
+        stats, elapsed = run_checkouts(jobs, workers=2, host='testserver')
+
+        summary = stats.summary(elapsed)
+        assert summary['orders'] + summary['failed'] == 12
+        assert summary['orders'] > 0
+        assert Order.objects.count() >= summary['orders']
+        assert Product.objects.get(pk=products[0].pk).inventory < 1000000
+        assert summary['lock_wait'] > 0
+
+    @pytest.mark.django_db(transaction=True)
+    def test_command_removes_its_data(self, capsys):
+        call_command('benchmark_checkout', carts=5, workers=2, products=5, host='testserver')
+
+        output = capsys.readouterr().out
+        assert 'hot' in output and 'uniform' in output
+        assert not Customer.objects.exists()
+        assert not Product.objects.exists()
+        assert not Order.objects.exists()
+        assert not StockSync.objects.exists()
+        assert not IdempotencyKey.objects.exists()
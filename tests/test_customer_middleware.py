@@ -0,0 +1,69 @@
+import pytest
+from uuid import uuid4
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from model_bakery import baker
+from mainapp.authentication import issue_token
+from mainapp.models import Cart, CartItem, Customer, CustomUser, Order
+
+
+order_url = '/orders/'
+
+
+def customer_queries(context):
+    '''customer lookups, the customer check of the checkout cart query is not one'''
+    return [query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('SELECT') and 'FROM "mainapp_customer"' in query['sql']
+            and 'FROM "mainapp_cart"' not in query['sql']]
+
+
+@pytest.fixture
+def cart():
+    cart = baker.make(Cart, id=uuid4())
+    baker.make(CartItem, cart=cart, _quantity=2)
+    return cart
+
+
+class TestCustomerMiddleware:
+    @pytest.mark.django_db
+    def test_checkout_looks_up_customer_once(self, api_client, auth_user, cart):
+        auth_user(is_staff=False)
+
+        with CaptureQueriesContext(connection) as context:
+            response = api_client.post(order_url, {'cart_id': cart.id})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert len(customer_queries(context)) == 1
+
+    @pytest.mark.django_db
+    def test_customer_is_cached_between_requests(self, api_client, auth_user):
+        auth_user(is_staff=False)
+        api_client.get(order_url)
+
+        with CaptureQueriesContext(connection) as context:
+            response = api_client.get(order_url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert customer_queries(context) == []
+
+    @pytest.mark.django_db
+    def test_token_customer_needs_no_query(self, api_client, cart):
+        customer = baker.make(Customer, user=baker.make(CustomUser))
+        api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_token(customer.user, customer.id)}')
+
+        with CaptureQueriesContext(connection) as context:
+            response = api_client.post(order_url, {'cart_id': cart.id})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert customer_queries(context) == []
+        assert Order.objects.get().customer_id == customer.id
+
+    @pytest.mark.django_db
+    def test_user_without_customer_cannot_order(self, api_client, auth_user, cart):
+        auth_user(is_staff=True)
+
+        response = api_client.post(order_url, {'cart_id': cart.id})
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+        assert Order.objects.count() == 0
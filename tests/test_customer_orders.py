@@ -0,0 +1,157 @@
+import pytest
+from decimal import Decimal
+from rest_framework import status
+from model_bakery import baker
+from mainapp.models import Customer, CustomerSummary, Order, OrderItem, Product
+from mainapp.order_status import bulk_update_payment_status
+from mainapp.serializers import UpdateOrderSerializer
+from mainapp.summaries import rebuild_summaries
+
+
+'''permissions are IsAdminOrOwnCustomer'''
+
+
+@pytest.fixture
+def get_customer_orders_url():
+    def do_get_customer_orders_url(customer_pk):
+        return f'/customers/{customer_pk}/orders/'
+    return do_get_customer_orders_url
+
+
+class TestCustomerOrderList:
+    @pytest.mark.django_db
+    def test_list_customer_orders(self, api_client, auth_user, get_customer_orders_url):
+        auth_user(is_staff=True)
+        customer = baker.make(Customer)
+        orders = baker.make(Order, customer=customer, _quantity=12)
+        baker.make(Order)
+
+        response = api_client.get(get_customer_orders_url(customer.id))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == 10
+        assert response.data['results'][0]['id'] == orders[-1].id
+        assert response.data['next'] is not None
+        assert response.data['summary']['order_count'] == 12
+
+        response = api_client.get(response.data['next'])
+
+        assert len(response.data['results']) == 2
+
+    @pytest.mark.django_db
+    def test_list_orders_of_missing_customer_returns_404(self, api_client, auth_user, get_customer_orders_url):
+        auth_user(is_staff=True)
+
+        response = api_client.get(get_customer_orders_url(100000))
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.django_db
+    def test_list_customer_orders_of_other_customer_returns_403(self, api_client, auth_user, get_customer_orders_url):
+        auth_user(is_staff=False)
+        customer = baker.make(Customer)
+
+        response = api_client.get(get_customer_orders_url(customer.id))
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+class TestCustomerSummary:
+    @pytest.mark.django_db
+    def test_summary_follows_payment_status(self):
+        customer = baker.make(Customer)
+        order = baker.make(Order, customer=customer)
+        product = baker.make(Product, unit_price=Decimal('10.50'))
+        baker.make(OrderItem, order=order, product=product, quantity=2, unit_price=product.unit_price)
+        order = Order.objects.get(pk=order.pk)
+
+        order.payment_status = Order.PAYMENT_STATUS_COMPLETE
+        order.save()
+        summary = CustomerSummary.objects.get(customer=customer)
+        assert summary.order_count == 1
+        assert summary.lifetime_value == Decimal('21.00')
+        assert summary.last_order_at == order.placed_at
+
+        order.payment_status = Order.PAYMENT_STATUS_FAILED
+        order.save()
+        summary.refresh_from_db()
+        assert summary.lifetime_value == Decimal('0.00')
+
+    @pytest.mark.django_db
+    def test_summary_uses_price_of_the_order(self):
+        customer = baker.make(Customer)
+        order = baker.make(Order, customer=customer)
+        product = baker.make(Product, unit_price=Decimal('10.00'))
+        baker.make(OrderItem, order=order, product=product, quantity=2, unit_price=Decimal('10.00'))
+        order = Order.objects.get(pk=order.pk)
+        order.payment_status = Order.PAYMENT_STATUS_COMPLETE
+        order.save()
+        Product.objects.filter(pk=product.pk).update(unit_price=Decimal('25.00'))
+
+        order.payment_status = Order.PAYMENT_STATUS_FAILED
+        order.save()
+
+        summary = CustomerSummary.objects.get(customer=customer)
+        assert summary.lifetime_value == Decimal('0.00')
+
+    @pytest.mark.django_db
+    def test_bulk_status_update_adjusts_summary(self):
+        customer = baker.make(Customer)
+        product = baker.make(Product, unit_price=Decimal('5.00'))
+        orders = baker.make(Order, customer=customer, _quantity=2)
+        for order in orders:
+            baker.make(OrderItem, order=order, product=product, quantity=1, unit_price=product.unit_price)
+
+        bulk_update_payment_status([{'order_id': order.id, 'payment_status': 'C'}
+                                    for order in orders])
+
+        summary = CustomerSummary.objects.get(customer=customer)
+        assert summary.lifetime_value == Decimal('10.00')
+
+    @pytest.mark.django_db
+    def test_deleted_order_leaves_summary(self, api_client, auth_user):
+        auth_user(is_staff=True)
+        customer = baker.make(Customer)
+        kept = baker.make(Order, customer=customer)
+        order = baker.make(Order, customer=customer, payment_status=Order.PAYMENT_STATUS_COMPLETE)
+        item = baker.make(OrderItem, order=order, quantity=2, unit_price=Decimal('4.00'))
+        assert CustomerSummary.objects.get(customer=customer).lifetime_value == Decimal('8.00')
+
+        api_client.delete(f'/orders/{order.id}/items/{item.id}/')
+        response = api_client.delete(f'/orders/{order.id}/')
+
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        summary = CustomerSummary.objects.get(customer=customer)
+        assert summary.order_count == 1
+        assert summary.lifetime_value == Decimal('0.00')
+        assert summary.last_order_at == kept.placed_at
+
+    @pytest.mark.django_db
+    def test_concurrent_status_updates_count_the_order_once(self):
+        customer = baker.make(Customer)
+        order = baker.make(Order, customer=customer)
+        baker.make(OrderItem, order=order, quantity=1, unit_price=Decimal('7.00'))
+        # both requests loaded the order while it was pending
+        first, second = Order.objects.get(pk=order.pk), Order.objects.get(pk=order.pk)
+
+        for stale in (first, second):
+            serializer = UpdateOrderSerializer(stale, data={'payment_status': 'C'})
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        assert CustomerSummary.objects.get(customer=customer).lifetime_value == Decimal('7.00')
+
+    @pytest.mark.django_db
+    def test_rebuild_summaries(self):
+        customer = baker.make(Customer)
+        order = baker.make(Order, customer=customer,
+                           payment_status=Order.PAYMENT_STATUS_COMPLETE)
+        product = baker.make(Product, unit_price=Decimal('3.00'))
+        baker.make(OrderItem, order=order, product=product, quantity=3, unit_price=product.unit_price)
+        CustomerSummary.objects.all().delete()
+
+        rebuild_summaries()
+
+        summary = CustomerSummary.objects.get(customer=customer)
+        assert summary.order_count == 1
+        assert summary.lifetime_value == Decimal('9.00')
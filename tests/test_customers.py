@@ -1,7 +1,9 @@
 import pytest
 from rest_framework import status
+from django.contrib.auth import authenticate
 from model_bakery import baker
 from mainapp.models import Customer
+from mainapp.provisioning import provision_customer
 
 
 customer_url = '/customers/'
@@ -30,6 +32,34 @@ class TestCustomerList:
         assert response.status_code == status.HTTP_403_FORBIDDEN
 
 
+class TestCustomerSearch:
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize('term', ['+7 (912) 345', 'IVAN.P@', 'петр', 'иван петр'])
+    def test_search_customers(self, api_client, auth_user, term):
+        auth_user(is_staff=True)
+        customer = baker.make(Customer, first_name='Иван', last_name='Петров',
+                              email='ivan.p@example.com', phone='+79123456789')
+        baker.make(Customer, first_name='Анна', last_name='Смирнова',
+                   email='anna@example.com', phone='+79990000000')
+
+        response = api_client.get(customer_url, {'search': term})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 1
+        assert response.data['results'][0]['id'] == customer.id
+
+    @pytest.mark.django_db
+    def test_list_customers_is_paginated(self, api_client, auth_user):
+        auth_user(is_staff=True)
+        baker.make(Customer, _quantity=11)
+
+        response = api_client.get(customer_url)
+
+        assert response.data['count'] == 11
+        assert len(response.data['results']) == 10
+
+
 class TestCustomerRetrieve:
     @pytest.mark.django_db
     def test_retrieve_customer_for_admin(self, api_client, auth_user):
@@ -109,6 +139,30 @@ class TestCustomerCreate:
         assert response.data['korpus'] == expected_json['korpus']
         assert response.data['flat'] == expected_json['flat']
 
+    @pytest.mark.django_db
+    def test_create_customer_creates_user(self, api_client, settings):
+        settings.PASSWORD_HASHER_ITERATIONS = 1000
+        data = {'first_name': 'a', 'last_name': 'b', 'email': 'a@example.com', 'phone': '123',
+                'street': 'c', 'house': '1', 'flat': '2', 'password': 'secret'}
+
+        response = api_client.post(customer_url, data)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert 'password' not in response.data
+        customer = Customer.objects.select_related('user').get(pk=response.data['id'])
+        assert customer.user.check_password('secret')
+
+    @pytest.mark.django_db
+    def test_create_customer_with_existing_email_returns_400(self, api_client):
+        data = {'first_name': 'a', 'last_name': 'b', 'email': 'a@example.com', 'phone': '123',
+                'street': 'c', 'house': '1', 'flat': '2'}
+        api_client.post(customer_url, data)
+
+        response = api_client.post(customer_url, data)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert Customer.objects.count() == 1
+
     @pytest.mark.django_db
     def test_create_customer_with_invalid_data(self, api_client):
         customer = baker.make(Customer, korpus='2')
@@ -198,6 +252,32 @@ class TestCustomerUpdate:
         assert response.data[field] == valid_field
 
 
+class TestCustomerEmailUpdate:
+    @pytest.mark.django_db
+    def test_email_change_updates_the_user(self, api_client, auth_user):
+        auth_user(is_staff=True)
+        customer = provision_customer(email='a@example.com', password='secret', first_name='a', last_name='b')
+
+        response = api_client.patch(f'{customer_url}{customer.id}/', {'email': 'new@example.com'})
+
+        assert response.status_code == status.HTTP_200_OK
+        customer.user.refresh_from_db()
+        assert customer.user.email == 'new@example.com'
+        assert authenticate(email='new@example.com', password='secret') == customer.user
+
+    @pytest.mark.django_db
+    def test_email_of_other_user_returns_400(self, api_client, auth_user):
+        auth_user(is_staff=True)
+        provision_customer(email='taken@example.com', first_name='a', last_name='b')
+        customer = provision_customer(email='a@example.com', first_name='c', last_name='d')
+
+        response = api_client.patch(f'{customer_url}{customer.id}/', {'email': 'taken@example.com'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        customer.refresh_from_db()
+        assert customer.email == 'a@example.com'
+
+
 class TestCustomerDelete:
 
     @pytest.mark.django_db
@@ -0,0 +1,33 @@
+import pytest
+from datetime import timedelta
+from django.core.management import call_command
+from django.utils import timezone
+from mainapp.models import Cart, Customer, CustomerSummary, Order, OrderItem, Product
+
+
+class TestGenerateData:
+    @pytest.mark.django_db
+    def test_generate_data_is_deterministic(self):
+        options = ['--collections', '3', '--products', '50', '--customers', '10',
+                   '--orders', '40', '--order-items', '120', '--carts', '5', '--batch-size', '16']
+
+        call_command('generate_data', *options)
+        call_command('generate_data', *options)
+
+        assert Product.objects.count() == 100
+        assert Order.objects.count() == 80
+        assert OrderItem.objects.count() > 80
+        assert Cart.objects.count() == 10
+        assert CustomerSummary.objects.count() == Customer.objects.count() == 20
+        assert sum(CustomerSummary.objects.values_list('order_count', flat=True)) == 80
+        descriptions = Product.objects.filter(title='Product 7')\
+            .values_list('description', flat=True)
+        assert descriptions[0] == descriptions[1]
+
+    @pytest.mark.django_db
+    def test_orders_are_spread_over_three_years(self):
+        call_command('generate_data', '--collections', '1', '--products', '5', '--customers', '2',
+                     '--orders', '20', '--order-items', '20', '--carts', '0')
+
+        oldest = Order.objects.earliest('placed_at').placed_at
+        assert oldest < timezone.now() - timedelta(days=30)
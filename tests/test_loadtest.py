@@ -0,0 +1,62 @@
+import json
+import pytest
+from django.core.management import call_command
+from model_bakery import baker
+from mainapp.loadtest import HISTOGRAM_BOUNDS, InProcessTarget, histogram, load_recording, percentile, replay
+from mainapp.models import Product
+
+
+@pytest.fixture
+def recording(tmp_path):
+    path = tmp_path / 'recording.jsonl'
+    lines = [
+        {'method': 'GET', 'path': '/products/'},
+        {'method': 'GET', 'path': '/products/?unit_price__gt=10'},
+        {'method': 'GET', 'path': '/collections/'},
+        {'title': 'not a request'},
+    ]
+    path.write_text('\n'.join(json.dumps(line) for line in lines))
+    return path
+
+
+class TestLoadTest:
+    def test_load_recording_skips_lines_without_path(self, recording):
+        records, skipped = load_recording(recording)
+
+        assert len(records) == 3
+        assert skipped == 1
+
+    def test_percentile(self):
+        assert percentile(list(range(1, 101)), 50) == 51
+        assert percentile(list(range(1, 101)), 99) == 99
+        assert percentile([], 95) == 0
+
+    def test_histogram_buckets_include_their_bound(self):
+        counts = histogram([0, 5, 5.001, 10, 2500, 10000, 10000.5, 60000])
+
+        assert HISTOGRAM_BOUNDS == (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+        assert counts == [2, 2, 0, 0, 0, 0, 0, 0, 1, 0, 1, 2]
+        assert histogram([]) == [0] * 12
+
+    @pytest.mark.django_db(transaction=True)
+    def test_replay_in_process(self, recording):
+        baker.make(Product, _quantity=3)
+        records, _ = load_recording(recording)
+
+        stats, elapsed = replay(records, InProcessTarget('testserver'),
+                                concurrency=2, repeat=2)
+
+        assert stats['GET products-list'].summary()['requests'] == 4
+        assert stats['GET products-list'].summary()['errors'] == 0
+        assert stats['GET products-list'].summary()['queries'] >= 2
+        assert stats['GET collection-list'].summary()['requests'] == 2
+        assert sum(stats['GET products-list'].summary()['histogram']) == 4
+
+    @pytest.mark.django_db(transaction=True)
+    def test_replay_requests_command(self, recording, capsys):
+        call_command('replay_requests', str(recording), '--host', 'testserver')
+
+        out = capsys.readouterr().out
+        assert 'GET products-list' in out
+        assert '     5     10     25' in out
+        assert out.splitlines()[-1].startswith('GET products-list')
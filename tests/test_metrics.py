@@ -0,0 +1,117 @@
+import json
+import os
+import pytest
+from uuid import uuid4
+from rest_framework import status
+from model_bakery import baker
+from mainapp.metrics import Registry, collect, fold_exited, merge, read_snapshots, registry, render
+from mainapp.models import Cart, CartItem
+
+
+metrics_url = '/metrics'
+
+
+def snapshot(pid, families, exited=False):
+    return {'pid': pid, 'exited': exited, 'metrics': families}
+
+
+class TestRegistry:
+    def test_counter_and_histogram_are_rendered(self):
+        metrics = Registry()
+        requests = metrics.counter('requests_total', 'Requests', ['status'])
+        latency = metrics.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+        requests.inc(status=200)
+        requests.inc(2, status=200)
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+
+        text = render(merge([metrics.snapshot()]))
+
+        assert '# TYPE requests_total counter' in text
+        assert 'requests_total{status="200"} 3' in text
+        assert 'latency_seconds_bucket{le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{le="1"} 2' in text
+        assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+        assert 'latency_seconds_sum 5.55' in text
+        assert 'latency_seconds_count 3' in text
+
+    def test_labels_must_match(self):
+        requests = Registry().counter('requests_total', 'Requests', ['status'])
+
+        with pytest.raises(ValueError):
+            requests.inc(view='x')
+
+    def test_merge_adds_up_counters_and_keeps_gauges_per_running_process(self):
+        counter = {'type': 'counter', 'help': '', 'samples': [[{}, 2]]}
+        gauge = {'type': 'gauge', 'help': '', 'samples': [[{}, 7]]}
+
+        merged = merge([snapshot(1, {'c': counter, 'g': gauge}), snapshot(2, {'c': counter, 'g': gauge}),
+                        snapshot(3, {'c': counter, 'g': gauge}, exited=True)])
+
+        assert merged['c']['samples'] == [({}, 6)]
+        assert sorted(labels['pid'] for labels, _ in merged['g']['samples']) == ['1', '2']
+
+    def test_exited_processes_are_folded(self, tmp_path, settings):
+        settings.METRICS_DIR = str(tmp_path)
+        counter = {'type': 'counter', 'help': '', 'samples': [[{}, 2]]}
+        for pid in (101, 102):
+            (tmp_path / f'metrics-{pid}.json').write_text(
+                json.dumps(snapshot(pid, {'c': counter}, exited=True)))
+
+        fold_exited(str(tmp_path))
+        fold_exited(str(tmp_path))
+
+        assert [name for name, _ in read_snapshots(str(tmp_path))] == ['metrics-exited.json']
+        assert merge([s for _, s in read_snapshots(str(tmp_path))])['c']['samples'] == [({}, 4)]
+
+    def test_collect_includes_this_process(self, tmp_path, settings):
+        settings.METRICS_DIR = str(tmp_path)
+        registry.counter('checkouts_total', 'Checkouts', ['outcome']).inc(outcome='placed')
+
+        families = collect()
+
+        assert os.path.exists(tmp_path / f'metrics-{os.getpid()}.json')
+        assert families['checkouts_total']['samples'] == [({'outcome': 'placed'}, 1)]
+
+
+class TestMetricsEndpoint:
+    @pytest.mark.django_db
+    def test_staff_sees_request_and_checkout_metrics(self, api_client, auth_user, settings):
+        auth_user(is_staff=False)
+        cart = baker.make(Cart, id=uuid4())
+        baker.make(CartItem, cart=cart, _quantity=2)
+        api_client.post('/orders/', {'cart_id': cart.id})
+        auth_user(is_staff=True)
+
+        response = api_client.get(metrics_url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+        text = response.content.decode()
+        assert 'http_requests_total{action="create",status="201",view="OrderViewSet"} 1' in text
+        assert 'checkouts_total{outcome="placed"} 1' in text
+        assert 'db_queries_per_request_count{action="create",view="OrderViewSet"} 1' in text
+
+    @pytest.mark.django_db
+    def test_allowed_ip_needs_no_user(self, api_client, settings):
+        settings.METRICS_ALLOWED_IPS = ['10.0.0.5']
+
+        response = api_client.get(metrics_url, REMOTE_ADDR='10.0.0.5')
+
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.django_db
+    def test_others_get_403(self, api_client, auth_user):
+        auth_user(is_staff=False)
+
+        response = api_client.get(metrics_url)
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    @pytest.mark.django_db
+    def test_local_requests_are_not_allowed_by_default(self, api_client):
+        # what every request looks like behind a reverse proxy on the same host
+        response = api_client.get(metrics_url, REMOTE_ADDR='127.0.0.1')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
@@ -1,8 +1,11 @@
 import pytest
+from datetime import timedelta
 from uuid import uuid4
+from django.core.management import call_command
+from django.utils import timezone
 from rest_framework import status
 from model_bakery import baker
-from mainapp.models import Order, Cart, CartItem, OrderItem
+from mainapp.models import Order, Cart, CartItem, OrderItem, ArchivedOrder, ArchivedOrderItem
 
 
 order_url = '/orders/'
@@ -21,6 +24,18 @@ class TestOrderList:
         assert response.status_code == status.HTTP_200_OK
         assert Order.objects.count() > 0
 
+    @pytest.mark.django_db
+    def test_list_orders_prefetches_order_items(self, api_client, auth_user, django_assert_num_queries):
+        auth_user(is_staff=True)
+        for order in baker.make(Order, _quantity=3):
+            baker.make(OrderItem, order=order, _quantity=2)
+
+        with django_assert_num_queries(2):
+            response = api_client.get(order_url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data[0]['orderitems']) == 2
+
 
 class TestOrderRetrieve:
     @pytest.mark.django_db
@@ -48,14 +63,74 @@ class TestOrderCreate:
     @pytest.mark.django_db
     def test_create_order(self, api_client, auth_user):
         auth_user(is_staff=False)
-        items = baker.make(CartItem, _quantity=3)
-        cart = baker.make(Cart, id=uuid4(), items=items)
+        cart = baker.make(Cart, id=uuid4())
+        cart_items = baker.make(CartItem, cart=cart, _quantity=3)
 
         response = api_client.post(order_url, {'cart_id': cart.id})
 
         assert response.status_code == status.HTTP_201_CREATED
         assert Order.objects.count() > 0
         assert Cart.objects.count() == 0
+        assert sorted(OrderItem.objects.values_list('product_id', 'unit_price')) == \
+            sorted((item.product_id, item.product.unit_price) for item in cart_items)
+
+    @pytest.mark.django_db
+    def test_create_order_query_count(self, api_client, auth_user, django_assert_num_queries):
+        auth_user(is_staff=False)
+        cart = baker.make(Cart, id=uuid4())
+        items = baker.make(CartItem, cart=cart, _quantity=5)
+
+        # customer, savepoint, cart with items and customer check, order, summary insert and
+        # update, order items, outbox, cart delete (select cart, delete its items and it), release
+        with django_assert_num_queries(12):
+            response = api_client.post(order_url, {'cart_id': cart.id})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert sorted(item['product']['id'] for item in response.data['orderitems']) == \
+            sorted(item.product_id for item in items)
+
+    @pytest.mark.django_db
+    def test_create_order_twice_from_one_cart(self, api_client, auth_user):
+        auth_user(is_staff=False)
+        cart = baker.make(Cart, id=uuid4())
+        baker.make(CartItem, cart=cart)
+        api_client.post(order_url, {'cart_id': cart.id})
+
+        response = api_client.post(order_url, {'cart_id': cart.id})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert Order.objects.count() == 1
+
+    @pytest.mark.django_db
+    def test_create_order_with_repeated_idempotency_key(self, api_client, auth_user):
+        auth_user(is_staff=False)
+        cart = baker.make(Cart, id=uuid4())
+        baker.make(CartItem, cart=cart, _quantity=2)
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'checkout-key'}
+
+        first_response = api_client.post(order_url, {'cart_id': cart.id}, **headers)
+        second_response = api_client.post(order_url, {'cart_id': cart.id}, **headers)
+
+        assert first_response.status_code == status.HTTP_201_CREATED
+        assert second_response.status_code == status.HTTP_201_CREATED
+        assert second_response.data['id'] == first_response.data['id']
+        assert second_response['Idempotent-Replayed'] == 'true'
+        assert Order.objects.count() == 1
+
+    @pytest.mark.django_db
+    def test_create_order_idempotency_key_reused_with_other_cart_returns_422(self, api_client, auth_user):
+        auth_user(is_staff=False)
+        carts = baker.make(Cart, _quantity=2)
+        for cart in carts:
+            baker.make(CartItem, cart=cart)
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'checkout-key'}
+        api_client.post(order_url, {'cart_id': carts[0].id}, **headers)
+
+        response = api_client.post(order_url, {'cart_id': carts[1].id}, **headers)
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert Order.objects.count() == 1
+        assert Cart.objects.filter(id=carts[1].id).exists()
 
     @pytest.mark.django_db
     def test_create_order_cart_id_doesnt_exist(self, api_client, auth_user):
@@ -147,4 +222,96 @@ class TestOrderDelete:
         response = api_client.delete(url)
 
         assert response.status_code == status.HTTP_405_METHOD_NOT_ALLOWED
-        assert Order.objects.count() == 1
\ No newline at end of file
+        assert Order.objects.count() == 1
+
+
+class TestOrderBulkUpdateStatus:
+    @pytest.mark.django_db
+    def test_bulk_update_status(self, api_client, auth_user):
+        auth_user(is_staff=True)
+        pending, failed = baker.make(Order, _quantity=2)
+        complete = baker.make(Order, payment_status='C')
+        updates = [
+            {'order_id': pending.id, 'payment_status': 'C'},
+            {'order_id': failed.id, 'payment_status': 'F'},
+            {'order_id': complete.id, 'payment_status': 'C'},
+            {'order_id': 100000, 'payment_status': 'C'},
+            {'order_id': pending.id, 'payment_status': 'X'},
+        ]
+
+        response = api_client.post(f'{order_url}bulk_update_status/',
+                                   {'updates': updates}, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['updated'] == 2
+        assert response.data['unchanged'] == 1
+        assert response.data['missing'] == [100000]
+        assert len(response.data['invalid']) == 1
+        assert Order.objects.filter(payment_status='C').count() == 2
+        assert Order.objects.filter(payment_status='F').count() == 1
+
+    @pytest.mark.django_db
+    def test_bulk_update_status_conflicting_duplicates_are_invalid(self, api_client, auth_user):
+        auth_user(is_staff=True)
+        conflicting, repeated = baker.make(Order, _quantity=2)
+        updates = [
+            {'order_id': conflicting.id, 'payment_status': 'C'},
+            {'order_id': repeated.id, 'payment_status': 'F'},
+            {'order_id': conflicting.id, 'payment_status': 'F'},
+            {'order_id': repeated.id, 'payment_status': 'F'},
+        ]
+
+        response = api_client.post(f'{order_url}bulk_update_status/',
+                                   {'updates': updates}, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['updated'] == 1
+        assert [row['update'] for row in response.data['invalid']] == [updates[0], updates[2]]
+        conflicting.refresh_from_db()
+        repeated.refresh_from_db()
+        assert conflicting.payment_status == 'P'
+        assert repeated.payment_status == 'F'
+
+    @pytest.mark.django_db
+    def test_bulk_update_status_user_is_not_admin_returns_403(self, api_client, auth_user):
+        auth_user(is_staff=False)
+
+        response = api_client.post(f'{order_url}bulk_update_status/',
+                                   {'updates': []}, format='json')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+class TestOrderArchive:
+    @pytest.mark.django_db
+    def test_archived_orders_are_readable_by_staff(self, api_client, auth_user):
+        auth_user(is_staff=True)
+        old_order = baker.make(Order, payment_status='C')
+        baker.make(OrderItem, order=old_order, _quantity=2)
+        Order.objects.filter(pk=old_order.pk).update(
+            placed_at=timezone.now() - timedelta(days=400))
+        new_order = baker.make(Order, payment_status='C')
+
+        call_command('archive_orders', '--months', '12')
+
+        assert list(Order.objects.values_list('id', flat=True)) == [new_order.id]
+        assert ArchivedOrderItem.objects.count() == 2
+
+        response = api_client.get(order_url, {'archived': 'true'})
+        assert [order['id'] for order in response.data] == [old_order.id]
+        assert len(response.data[0]['orderitems']) == 2
+
+        response = api_client.get(f'{order_url}{old_order.id}/')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['id'] == old_order.id
+
+    @pytest.mark.django_db
+    def test_pending_orders_are_not_archived(self):
+        order = baker.make(Order)
+        Order.objects.filter(pk=order.pk).update(
+            placed_at=timezone.now() - timedelta(days=400))
+
+        call_command('archive_orders', '--months', '12')
+
+        assert Order.objects.count() == 1
+        assert ArchivedOrder.objects.count() == 0
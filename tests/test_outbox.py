@@ -0,0 +1,106 @@
+import pytest
+from datetime import timedelta
+from django.utils import timezone
+from model_bakery import baker
+from mainapp import outbox
+from mainapp.models import Cart, CartItem, Customer, OutboxMessage, Product, StockSync
+from mainapp.serializers import CreateOrderSerializer
+from mainapp.tasks import sync_stock
+
+
+@pytest.fixture
+def register_handler(monkeypatch):
+    def do_register_handler(func, event='test_event'):
+        handlers = dict(outbox._handlers)
+        monkeypatch.setattr(outbox, '_handlers', handlers)
+        outbox.handler(event)(func)
+    return do_register_handler
+
+
+class TestOutboxEnqueue:
+    @pytest.mark.django_db
+    def test_checkout_writes_outbox_messages(self):
+        customer = baker.make(Customer)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=2, _quantity=2)
+        serializer = CreateOrderSerializer(
+            data={'cart_id': cart.id}, context={'customer': customer})
+        serializer.is_valid(raise_exception=True)
+
+        order = serializer.save()
+
+        messages = OutboxMessage.objects.filter(event='order_placed')
+        assert messages.count() == 3
+        assert all(message.payload['order_id'] == order.id for message in messages)
+        assert len(messages[0].payload['items']) == 2
+
+
+class TestOutboxWorker:
+    @pytest.mark.django_db
+    def test_process_batch_marks_messages_done(self, register_handler):
+        received = []
+        register_handler(lambda payload: received.append(payload['n']))
+        for n in range(3):
+            outbox.enqueue('test_event', {'n': n})
+
+        processed = outbox.process_batch(max_workers=2)
+
+        assert processed == 3
+        assert sorted(received) == [0, 1, 2]
+        assert OutboxMessage.objects.filter(
+            status=OutboxMessage.STATUS_DONE).count() == 3
+
+    @pytest.mark.django_db
+    def test_failed_message_is_retried_later(self, register_handler):
+        def fail(payload):
+            raise ValueError('test')
+        register_handler(fail)
+        outbox.enqueue('test_event', {})
+
+        outbox.process_batch()
+
+        message = OutboxMessage.objects.get()
+        assert message.status == OutboxMessage.STATUS_PENDING
+        assert message.attempts == 1
+        assert 'ValueError' in message.last_error
+        assert outbox.process_batch() == 0
+
+    @pytest.mark.django_db
+    def test_message_fails_after_max_attempts(self, register_handler, settings):
+        settings.OUTBOX_MAX_ATTEMPTS = 2
+
+        def fail(payload):
+            raise ValueError('test')
+        register_handler(fail)
+        outbox.enqueue('test_event', {})
+
+        for _ in range(2):
+            OutboxMessage.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+            outbox.process_batch()
+
+        message = OutboxMessage.objects.get()
+        assert message.status == OutboxMessage.STATUS_FAILED
+        assert message.attempts == 2
+
+
+class TestOutboxHandlers:
+    @pytest.mark.django_db
+    def test_sync_stock_decrements_inventory(self):
+        product = baker.make(Product, inventory=5)
+
+        sync_stock({'order_id': 1, 'items': [{'product_id': product.id, 'quantity': 2}]})
+
+        product.refresh_from_db()
+        assert product.inventory == 3
+
+    @pytest.mark.django_db
+    def test_sync_stock_skips_redelivered_message(self):
+        product = baker.make(Product, inventory=5)
+        payload = {'order_id': 1, 'items': [{'product_id': product.id, 'quantity': 2}]}
+
+        sync_stock(payload)
+        sync_stock(payload)
+
+        product.refresh_from_db()
+        assert product.inventory == 3
+        assert StockSync.objects.filter(order_id=1).count() == 1
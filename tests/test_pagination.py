@@ -0,0 +1,118 @@
+import pytest
+import time
+from contextlib import contextmanager
+from django.contrib.auth import get_user_model
+from django.test import Client
+from model_bakery import baker
+from mainapp import pagination
+from mainapp.models import Product
+from mainapp.pagination import EstimatedCountPaginator
+
+
+class PostgresStatistics:
+    '''a connection whose pg_class.reltuples of every table is the given estimate'''
+    vendor = 'postgresql'
+
+    def __init__(self, estimate):
+        self.estimate = estimate
+        self.queries = []
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, sql, params):
+        self.queries.append((sql, params))
+
+    def fetchone(self):
+        return (self.estimate,)
+
+
+@pytest.fixture
+def postgres_statistics(monkeypatch):
+    def do_postgres_statistics(estimate):
+        connection = PostgresStatistics(estimate)
+        monkeypatch.setattr(pagination, 'connections', {'default': connection})
+        return connection
+    return do_postgres_statistics
+
+
+@pytest.fixture
+def admin_client():
+    client = Client()
+    client.force_login(baker.make(get_user_model(), is_staff=True, is_superuser=True))
+    return client
+
+
+def paginator(queryset):
+    return EstimatedCountPaginator(queryset.order_by('pk'), 10)
+
+
+class TestEstimatedCountPaginator:
+    @pytest.mark.django_db
+    def test_postgres_estimate_is_the_count_of_large_tables(self, postgres_statistics):
+        connection = postgres_statistics(50000)
+
+        assert paginator(Product.objects.all()).count == 50000
+        assert connection.queries == [
+            ('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', ['mainapp_product'])]
+
+    @pytest.mark.django_db
+    def test_postgres_small_tables_are_counted(self, postgres_statistics):
+        postgres_statistics(100)
+        baker.make(Product, _quantity=3)
+
+        assert paginator(Product.objects.all()).count == 3
+
+    @pytest.mark.django_db
+    def test_unfiltered_count_is_cached_for_60_seconds(self, monkeypatch, django_assert_num_queries):
+        baker.make(Product, _quantity=3)
+        assert paginator(Product.objects.all()).count == 3
+        baker.make(Product)
+
+        with django_assert_num_queries(0):
+            assert paginator(Product.objects.all()).count == 3
+
+        now = time.time()
+        monkeypatch.setattr(time, 'time', lambda: now + 61)
+        assert paginator(Product.objects.all()).count == 4
+
+    @pytest.mark.django_db
+    def test_filtered_count_is_exact(self, postgres_statistics):
+        connection = postgres_statistics(50000)
+        baker.make(Product, title='chair', _quantity=2)
+        baker.make(Product, title='table')
+
+        assert paginator(Product.objects.filter(title='chair')).count == 2
+        assert connection.queries == []
+
+    @pytest.mark.django_db
+    def test_filtered_count_is_not_cached(self):
+        baker.make(Product, title='chair', _quantity=2)
+        assert paginator(Product.objects.all()).count == 2
+        baker.make(Product, title='chair')
+
+        assert paginator(Product.objects.filter(title='chair')).count == 3
+
+
+class TestAdminChangelist:
+    @pytest.mark.django_db
+    def test_unfiltered_changelist_uses_the_cached_count(self, admin_client):
+        baker.make(Product, _quantity=3)
+        assert admin_client.get('/admin/mainapp/product/').context['cl'].result_count == 3
+        baker.make(Product)
+
+        response = admin_client.get('/admin/mainapp/product/')
+
+        assert response.context['cl'].result_count == 3
+
+    @pytest.mark.django_db
+    def test_searched_changelist_counts_exactly(self, admin_client):
+        baker.make(Product, title='chair', _quantity=2)
+        baker.make(Product, title='table')
+        admin_client.get('/admin/mainapp/product/')
+        baker.make(Product, title='chair')
+
+        response = admin_client.get('/admin/mainapp/product/', {'q': 'chair'})
+
+        assert response.context['cl'].result_count == 3
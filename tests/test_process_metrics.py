@@ -0,0 +1,85 @@
+import os
+import runpy
+import subprocess
+import sys
+import pytest
+from types import SimpleNamespace
+from django.conf import settings
+from mainapp.process_metrics import WorkerMetrics, memory_usage, read_worker_metrics
+
+
+gunicorn_conf = os.path.join(settings.BASE_DIR, 'gunicorn.conf.py')
+
+
+class TestWorkerMetrics:
+    def test_memory_usage(self):
+        usage = memory_usage()
+
+        assert usage.get('rss', usage.get('max_rss')) > 0
+
+    def test_requests_are_flushed_at_most_once_per_interval(self, tmp_path):
+        now = [0.0]
+        metrics = WorkerMetrics(tmp_path, pid=1, flush_interval=1.0, clock=lambda: now[0])
+
+        metrics.request_finished(0.2, 200)
+        metrics.request_finished(0.4, 500)
+        assert [worker['requests'] for worker in read_worker_metrics(tmp_path)] == [1]
+
+        now[0] = 1.5
+        metrics.request_finished(0.1, 200)
+        [worker] = read_worker_metrics(tmp_path)
+        assert worker['requests'] == 3
+        assert worker['errors'] == 1
+        assert worker['max_request_seconds'] == 0.4
+
+    def test_removed_workers_are_not_read(self, tmp_path):
+        metrics = WorkerMetrics(tmp_path, pid=1)
+        WorkerMetrics(tmp_path, pid=os.getpid()).flush()
+        metrics.flush()
+
+        metrics.remove()
+
+        assert [worker['pid'] for worker in read_worker_metrics(tmp_path)] == [os.getpid()]
+        assert read_worker_metrics(tmp_path / 'missing') == []
+
+    def test_files_of_killed_workers_are_removed(self, tmp_path):
+        child = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                               capture_output=True, text=True)
+        WorkerMetrics(tmp_path, pid=int(child.stdout)).flush()
+        WorkerMetrics(tmp_path, pid=os.getpid()).flush()
+
+        assert [worker['pid'] for worker in read_worker_metrics(tmp_path)] == [os.getpid()]
+        assert sorted(os.listdir(tmp_path)) == [f'worker-{os.getpid()}.json']
+
+
+class TestGunicornConf:
+    @pytest.mark.parametrize('profile, worker_class, app', [
+        ('sync', 'sync', 'online_shop.wsgi:application'),
+        ('gthread', 'gthread', 'online_shop.wsgi:application'),
+        ('uvicorn', 'uvicorn.workers.UvicornWorker', 'online_shop.asgi:application'),
+    ])
+    def test_profiles(self, monkeypatch, profile, worker_class, app):
+        monkeypatch.setenv('GUNICORN_PROFILE', profile)
+        monkeypatch.setenv('GUNICORN_MAX_REQUESTS', '500')
+
+        conf = runpy.run_path(gunicorn_conf)
+
+        assert conf['worker_class'] == worker_class
+        assert conf['wsgi_app'] == app
+        assert conf['preload_app'] is True
+        assert (conf['max_requests'], conf['max_requests_jitter']) == (500, 50)
+
+    def test_unknown_profile(self, monkeypatch):
+        monkeypatch.setenv('GUNICORN_PROFILE', 'gevent')
+
+        with pytest.raises(RuntimeError):
+            runpy.run_path(gunicorn_conf)
+
+    def test_child_exit_removes_the_worker_file(self, monkeypatch, tmp_path):
+        monkeypatch.setenv('GUNICORN_METRICS_DIR', str(tmp_path))
+        conf = runpy.run_path(gunicorn_conf)
+        WorkerMetrics(tmp_path, pid=4242).flush()
+
+        conf['child_exit'](None, SimpleNamespace(pid=4242))
+
+        assert os.listdir(tmp_path) == []
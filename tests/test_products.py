@@ -1,7 +1,9 @@
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from model_bakery import baker
-from mainapp.models import Product, OrderItem
+from mainapp.models import Collection, Product, OrderItem
 
 
 product_url = '/products/'
@@ -20,6 +22,24 @@ class TestProductList:
         assert response.status_code == status.HTTP_200_OK
         assert Product.objects.count() > 0
 
+    @pytest.mark.django_db
+    def test_list_products_with_sparse_fields(self, api_client):
+        baker.make(Product, description='test')
+
+        with CaptureQueriesContext(connection) as context:
+            response = api_client.get(product_url, {'fields': 'id,title'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert set(response.data['results'][0]) == {'id', 'title'}
+        assert not any('description' in query['sql']
+                       for query in context.captured_queries)
+
+    @pytest.mark.django_db
+    def test_list_products_with_unknown_field_returns_400(self, api_client):
+        response = api_client.get(product_url, {'fields': 'id,test'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
 
 class TestProductRetrieve:
     @pytest.mark.django_db
@@ -94,6 +114,52 @@ class TestProductCreate:
         assert response.status_code == status.HTTP_403_FORBIDDEN
 
 
+class TestProductFacets:
+
+    @pytest.mark.django_db
+    def test_facets(self, api_client, django_assert_num_queries):
+        first, second = baker.make(Collection, _quantity=2)
+        baker.make(Product, title='red chair', unit_price=5, inventory=1, collection=first)
+        baker.make(Product, title='red table', unit_price=70, inventory=1, collection=second, _quantity=2)
+        baker.make(Product, title='blue chair', unit_price=2000, collection=second)
+        baker.make(Product, title='red lamp', unit_price=70, inventory=0, collection=first)
+
+        with django_assert_num_queries(1):
+            response = api_client.get(product_url + 'facets/', {'search': 'Red', 'in_stock': 'true'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 3
+        assert response.data['collections'] == [{'id': second.id, 'count': 2},
+                                                {'id': first.id, 'count': 1}]
+        assert [bucket['count'] for bucket in response.data['prices']] == [1, 0, 2, 0, 0, 0]
+        assert response.data['prices'][0] == {'min': None, 'max': '10.00', 'count': 1}
+        assert response.data['prices'][-1]['max'] is None
+
+    @pytest.mark.django_db
+    def test_facets_are_cached_by_normalized_query(self, api_client, django_assert_num_queries,
+                                                   django_capture_on_commit_callbacks):
+        collections = baker.make(Collection, _quantity=2)
+        baker.make(Product, title='chair', collection=collections[0])
+        ids = [collection.id for collection in collections]
+        api_client.get(product_url + 'facets/', {'search': 'chair', 'collection_id__in': f'{ids[0]},{ids[1]}'})
+
+        with django_assert_num_queries(0):
+            response = api_client.get(product_url + 'facets/', {
+                'collection_id__in': f'{ids[1]},{ids[0]}', 'search': ' CHAIR ', 'ordering': 'unit_price'})
+        assert response.data['count'] == 1
+
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make(Product, title='chair', collection=collections[1])
+        response = api_client.get(product_url + 'facets/', {'search': 'chair', 'collection_id__in': f'{ids[0]},{ids[1]}'})
+        assert response.data['count'] == 2
+
+    @pytest.mark.django_db
+    def test_facets_with_invalid_filter_returns_400(self, api_client):
+        response = api_client.get(product_url + 'facets/', {'unit_price__gt': 'test'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
 class TestProductUpdate:
     @pytest.mark.django_db
     def test_update_product(self, api_client, auth_user):
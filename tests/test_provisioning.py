@@ -0,0 +1,73 @@
+import json
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password
+from django.core.management import call_command
+from django.db import IntegrityError
+from mainapp.models import Customer
+from mainapp.provisioning import provision_customer, provision_customers
+
+
+@pytest.fixture(autouse=True)
+def cheap_hasher(settings):
+    settings.PASSWORD_HASHER_ITERATIONS = 1000
+
+
+def account(number, **fields):
+    return {'email': f'customer{number}@Example.com', 'password': 'secret', 'first_name': 'Name',
+            'last_name': f'Surname{number}', 'phone': '+7 900 000-00-00', 'street': 'Street',
+            'house': '1', 'flat': str(number), **fields}
+
+
+class TestProvisionCustomer:
+    @pytest.mark.django_db
+    def test_creates_customer_with_user(self):
+        fields = account(1)
+        customer = provision_customer(fields.pop('email'), fields.pop('password'), **fields)
+
+        assert customer.user.email == customer.email == 'customer1@example.com'
+        assert customer.user.password.startswith('pbkdf2_sha256$1000$')
+        assert customer.user.check_password('secret')
+        assert customer.search_phone == '79000000000'
+
+    @pytest.mark.django_db
+    def test_user_without_password_cannot_log_in(self):
+        user = get_user_model().objects.create_user('user@example.com', None)
+
+        assert not user.has_usable_password()
+
+    @pytest.mark.django_db
+    def test_duplicate_email_creates_nothing(self):
+        fields = account(1)
+        provision_customer(fields.pop('email'), **fields)
+
+        with pytest.raises(IntegrityError):
+            provision_customer('customer1@example.com', **fields)
+        assert Customer.objects.count() == 1
+
+
+class TestProvisionCustomers:
+    @pytest.mark.django_db
+    def test_bulk_creates_users_and_customers(self, django_assert_num_queries):
+        accounts = [account(number) for number in range(5)] + [account(5, password=None)]
+
+        # two batches of two inserts, in a savepoint
+        with django_assert_num_queries(6):
+            customers = provision_customers(accounts, batch_size=3)
+
+        assert len(customers) == 6
+        assert Customer.objects.filter(user__isnull=False).count() == 6
+        customer = Customer.objects.select_related('user').get(last_name='Surname4')
+        assert customer.search_last_name == 'surname4'
+        assert check_password('secret', customer.user.password)
+        assert not Customer.objects.get(last_name='Surname5').user.has_usable_password()
+
+    @pytest.mark.django_db
+    def test_import_customers_command(self, tmp_path, capsys):
+        path = tmp_path / 'customers.jsonl'
+        path.write_text('\n'.join(json.dumps(account(number)) for number in range(3)))
+
+        call_command('import_customers', str(path))
+
+        assert Customer.objects.count() == 3
+        assert 'Imported 3 customers' in capsys.readouterr().out
@@ -0,0 +1,126 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from io import StringIO
+from uuid import uuid4
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from model_bakery import baker
+from mainapp.models import Cart, CartItem, Product
+from mainapp.query_stats import fingerprint, fold_exited, normalize, query_stats, read_snapshots
+
+
+def entry_for(prefix, part=''):
+    return next(entry for entry in query_stats.snapshot()['queries'].values()
+                if entry['sql'].startswith(prefix) and part in entry['sql'])
+
+
+class TestFingerprint:
+    def test_literals_and_lists_are_replaced(self):
+        assert normalize("SELECT * FROM t WHERE a = 'it''s' AND b = 15 AND c IN (%s, %s, %s)") == \
+            'SELECT * FROM t WHERE a = ? AND b = ? AND c IN (...)'
+        assert normalize('INSERT INTO "t2" ("a") VALUES (%s), (%s),\n (%s)') == 'INSERT INTO "t2" ("a") VALUES (...)'
+
+    def test_same_query_with_other_values_has_one_fingerprint(self):
+        assert fingerprint('SELECT 1 FROM t WHERE id IN (1, 2)')[0] == \
+            fingerprint('SELECT 1 FROM t WHERE id IN (3, 4, 5)')[0]
+
+
+class TestQueryStats:
+    @pytest.mark.django_db
+    def test_queries_are_counted_per_fingerprint(self):
+        baker.make(Product, _quantity=2)
+        query_stats.reset()
+
+        for product in Product.objects.all():
+            Product.objects.filter(pk=product.pk).first()
+
+        entry = entry_for('SELECT "mainapp_product"."id"', 'WHERE "mainapp_product"."id" = ?')
+        assert entry['count'] == 2
+        assert entry['slow'] == 0
+        assert entry['plan'] is None
+        # not run by a view, a serializer or mainapp code
+        assert entry['origins'] == {'unknown': 0}
+
+    @pytest.mark.django_db
+    def test_slow_queries_are_traced_and_explained(self, api_client, auth_user, settings):
+        settings.SLOW_QUERY_THRESHOLD = 0
+        auth_user(is_staff=False)
+        cart = baker.make(Cart, id=uuid4())
+        baker.make(CartItem, cart=cart, _quantity=2)
+
+        api_client.post('/orders/', {'cart_id': cart.id})
+
+        entry = entry_for('SELECT "mainapp_cartitem"."product_id"')
+        assert entry['slow'] == 1
+        assert entry['origins'] == {'CreateOrderSerializer.load_cart': 1}
+        assert entry['plan'] and any('mainapp_cart' in line for line in entry['plan'])
+        assert entry_for('INSERT INTO "mainapp_order"')['plan'] is None
+
+    @pytest.mark.django_db
+    def test_explain_is_not_counted_as_a_query(self, settings, django_assert_num_queries):
+        settings.SLOW_QUERY_THRESHOLD = 0
+
+        with django_assert_num_queries(1):
+            Product.objects.count()
+
+        assert entry_for('SELECT COUNT(*)')['plan']
+
+    @pytest.mark.django_db
+    def test_none_threshold_turns_it_off(self, settings):
+        settings.SLOW_QUERY_THRESHOLD = None
+
+        Product.objects.count()
+
+        assert query_stats.snapshot()['queries'] == {}
+        assert query_stats.record in connection.execute_wrappers
+
+
+class TestTopQueriesCommand:
+    @pytest.mark.django_db
+    def test_prints_the_top_fingerprints(self, tmp_path, settings):
+        settings.METRICS_DIR = str(tmp_path)
+        settings.SLOW_QUERY_THRESHOLD = 0
+        Product.objects.count()
+        query_stats.flush()
+        out = StringIO()
+
+        call_command('top_queries', '--plans', stdout=out)
+
+        assert 'SELECT COUNT(*) AS "__count" FROM "mainapp_product"' in out.getvalue()
+        assert '    | ' in out.getvalue()
+
+    def test_exited_processes_are_folded(self, tmp_path, settings):
+        settings.METRICS_DIR = str(tmp_path)
+        child = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                               capture_output=True, text=True)
+        entry = {'sql': 'SELECT ?', 'count': 2, 'seconds': 0.5, 'max_seconds': 0.25,
+                 'slow': 1, 'origins': {'ProductViewSet.list': 1}, 'plan': None}
+        # one marked by worker_exit, one killed before it could
+        for pid, exited in ((101, True), (int(child.stdout), False)):
+            (tmp_path / f'queries-{pid}.json').write_text(
+                json.dumps({'pid': pid, 'exited': exited, 'dropped': 1, 'queries': {'abc': entry}}))
+        query_stats.flush()
+
+        fold_exited(str(tmp_path))
+        fold_exited(str(tmp_path))
+
+        snapshots = dict(read_snapshots(str(tmp_path)))
+        assert sorted(snapshots) == sorted(['queries-exited.json', f'queries-{os.getpid()}.json'])
+        folded = snapshots['queries-exited.json']
+        assert (folded['processes'], folded['dropped']) == (2, 2)
+        assert folded['queries']['abc']['count'] == 4
+        assert folded['queries']['abc']['origins'] == {'ProductViewSet.list': 2}
+
+        out = StringIO()
+        call_command('top_queries', stdout=out)
+        assert out.getvalue().startswith('3 processes')
+
+    def test_without_statistics_fails(self, tmp_path, settings):
+        settings.METRICS_DIR = str(tmp_path)
+
+        with pytest.raises(CommandError):
+            call_command('top_queries')
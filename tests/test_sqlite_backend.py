@@ -0,0 +1,44 @@
+import pytest
+from django.db import connections, transaction
+from django.test.utils import CaptureQueriesContext
+from mainapp.sqlite_benchmark import PROFILES, add_database, create_table, remove_database, run_profile
+
+
+@pytest.fixture
+def tuned_database(tmp_path, django_db_blocker):
+    with django_db_blocker.unblock():
+        yield add_database('tuned', PROFILES['tuned'], str(tmp_path / 'tuned.sqlite3'),
+                           {'pragmas': {'busy_timeout': 1000}})
+        remove_database('tuned')
+
+
+class TestTunedSqlite:
+    def test_pragmas_are_set_on_connect(self, tuned_database):
+        with tuned_database.cursor() as cursor:
+            pragmas = {name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                       for name in ('journal_mode', 'synchronous', 'busy_timeout', 'foreign_keys')}
+
+        # synchronous NORMAL is 1
+        assert pragmas == {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 1000, 'foreign_keys': 1}
+
+    def test_transactions_begin_immediate(self, tuned_database):
+        create_table('tuned', 10)
+
+        with CaptureQueriesContext(tuned_database) as context:
+            with transaction.atomic(using='tuned'):
+                with tuned_database.cursor() as cursor:
+                    cursor.execute('UPDATE benchmark_item SET value = 1 WHERE id = 1')
+
+        assert context.captured_queries[0]['sql'] == 'BEGIN IMMEDIATE'
+
+    def test_benchmark_profiles(self, django_db_blocker):
+        with django_db_blocker.unblock():
+            results = {profile: run_profile(engine, readers=2, writers=2, duration=0.2, rows=100)
+                       for profile, engine in PROFILES.items()}
+
+        assert results['default']['journal_mode'] == 'delete'
+        assert results['tuned']['journal_mode'] == 'wal'
+        assert results['tuned']['writes']['errors'] == 0
+        assert all(result['reads']['per_second'] > 0 and result['writes']['per_second'] > 0
+                   for result in results.values())
+        assert 'sqlite_benchmark' not in ''.join(connections.settings)
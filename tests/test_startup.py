@@ -0,0 +1,18 @@
+from django.urls import get_resolver
+from mainapp.startup_benchmark import measure
+from mainapp.warmup import warm_up
+
+
+class TestStartup:
+    def test_warm_up_makes_no_queries(self):
+        # pytest-django blocks database access outside of django_db tests
+        warm_up()
+
+        assert get_resolver().reverse_dict
+
+    def test_production_profile_starts(self):
+        result = measure('online_shop.settings_production', '/auth/token/', runs=1,
+                         env={'DJANGO_SECRET_KEY': 'test', 'REDIS_URL': 'redis://localhost:6379/0'})
+
+        assert result['ready'] > 0
+        assert result['statuses'] == [403]
@@ -0,0 +1,100 @@
+import pytest
+from uuid import uuid4
+from django.db import IntegrityError, OperationalError, transaction
+from rest_framework import status
+from model_bakery import baker
+from mainapp.models import Cart, CartItem, Order, Product
+from mainapp.serializers import CreateOrderSerializer
+from mainapp.transactions import conflict_kind, retry_metrics, run_in_transaction
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(settings):
+    settings.TRANSACTION_RETRY_BASE_DELAY = 0
+    settings.TRANSACTION_MAX_ATTEMPTS = 3
+
+
+class Failing:
+    '''raises the given errors on the first calls, then returns the value'''
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'done'
+
+
+class TestRunInTransaction:
+    def test_conflict_kind(self):
+        assert conflict_kind(OperationalError('deadlock detected')) == 'deadlock'
+        assert conflict_kind(OperationalError('database is locked')) == 'locked'
+        assert conflict_kind(OperationalError('could not serialize access')) == 'serialization'
+        assert conflict_kind(OperationalError('no such table')) is None
+        assert conflict_kind(ValueError('deadlock')) is None
+
+    @pytest.mark.django_db(transaction=True)
+    def test_conflicts_are_retried(self):
+        func = Failing(OperationalError('database is locked'), OperationalError('deadlock detected'))
+
+        assert run_in_transaction('test', func) == 'done'
+
+        assert func.calls == 3
+        assert retry_metrics.snapshot()['test'] == {
+            'transactions': 1, 'retries': {'locked': 1, 'deadlock': 1}, 'exhausted': 0}
+
+    @pytest.mark.django_db(transaction=True)
+    def test_last_error_is_raised_after_max_attempts(self):
+        func = Failing(*[OperationalError('database is locked')] * 3)
+
+        with pytest.raises(OperationalError):
+            run_in_transaction('test', func)
+
+        assert func.calls == 3
+        assert retry_metrics.snapshot()['test']['exhausted'] == 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_other_errors_are_not_retried(self):
+        func = Failing(OperationalError('no such table'))
+
+        with pytest.raises(OperationalError):
+            run_in_transaction('test', func)
+        with pytest.raises(IntegrityError):
+            run_in_transaction('test', Failing(IntegrityError()))
+        assert run_in_transaction('test', Failing(IntegrityError()), retry_on=(IntegrityError,)) == 'done'
+
+        assert func.calls == 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_nested_transaction_is_not_retried(self):
+        func = Failing(OperationalError('database is locked'))
+
+        with pytest.raises(OperationalError):
+            with transaction.atomic():
+                run_in_transaction('test', func)
+
+        assert func.calls == 1
+        assert 'test' not in retry_metrics.snapshot()
+
+    @pytest.mark.django_db(transaction=True)
+    def test_checkout_is_retried(self, api_client, auth_user, monkeypatch):
+        auth_user(is_staff=False)
+        cart = baker.make(Cart, id=uuid4())
+        baker.make(CartItem, cart=cart, product=baker.make(Product, inventory=10))
+        load_cart = CreateOrderSerializer.load_cart
+        errors = [OperationalError('database is locked')]
+
+        def locked_once(self, *args):
+            if errors:
+                raise errors.pop()
+            return load_cart(self, *args)
+        monkeypatch.setattr(CreateOrderSerializer, 'load_cart', locked_once)
+
+        response = api_client.post('/orders/', {'cart_id': cart.id})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert Order.objects.count() == 1
+        assert retry_metrics.snapshot()['checkout']['retries'] == {'locked': 1}